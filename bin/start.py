@@ -8,6 +8,7 @@ import sys
 import os
 from paste.deploy import loadapp, loadserver
 import logging
+import argparse
 
 if __name__ == '__main__':
     logging.basicConfig(
@@ -19,6 +20,14 @@ if __name__ == '__main__':
     CONFDIR = os.path.join(PARDIR, 'reporting_api', 'conf')
     PASTE_CONFIG = os.path.join(CONFDIR, 'paste.config')
     sys.path.insert(0, PARDIR)
-    REPORTING_APP = loadapp('config:' + PASTE_CONFIG)
-    SERVER = loadserver('config:' + PASTE_CONFIG)
-    SERVER(REPORTING_APP)
+    from reporting_api.common import prefork
+    PARSER = argparse.ArgumentParser()
+    prefork.add_arguments(PARSER)
+    ARGS = PARSER.parse_args()
+    if ARGS.workers:
+        # Each worker process loads the application itself
+        prefork.paste_server('config:' + PASTE_CONFIG, ARGS).serve_forever()
+    else:
+        REPORTING_APP = loadapp('config:' + PASTE_CONFIG)
+        SERVER = loadserver('config:' + PASTE_CONFIG)
+        SERVER(REPORTING_APP)
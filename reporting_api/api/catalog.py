@@ -0,0 +1,311 @@
+"""
+A catalog of the available reports, refreshed in the background.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from unittest import main as test_main, TestCase
+from reporting_api.api.dbqueries import DBQueries
+
+
+class ReportCatalog(object):
+
+    """
+    Holds the name, comment, last update time and column names of every
+    report table, refreshing them from the database in a background thread
+    every refresh_interval seconds, so that requests can be answered
+    without querying the database for them.
+    If a refresh fails, the previous snapshot continues to be served
+    until a later refresh succeeds.
+    Until the first refresh succeeds, no snapshot is available,
+    and callers must query the database themselves.
+    The queries are made through the given class, by default DBQueries.
+    """
+
+    def __init__(self, pool, dbname, refresh_interval, queries=DBQueries):
+        self.pool = pool
+        self.dbname = dbname
+        self.refresh_interval = refresh_interval
+        self.queries = queries
+        # An OrderedDict mapping table names to
+        # (comment, last update, column names) tuples,
+        # which is replaced rather than modified on each refresh
+        self.snapshot = None
+        self.refreshed = None
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.pid = None
+
+    def ensure_started(self):
+        """
+        Start the background refresh thread, unless it is already running
+        in this process. Threads do not survive a fork, so this is checked
+        on use rather than done once at construction.
+        """
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.stopping.clear()
+            self.thread = threading.Thread(
+                target=self._run, name='report-catalog'
+            )
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        """
+        Ask the background refresh thread to exit.
+        """
+        self.stopping.set()
+
+    def _run(self):
+        """
+        Refresh the catalog immediately, then every refresh_interval seconds
+        until asked to stop.
+        """
+        while not self.stopping.is_set():
+            self.refresh()
+            self.stopping.wait(self.refresh_interval)
+
+    def refresh(self):
+        """
+        Replace the snapshot with the current details of every table.
+        On failure, log the error and keep the previous snapshot.
+        """
+        try:
+            dbconn = self.pool.acquire()
+            try:
+                tables = self.queries.get_tables_details(
+                    dbconn, self.dbname
+                )
+                columns = dict()
+                for (table_name, column) in (
+                    self.queries.get_all_tables_columns(dbconn, self.dbname)
+                ):
+                    columns.setdefault(table_name, []).append(column)
+            finally:
+                self.pool.release(dbconn)
+        # Pylint warns about catch-all exception handlers like that below,
+        # but whatever went wrong, the stale snapshot remains usable.
+        # pylint: disable=W0702
+        except:
+            self.failures += 1
+            logging.exception("Failed to refresh the report catalog")
+            return
+        self.snapshot = OrderedDict(
+            (name, (comment, last_update, columns.get(name, [])))
+            for (name, comment, last_update) in tables
+        )
+        self.refreshed = time.time()
+
+    def tables(self):
+        """
+        Return a list of (table name, comment, last update time) tuples,
+        or None if no snapshot is available.
+        """
+        self.ensure_started()
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        return [
+            (name, comment, last_update)
+            for (name, (comment, last_update, _)) in snapshot.iteritems()
+        ]
+
+    def last_update(self, table_name):
+        """
+        Return the last update time of the given table,
+        or None if it is not known.
+        """
+        self.ensure_started()
+        snapshot = self.snapshot
+        if snapshot is None or table_name not in snapshot:
+            return None
+        return snapshot[table_name][1]
+
+    def columns(self, table_name):
+        """
+        Return a list of the names of the given table's columns, in order,
+        or None if they are not known.
+        """
+        self.ensure_started()
+        snapshot = self.snapshot
+        if snapshot is None or table_name not in snapshot:
+            return None
+        return snapshot[table_name][2]
+
+    def stats(self):
+        """
+        Return a dictionary of statistics describing this catalog.
+        """
+        snapshot = self.snapshot
+        return dict(
+            tables=None if snapshot is None else len(snapshot),
+            refreshed=self.refreshed,
+            failures=self.failures
+        )
+
+
+class FakePool(object):
+
+    """
+    A stand-in for a connection pool, counting connections in use.
+    """
+
+    def __init__(self):
+        self.in_use = 0
+
+    def acquire(self):
+        """
+        Return a placeholder connection.
+        """
+        self.in_use += 1
+        return object()
+
+    def release(self, dbconn):
+        """
+        Take back a placeholder connection.
+        """
+        # pylint: disable=W0613
+        self.in_use -= 1
+
+
+class FakeQueries(object):
+
+    """
+    A stand-in for DBQueries, answering the catalog's queries from
+    the given tables and columns, or failing once told to.
+    """
+
+    def __init__(self, tables, columns):
+        self.tables = tables
+        self.columns = columns
+        self.fail = False
+        self.called = threading.Event()
+
+    def get_tables_details(self, dbconn, dbname):
+        """
+        Return the tables, or raise an error if told to fail.
+        """
+        # pylint: disable=W0613
+        self.called.set()
+        if self.fail:
+            raise RuntimeError("The database is unavailable")
+        return self.tables
+
+    def get_all_tables_columns(self, dbconn, dbname):
+        """
+        Return the columns of all tables.
+        """
+        # pylint: disable=W0613
+        return self.columns
+
+
+class ReportCatalogTestCase(TestCase):
+
+    """
+    Unit tests for the report catalog, using stubbed queries.
+    """
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    def setUp(self):
+        # Silence the errors logged by failing refreshes
+        logging.disable(logging.CRITICAL)
+        self.pool = FakePool()
+        self.queries = FakeQueries(
+            [('usage', 'Usage', 100), ('empty', 'Empty', 200)],
+            [('usage', 'id'), ('usage', 'bytes')]
+        )
+        self.catalog = ReportCatalog(
+            self.pool, 'reporting', 3600, queries=self.queries
+        )
+        # Refresh synchronously unless a test starts the thread itself
+        self.catalog.pid = os.getpid()
+
+    def tearDown(self):
+        self.catalog.stop()
+        logging.disable(logging.NOTSET)
+
+    def testCold(self):
+        """
+        Test that nothing is known until a refresh has succeeded.
+        """
+        self.queries.fail = True
+        self.catalog.refresh()
+        self.assertIsNone(self.catalog.tables())
+        self.assertIsNone(self.catalog.last_update('usage'))
+        self.assertIsNone(self.catalog.columns('usage'))
+        self.assertEqual(
+            self.catalog.stats(),
+            dict(tables=None, refreshed=None, failures=1)
+        )
+        self.assertEqual(self.pool.in_use, 0)
+
+    def testRefresh(self):
+        """
+        Test that a refresh makes every table's details known.
+        """
+        self.catalog.refresh()
+        self.assertEqual(
+            self.catalog.tables(),
+            [('usage', 'Usage', 100), ('empty', 'Empty', 200)]
+        )
+        self.assertEqual(self.catalog.last_update('empty'), 200)
+        self.assertEqual(self.catalog.columns('usage'), ['id', 'bytes'])
+        self.assertEqual(self.catalog.columns('empty'), [])
+        self.assertIsNone(self.catalog.columns('missing'))
+        self.assertEqual(self.catalog.stats()['tables'], 2)
+
+    def testStaleOnFailure(self):
+        """
+        Test that the previous snapshot is kept when a refresh fails.
+        """
+        self.catalog.refresh()
+        refreshed = self.catalog.refreshed
+        self.queries.fail = True
+        self.queries.tables = [('new', 'New', 300)]
+        self.catalog.refresh()
+        self.assertEqual(len(self.catalog.tables()), 2)
+        self.assertEqual(self.catalog.last_update('usage'), 100)
+        self.assertEqual(self.catalog.stats()['failures'], 1)
+        self.assertEqual(self.catalog.refreshed, refreshed)
+        self.assertEqual(self.pool.in_use, 0)
+
+    def testLazyStart(self):
+        """
+        Test that the refresh thread is started on first use in each
+        process, as after a fork, and not again in the same process.
+        """
+        catalog = self.catalog
+        catalog.pid = None
+        self.assertIsNone(catalog.thread)
+        catalog.tables()
+        thread = catalog.thread
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(catalog.pid, os.getpid())
+        self.assertTrue(self.queries.called.wait(10))
+        catalog.last_update('usage')
+        self.assertIs(catalog.thread, thread)
+        # A parent's thread does not survive a fork into this process
+        catalog.pid = -1
+        catalog.columns('usage')
+        self.assertIsNot(catalog.thread, thread)
+        catalog.stop()
+        for thread in (thread, catalog.thread):
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+
+
+if __name__ == '__main__':
+    test_main()
@@ -4,7 +4,8 @@ gathering all SQL into one place.
 """
 
 from datetime import datetime, tzinfo, timedelta
-from reporting_api.common.dbconn import ResultSet, ResultSetSlice
+from unittest import main as test_main, TestCase
+from reporting_api.common.dbconn import RecordSet, ResultSet, ResultSetSlice
 
 
 class UTC(tzinfo):
@@ -29,6 +30,20 @@ class UTC(tzinfo):
         return "UTC"
 
 
+def as_utc(last_update):
+    """
+    Mark the given naive last update time as being in UTC.
+    A missing time (None) is taken to be the start of the UNIX epoch.
+    """
+    if last_update is None:
+        """
+        Despite the name, utcfromtimestamp returns a 'naive'
+        datetime lacking any timezone, UTC or otherwise.
+        """
+        last_update = datetime.utcfromtimestamp(0)
+    return last_update.replace(tzinfo=UTC())
+
+
 class DBQueries(object):
 
     """
@@ -40,6 +55,35 @@ class DBQueries(object):
     METADATA_LAST_UPDATE_COLUMN = 'last_update'
     METADATA_TABLE_NAME_COLUMN = 'table_name'
 
+    # Filter operators, which are appended to column names in query
+    # arguments after FILTER_SEPARATOR, with their SQL comparison operators.
+    # A column name without an operator is compared for equality.
+    FILTER_SEPARATOR = '__'
+    FILTER_OPERATORS = dict(
+        eq='=',
+        ne='<>',
+        lt='<',
+        lte='<=',
+        gt='>',
+        gte='>=',
+        prefix='LIKE'
+    )
+
+    # Aggregate functions which may be applied to columns by aggregate_table
+    AGGREGATE_FUNCTIONS = (
+        'count', 'sum', 'avg', 'min', 'max', 'first', 'last'
+    )
+
+    # Aggregate functions which need a column ordering the results
+    ORDERED_AGGREGATE_FUNCTIONS = ('first', 'last')
+
+    # The length in bytes to which GROUP_CONCAT results are limited
+    # by queries computing the 'first' and 'last' aggregate functions
+    GROUP_CONCAT_MAX_LEN = 1024 * 1024
+
+    # The name of the result column holding the start of each time bucket
+    BUCKET_COLUMN = 'bucket'
+
     @classmethod
     def get_tables_comments(cls, dbconn, dbname, table_names):
         """
@@ -95,12 +139,116 @@ class DBQueries(object):
         try:
             row = iter(rows).next()
         except StopIteration:
-            """
-            Despite the name, utcfromtimestamp returns a 'naive'
-            datetime lacking any timezone, UTC or otherwise.
-            """
-            row = datetime.utcfromtimestamp(0)
-        return row.replace(tzinfo=UTC())
+            row = None
+        return as_utc(row)
+
+    @classmethod
+    def get_all_tables_comments(cls, dbconn, dbname):
+        """
+        Return an iterator over (table name, SQL92 table comment) rows
+        for every table in the given database, ordered by table name.
+        """
+        query = """
+        SELECT
+            table_name,
+            table_comment
+        FROM
+            information_schema.tables
+        WHERE
+            table_schema=%s
+        ORDER BY
+            table_name;
+        """
+        cursor = dbconn.execute(query, False, [dbname])
+        return ResultSet(cursor)
+
+    @classmethod
+    def get_all_tables_lastupdates(cls, dbconn):
+        """
+        Return an iterator over (table name, last update time) rows
+        for every table listed in the optional 'metadata' table.
+        FIXME: Remove this knowledge about the underlying schema.
+        """
+        query = "SELECT " + dbconn.escape_identifier(cls.METADATA_TABLE_NAME_COLUMN) \
+            + ", " + dbconn.escape_identifier(cls.METADATA_LAST_UPDATE_COLUMN) \
+            + " FROM " + dbconn.escape_identifier(cls.METADATA_TABLE) + ";"
+        cursor = dbconn.execute(query, False)
+        return ResultSet(cursor)
+
+    @classmethod
+    def get_all_tables_columns(cls, dbconn, dbname):
+        """
+        Return an iterator over (table name, column name) rows
+        for every column of every table in the given database,
+        ordered by table name then by position within the table.
+        """
+        query = """
+        SELECT
+            table_name,
+            column_name
+        FROM
+            information_schema.columns
+        WHERE
+            table_schema=%s
+        ORDER BY
+            table_name,
+            ordinal_position;
+        """
+        cursor = dbconn.execute(query, False, [dbname])
+        return ResultSet(cursor)
+
+    @classmethod
+    def get_table_columns(cls, dbconn, dbname, table_name):
+        """
+        Return a list of the names of the given table's columns, in order.
+        The list is empty if there is no such table.
+        """
+        query = """
+        SELECT
+            column_name
+        FROM
+            information_schema.columns
+        WHERE
+            table_schema=%s
+            AND table_name=%s
+        ORDER BY
+            ordinal_position;
+        """
+        cursor = dbconn.execute(query, False, [dbname, table_name])
+        return list(ResultSetSlice(cursor, 0))
+
+    @classmethod
+    def get_tables_details(
+        cls, dbconn, dbname, comments=True, lastupdates=True
+    ):
+        """
+        Return a list of (table name, comment, last update time) tuples
+        for every table in the given database, ordered by table name,
+        using at most two queries however many tables there are.
+        If comments or lastupdates is false, the corresponding query
+        is skipped, and that element of each tuple is None.
+        """
+        if comments:
+            # Each resultset must be entirely read before the next query
+            # can be performed on the same connection
+            tables = [
+                (name, comment) for (name, comment)
+                in cls.get_all_tables_comments(dbconn, dbname)
+            ]
+        else:
+            tables = [
+                (name, None) for name in cls.get_table_list(dbconn)
+            ]
+        if lastupdates:
+            updates = dict(
+                (name, last_update) for (name, last_update)
+                in cls.get_all_tables_lastupdates(dbconn)
+            )
+            return [
+                (name, comment, as_utc(updates.get(name)))
+                for (name, comment) in tables
+            ]
+        return [(name, comment, None) for (name, comment) in tables]
 
     @classmethod
     def get_table_list(cls, dbconn):
@@ -112,24 +260,474 @@ class DBQueries(object):
         return ResultSetSlice(cursor, 0)
 
     @classmethod
-    def filter_table(cls, dbconn, table_name, filter_args):
+    def get_primary_key(cls, dbconn, dbname, table_name):
+        """
+        Return a list of the names of the columns making up
+        the given table's primary key, in order.
+        The list is empty if the table has no primary key.
+        """
+        query = """
+        SELECT
+            column_name
+        FROM
+            information_schema.key_column_usage
+        WHERE
+            table_schema=%s
+            AND table_name=%s
+            AND constraint_name='PRIMARY'
+        ORDER BY
+            ordinal_position;
+        """
+        cursor = dbconn.execute(query, False, [dbname, table_name])
+        return list(ResultSetSlice(cursor, 0))
+
+    @classmethod
+    def _seek_criterion(cls, dbconn, key_columns, after):
+        """
+        Return an SQL criterion, and a list of parameters for it,
+        selecting rows which come after the given key values when ordered
+        by the given key columns. This is written as
+            k1 >= v1 AND (k1 > v1 OR (k1 = v1 AND k2 > v2) OR ...)
+        so that MySQL can use an index on the key columns to seek
+        directly to the first such row.
+        """
+        columns = [dbconn.escape_identifier(col) for col in key_columns]
+        alternatives = []
+        parameters = [after[0]]
+        for i in range(len(columns)):
+            alternatives.append('(' + ' AND '.join(
+                [column + '=%s' for column in columns[:i]] +
+                [columns[i] + '>%s']
+            ) + ')')
+            parameters.extend(after[:i + 1])
+        criterion = columns[0] + '>=%s AND (' \
+            + ' OR '.join(alternatives) + ')'
+        return (criterion, parameters)
+
+    @classmethod
+    def parse_filters(cls, filter_args):
+        """
+        Return a list of (column name, operator, values) tuples
+        describing the given query arguments, each of which names a column,
+        optionally followed by FILTER_SEPARATOR and an operator,
+        and has a list of values.
+        Several values for 'eq' or 'ne' test membership of a set,
+        and several values for 'prefix' are alternatives; other operators
+        take a single value.
+        Raise ValueError if the arguments are invalid.
+        """
+        filters = []
+        for (key, values) in sorted(filter_args.items()):
+            (column, _, operator) = key.rpartition(cls.FILTER_SEPARATOR)
+            if not column or operator not in cls.FILTER_OPERATORS:
+                (column, operator) = (key, 'eq')
+            if not values:
+                raise ValueError("No value given for '%s'" % key)
+            if len(values) > 1 and operator not in ('eq', 'ne', 'prefix'):
+                raise ValueError("Only one value may be given for '%s'" % key)
+            filters.append((column, operator, values))
+        return filters
+
+    @classmethod
+    def _escape_like(cls, value):
+        """
+        Return the given string with the characters that are special
+        in SQL LIKE patterns escaped.
+        """
+        return value.replace('\\', '\\\\') \
+            .replace('%', '\\%').replace('_', '\\_')
+
+    @classmethod
+    def _filter_criteria(cls, dbconn, filters):
+        """
+        Return a list of SQL criteria, and a list of parameters for them,
+        implementing the given filters, as returned by parse_filters.
+        Each criterion compares a column directly with parameters,
+        so that MySQL can use an index on the column.
+        """
+        criteria = []
+        parameters = []
+        for (column, operator, values) in filters:
+            # Column names cannot be parameters, so must escaped
+            column = dbconn.escape_identifier(column)
+            # Filter values can be parameters
+            if operator == 'prefix':
+                criteria.append('(' + ' OR '.join(
+                    [column + ' LIKE %s'] * len(values)
+                ) + ')')
+                parameters.extend(
+                    cls._escape_like(value) + '%' for value in values
+                )
+                continue
+            if len(values) > 1:
+                criteria.append(
+                    column + (' NOT IN (' if operator == 'ne' else ' IN (') +
+                    ','.join(['%s'] * len(values)) + ')'
+                )
+            else:
+                criteria.append(column + cls.FILTER_OPERATORS[operator] + '%s')
+            parameters.extend(values)
+        return (criteria, parameters)
+
+    @classmethod
+    def filter_table(
+        cls, dbconn, table_name, filters,
+        key_columns=None, after=None, limit=None, columns=None
+    ):
         """
         Return an iterator over the records in a resultset
-        selecting all columns from the given-named table.
-        The filter_args are ANDed together then used as a WHERE criterion.
+        selecting the given columns, or all columns if none are given,
+        from the given-named table.
+        The filters, as returned by parse_filters, are ANDed together
+        then used as a WHERE criterion.
+        If key_columns are given, the records are ordered by them,
+        and if the values of those columns in the last row of the previous
+        page are given as after, only records after those are returned.
+        Since this seeks rather than skips, every page is as cheap as the
+        first, given an index on the key columns.
+        At most limit records are returned, if a limit is given.
         """
+        if columns:
+            # Column names cannot be parameters, so must be escaped
+            query = 'SELECT ' + ','.join(
+                [dbconn.escape_identifier(col) for col in columns]
+            )
+        else:
+            query = 'SELECT *'
         # Table names cannot be parameters, so must be escaped
-        query = 'SELECT * FROM ' + dbconn.escape_identifier(table_name)
-        parameters = []
-        if filter_args:
-            query += ' WHERE '
-            criteria = []
-            for (key, val) in filter_args.items():
-                # Column names cannot be parameters, so must escaped
-                criteria.append(dbconn.escape_identifier(key) + "=%s")
-                # Filter values can be parameters
-                parameters.append(val[0])
-            query += ' AND '.join(criteria)
+        query += ' FROM ' + dbconn.escape_identifier(table_name)
+        (criteria, parameters) = cls._filter_criteria(dbconn, filters)
+        if after is not None:
+            (criterion, seek_parameters) = cls._seek_criterion(
+                dbconn, key_columns, after
+            )
+            criteria.append(criterion)
+            parameters.extend(seek_parameters)
+        if criteria:
+            query += ' WHERE ' + ' AND '.join(criteria)
+        if key_columns:
+            query += ' ORDER BY ' + ','.join(
+                [dbconn.escape_identifier(col) for col in key_columns]
+            )
+        if limit is not None:
+            query += ' LIMIT %d' % limit
         query += ';'
-        cursor = dbconn.execute(query, True, parameters)
-        return ResultSet(cursor)
+        cursor = dbconn.execute(query, False, parameters)
+        return RecordSet(
+            cursor, dbconn.fetch_batch_size, dbconn.fetch_batch_memory
+        )
+
+    @classmethod
+    def count_table(cls, dbconn, table_name, filters, column=None):
+        """
+        Return the number of records of the given-named table
+        selected by the given filters, and if a column is given,
+        in which it is not null.
+        """
+        records = cls.aggregate_table(
+            dbconn, table_name, filters, [], [('count', column)]
+        )
+        return list(records.iter_tuples())[0][0]
+
+    @classmethod
+    def parse_aggregates(cls, specs):
+        """
+        Return a list of (function, column name) tuples described by
+        the given aggregate specifications, each of the form
+        'function(column)', or 'count' or 'count(*)' to count rows,
+        in which case the column name is None.
+        Raise ValueError if any specification is invalid.
+        """
+        aggregates = []
+        for spec in specs:
+            (function, _, column) = spec.partition('(')
+            if column:
+                if not column.endswith(')'):
+                    raise ValueError("Invalid aggregate '%s'" % spec)
+                column = column[:-1]
+            if function not in cls.AGGREGATE_FUNCTIONS:
+                raise ValueError("Unknown aggregate function '%s'" % function)
+            if column in ('', '*'):
+                if function != 'count':
+                    raise ValueError("Aggregate '%s' needs a column" % spec)
+                column = None
+            if (function, column) not in aggregates:
+                aggregates.append((function, column))
+        return aggregates
+
+    @classmethod
+    def aggregate_name(cls, function, column):
+        """
+        Return the name of the result column holding the given aggregate.
+        """
+        if column is None:
+            return function
+        return function + '_' + column
+
+    @classmethod
+    def _aggregate_expression(cls, dbconn, function, column, ts_column):
+        """
+        Return an SQL expression computing the given aggregate function
+        of the given column, using the given time column to order values
+        for the 'first' and 'last' functions.
+        Those concatenate the values of each group with GROUP_CONCAT, whose
+        result MySQL silently truncates to group_concat_max_len bytes.
+        Only the first value is kept, so this only matters if that value
+        is itself longer; aggregate_table raises the limit from MySQL's
+        default of 1024 bytes to GROUP_CONCAT_MAX_LEN for such queries.
+        """
+        if column is None:
+            return 'COUNT(*)'
+        # Column names cannot be parameters, so must be escaped
+        column = dbconn.escape_identifier(column)
+        if function in cls.ORDERED_AGGREGATE_FUNCTIONS:
+            # MySQL has no FIRST or LAST aggregate functions, so
+            # concatenate the values in order, separated by NUL characters,
+            # and take the first. The result is a string.
+            return "SUBSTRING_INDEX(GROUP_CONCAT(" + column + " ORDER BY " \
+                + dbconn.escape_identifier(ts_column) \
+                + (" DESC" if function == 'last' else "") \
+                + " SEPARATOR '\\0'), '\\0', 1)"
+        return function.upper() + '(' + column + ')'
+
+    @classmethod
+    def aggregate_table(
+        cls, dbconn, table_name, filters, group_by, aggregates,
+        ts_column=None, bucket_seconds=None
+    ):
+        """
+        Return an iterator over the records in a resultset holding the
+        given aggregates, as returned by parse_aggregates, of the records
+        of the given-named table selected by the given filters, for each
+        distinct combination of values of the group_by columns, which are
+        also included in each record, and by which the records are ordered.
+        If bucket_seconds is given, records are also grouped into buckets
+        of that many seconds by the value of the ts_column, and each record
+        starts with a 'bucket' column holding the start of its bucket,
+        by which records are ordered first.
+        The 'first' and 'last' aggregates need a ts_column to order values.
+        The aggregates are computed by the database in a single query,
+        so only one record per group is transferred.
+        """
+        if any(
+            function in cls.ORDERED_AGGREGATE_FUNCTIONS
+            for (function, _) in aggregates
+        ):
+            dbconn.execute(
+                'SET SESSION group_concat_max_len=%s;', False,
+                [cls.GROUP_CONCAT_MAX_LEN]
+            )
+        # Column names cannot be parameters, so must be escaped
+        group_columns = [dbconn.escape_identifier(col) for col in group_by]
+        if bucket_seconds is not None:
+            # The connection's time zone is UTC, so buckets start at
+            # multiples of the interval since the UNIX epoch in UTC
+            group_columns.insert(0, dbconn.escape_identifier(
+                cls.BUCKET_COLUMN
+            ))
+            selected = [
+                'FROM_UNIXTIME(FLOOR(UNIX_TIMESTAMP(' +
+                dbconn.escape_identifier(ts_column) + ')/%d)*%d) AS ' % (
+                    bucket_seconds, bucket_seconds
+                ) + group_columns[0]
+            ] + group_columns[1:]
+        else:
+            selected = list(group_columns)
+        for (function, column) in aggregates:
+            expression = cls._aggregate_expression(
+                dbconn, function, column, ts_column
+            )
+            selected.append(expression + ' AS ' + dbconn.escape_identifier(
+                cls.aggregate_name(function, column)
+            ))
+        # Table names cannot be parameters, so must be escaped
+        query = 'SELECT ' + ','.join(selected) \
+            + ' FROM ' + dbconn.escape_identifier(table_name)
+        (criteria, parameters) = cls._filter_criteria(dbconn, filters)
+        if criteria:
+            query += ' WHERE ' + ' AND '.join(criteria)
+        if group_columns:
+            query += ' GROUP BY ' + ','.join(group_columns) \
+                + ' ORDER BY ' + ','.join(group_columns)
+        query += ';'
+        cursor = dbconn.execute(query, False, parameters)
+        return RecordSet(
+            cursor, dbconn.fetch_batch_size, dbconn.fetch_batch_memory
+        )
+
+
+class FakeDBConnection(object):
+
+    """
+    A stand-in for a DBConnection, recording the queries executed on it,
+    whose identifiers are escaped as MySQL's would be.
+    """
+
+    fetch_batch_size = None
+    fetch_batch_memory = None
+
+    def __init__(self):
+        self.queries = []
+
+    def execute(self, query, return_dictionaries=True, bind_values=None):
+        """
+        Record the given query and its parameters.
+        """
+        # pylint: disable=W0613
+        self.queries.append((query, bind_values))
+
+    @classmethod
+    def escape_identifier(cls, identifier):
+        """
+        Return the given identifier, which holds no special characters.
+        """
+        return identifier
+
+
+class DBQueriesTestCase(TestCase):
+
+    """
+    Unit tests for building queries, using a fake database connection.
+    """
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    def setUp(self):
+        self.dbconn = FakeDBConnection()
+
+    def testSeekCriterion(self):
+        """
+        Test selecting the rows after given values of one or more
+        key columns.
+        """
+        # pylint: disable=W0212
+        for (key_columns, after, criterion, parameters) in [
+            (['id'], [5], 'id>=%s AND ((id>%s))', [5, 5]),
+            (
+                ['project', 'id'], ['p1', 7],
+                'project>=%s AND ((project>%s) OR (project=%s AND id>%s))',
+                ['p1', 'p1', 'p1', 7]
+            ),
+            (
+                ['a', 'b', 'c'], [1, 2, 3],
+                'a>=%s AND ((a>%s) OR (a=%s AND b>%s) OR '
+                '(a=%s AND b=%s AND c>%s))',
+                [1, 1, 1, 2, 1, 2, 3]
+            )
+        ]:
+            self.assertEqual(
+                DBQueries._seek_criterion(self.dbconn, key_columns, after),
+                (criterion, parameters)
+            )
+
+    def testParseFilters(self):
+        """
+        Test splitting filter arguments into columns, operators and values.
+        """
+        self.assertEqual(DBQueries.parse_filters({
+            'bytes__gte': ['5'], 'project': ['a', 'b'],
+            'project__ne': ['c', 'd'], 'name__prefix': ['x', 'y'],
+            'odd__name': ['1'], '__lt': ['2'], 'a__b__lt': ['3']
+        }), [
+            ('__lt', 'eq', ['2']),
+            ('a__b', 'lt', ['3']),
+            ('bytes', 'gte', ['5']),
+            ('name', 'prefix', ['x', 'y']),
+            ('odd__name', 'eq', ['1']),
+            ('project', 'eq', ['a', 'b']),
+            ('project', 'ne', ['c', 'd'])
+        ])
+        for args in [{'bytes__gt': ['1', '2']}, {'bytes': []}]:
+            self.assertRaises(ValueError, DBQueries.parse_filters, args)
+
+    def testFilterCriteria(self):
+        """
+        Test the SQL criteria of filters, with several values testing
+        membership of a set, and prefixes escaped for LIKE.
+        """
+        # pylint: disable=W0212
+        self.assertEqual(DBQueries._filter_criteria(self.dbconn, [
+            ('bytes', 'gte', ['5']),
+            ('project', 'eq', ['a', 'b']),
+            ('project', 'ne', ['c', 'd']),
+            ('project', 'ne', ['e']),
+            ('name', 'prefix', ['50%_off\\', 'x'])
+        ]), ([
+            'bytes>=%s',
+            'project IN (%s,%s)',
+            'project NOT IN (%s,%s)',
+            'project<>%s',
+            '(name LIKE %s OR name LIKE %s)'
+        ], ['5', 'a', 'b', 'c', 'd', 'e', '50\\%\\_off\\\\%', 'x%']))
+
+    def testParseAggregates(self):
+        """
+        Test parsing valid aggregate specifications, and rejecting
+        invalid ones.
+        """
+        self.assertEqual(DBQueries.parse_aggregates([
+            'count', 'count(*)', 'sum(bytes)', 'first(t)', 'sum(bytes)',
+            'count(id)'
+        ]), [
+            ('count', None), ('sum', 'bytes'), ('first', 't'),
+            ('count', 'id')
+        ])
+        for spec in [
+            'median(bytes)', 'SUM(bytes)', 'sum', 'sum()', 'sum(*)',
+            'sum(bytes', 'sum(bytes))x', ''
+        ]:
+            self.assertRaises(ValueError, DBQueries.parse_aggregates, [spec])
+
+    def testAggregateTable(self):
+        """
+        Test aggregating into buckets, with the 'last' aggregate raising
+        the limit on the length of GROUP_CONCAT results.
+        """
+        DBQueries.aggregate_table(
+            self.dbconn, 'usage', [('project', 'eq', ['p1'])], ['project'],
+            [('count', None), ('last', 'bytes')], 't', 3600
+        )
+        self.assertEqual(self.dbconn.queries, [
+            (
+                'SET SESSION group_concat_max_len=%s;',
+                [DBQueries.GROUP_CONCAT_MAX_LEN]
+            ),
+            (
+                'SELECT FROM_UNIXTIME(FLOOR(UNIX_TIMESTAMP(t)/3600)*3600) '
+                'AS bucket,project,COUNT(*) AS count,'
+                "SUBSTRING_INDEX(GROUP_CONCAT(bytes ORDER BY t DESC "
+                "SEPARATOR '\\0'), '\\0', 1) AS last_bytes "
+                'FROM usage WHERE project=%s '
+                'GROUP BY bucket,project ORDER BY bucket,project;',
+                ['p1']
+            )
+        ])
+        self.dbconn.queries = []
+        DBQueries.aggregate_table(
+            self.dbconn, 'usage', [], [], [('sum', 'bytes')]
+        )
+        self.assertEqual(self.dbconn.queries, [
+            ('SELECT SUM(bytes) AS sum_bytes FROM usage;', [])
+        ])
+
+    def testFilterTablePage(self):
+        """
+        Test selecting a page of filtered rows after given key values.
+        """
+        DBQueries.filter_table(
+            self.dbconn, 'usage', [('project', 'eq', ['p1'])],
+            key_columns=['project', 'id'], after=['p1', 7], limit=11,
+            columns=['id', 'bytes']
+        )
+        self.assertEqual(self.dbconn.queries, [(
+            'SELECT id,bytes FROM usage WHERE project=%s AND project>=%s '
+            'AND ((project>%s) OR (project=%s AND id>%s)) '
+            'ORDER BY project,id LIMIT 11;',
+            ['p1', 'p1', 'p1', 'p1', 7]
+        )])
+
+
+if __name__ == '__main__':
+    test_main()
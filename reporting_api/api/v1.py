@@ -3,11 +3,26 @@ OpenStack Reporting API version 1.
 """
 
 import ConfigParser
+import base64
+import hashlib
+import json
+import urllib
+from datetime import datetime
+from functools import partial
+from unittest import main as test_main, TestCase
 import webob.exc
+from reporting_api.api.catalog import ReportCatalog
 from reporting_api.common.apiversion import APIVersion
-from reporting_api.common.dbconn import DBConnection
-from reporting_api.api.dbqueries import DBQueries
+from reporting_api.common.cache import ResponseCache, accepts_gzip
+from reporting_api.common.compression import CONTENT_CODINGS
+from reporting_api.common.dbconn import (
+    ConnectionPool, DBConnection, RecordPage
+)
+from reporting_api.common.diskstore import DiskStore
+from reporting_api.common.downsample import DownsampledRecordSet
+from reporting_api.api.dbqueries import DBQueries, as_utc
 from wsgiref.handlers import format_date_time
+from wsgiref.util import FileWrapper
 from time import mktime
 
 
@@ -17,24 +32,370 @@ class APIv1App(APIVersion):
     Implements version 1 of the OpenStack Reporting API.
     """
 
-    def __init__(self, configuration):
-        super(APIv1App, self).__init__(configuration)
+    # Optional connection pool settings in the 'database' section,
+    # each prefixed by 'pool_', with their defaults
+    POOL_OPTIONS = dict(
+        min_size=0,
+        max_size=10,
+        idle_timeout=300,
+        max_lifetime=3600,
+        acquire_timeout=30
+    )
+
+    # Optional row fetching settings in the 'database' section,
+    # each prefixed by 'fetch_', with their defaults.
+    # A batch size of 0 adapts the batch size to the width of rows.
+    FETCH_OPTIONS = dict(
+        batch_size=0,
+        batch_memory=0
+    )
+
+    # Optional result set cache settings in the 'cache' section,
+    # with their defaults. A max_bytes of 0 disables the cache.
+    CACHE_OPTIONS = dict(
+        max_bytes=64 * 1024 * 1024,
+        max_entry_bytes=4 * 1024 * 1024,
+        compress_level=6
+    )
+
+    # Optional on-disk response store settings in the 'store' section,
+    # with their defaults; the store is disabled unless a directory is given
+    STORE_OPTIONS = dict(
+        compress_level=6,
+        min_bytes=0
+    )
+
+    # The largest page of results which may be requested
+    DEFAULT_MAX_LIMIT = 10000
+
+    # WSGI environment key holding the current request's database connection
+    DBCONN_KEY = 'reporting_api.dbconn'
+
+    def __init__(self, configuration, settings=None):
+        super(APIv1App, self).__init__(configuration, settings)
         self.dbname = self.config.get('database', 'dbname')
         self.dbhost = self.config.get('database', 'hostname')
         self.dbuser = self.config.get('database', 'username')
         self.dbpass = self.config.get('database', 'password')
-
-    def _connect_db(self):
-        """
-        Return a new connection to the database.
-        TODO: Connection pooling.
-        """
-        return DBConnection(
+        pool_options = dict(
+            (option, self._get_int_option(
+                'database', 'pool_' + option, default
+            ))
+            for (option, default) in self.POOL_OPTIONS.items()
+        )
+        fetch_options = dict(
+            (option, self._get_int_option(
+                'database', 'fetch_' + option, default
+            ))
+            for (option, default) in self.FETCH_OPTIONS.items()
+        )
+        self.pool = ConnectionPool(
+            factory=partial(
+                DBConnection,
+                fetch_batch_size=fetch_options['batch_size'],
+                fetch_batch_memory=fetch_options['batch_memory']
+            ),
             host=self.dbhost,
             user=self.dbuser,
             password=self.dbpass,
-            database=self.dbname
+            database=self.dbname,
+            **pool_options
+        )
+        cache_options = dict(
+            (option, self._get_int_option('cache', option, default))
+            for (option, default) in self.CACHE_OPTIONS.items()
+        )
+        if cache_options['max_bytes']:
+            self.cache = ResponseCache(
+                compress=self._get_boolean_option('cache', 'compress', True),
+                **cache_options
+            )
+        else:
+            self.cache = None
+        if self.config.has_option('store', 'directory'):
+            self.store = DiskStore(
+                self.config.get('store', 'directory'),
+                **dict(
+                    (option, self._get_int_option('store', option, default))
+                    for (option, default) in self.STORE_OPTIONS.items()
+                )
+            )
+        else:
+            self.store = None
+        self.max_limit = self._get_int_option(
+            'pagination', 'max_limit', self.DEFAULT_MAX_LIMIT
+        )
+        refresh_interval = self._get_int_option(
+            'catalog', 'refresh_interval', 60
+        )
+        if refresh_interval:
+            self.catalog = ReportCatalog(
+                self.pool, self.dbname, refresh_interval
+            )
+        else:
+            self.catalog = None
+
+    def _get_int_option(self, section, option, default):
+        """
+        Return the given integer option from the configuration file,
+        or the given default if it is not present.
+        """
+        if self.config.has_option(section, option):
+            return self.config.getint(section, option)
+        return default
+
+    def _get_boolean_option(self, section, option, default):
+        """
+        Return the given boolean option from the configuration file,
+        or the given default if it is not present.
+        """
+        if self.config.has_option(section, option):
+            return self.config.getboolean(section, option)
+        return default
+
+    def _connect_db(self, req):
+        """
+        Return a pooled connection to the database.
+        The connection is held until the response to the given request
+        has been entirely streamed, then returned to the pool.
+        Repeated calls for the same request return the same connection.
+        """
+        if self.DBCONN_KEY in req.environ:
+            return req.environ[self.DBCONN_KEY]
+        dbconn = self.pool.acquire()
+        req.environ[self.DBCONN_KEY] = dbconn
+        self._on_close(req, lambda: self.pool.release(dbconn))
+        return dbconn
+
+    def _get_last_update(self, req, table_name):
+        """
+        Return the given table's last update time, from the catalog if
+        possible, otherwise from the database.
+        """
+        if self.catalog is not None:
+            last_update = self.catalog.last_update(table_name)
+            if last_update is not None:
+                return last_update
+        return DBQueries.get_table_lastupdate(
+            self._connect_db(req), table_name
+        )
+
+    def _get_tables_details(self, req, fields):
+        """
+        Return a list of (table name, comment, last update time) tuples,
+        from the catalog if possible, otherwise from the database.
+        Details not among the given fields may be omitted.
+        """
+        if self.catalog is not None:
+            tables = self.catalog.tables()
+            if tables is not None:
+                return tables
+        return DBQueries.get_tables_details(
+            self._connect_db(req), self.dbname,
+            comments='description' in fields,
+            lastupdates='lastUpdated' in fields
+        )
+
+    def _get_columns(self, req, table_name):
+        """
+        Return a list of the names of the given table's columns,
+        from the catalog if possible, otherwise from the database.
+        """
+        if self.catalog is not None:
+            columns = self.catalog.columns(table_name)
+            if columns is not None:
+                return columns
+        return DBQueries.get_table_columns(
+            self._connect_db(req), self.dbname, table_name
+        )
+
+    def pool_stats(self):
+        """
+        Return a dictionary of database connection pool statistics.
+        """
+        return self.pool.stats()
+
+    def cache_stats(self):
+        """
+        Return a dictionary of result set cache statistics,
+        or None if there is no cache.
+        """
+        if self.cache is None:
+            return None
+        return self.cache.stats()
+
+    def store_stats(self):
+        """
+        Return a dictionary of on-disk response store statistics,
+        or None if there is no store.
+        """
+        if self.store is None:
+            return None
+        return self.store.stats()
+
+    def catalog_stats(self):
+        """
+        Return a dictionary of report catalog statistics,
+        or None if there is no catalog.
+        """
+        if self.catalog is None:
+            return None
+        return self.catalog.stats()
+
+    @classmethod
+    def _normalise_args(cls, args):
+        """
+        Return a hashable representation of the given query arguments,
+        which is the same however the arguments were ordered.
+        """
+        return tuple(sorted(
+            (key, tuple(values)) for (key, values) in args.items()
+        ))
+
+    def _set_dictionary_columns(self, req, args):
+        """
+        Remove the 'dictionary' query argument from the given arguments,
+        and if the compact output format was negotiated for the given
+        request, dictionary-encode the columns it names; see
+        CompactJSONEncoder. Columns not in the results are ignored.
+        """
+        if 'dictionary' not in args:
+            return
+        columns = [
+            column.strip() for value in args.pop('dictionary')
+            for column in value.split(',') if column.strip()
+        ]
+        if self._get_format(req) == 'compact':
+            req.environ[self.ENCODER_OPTIONS_KEY] = dict(
+                dictionary_columns=columns
+            )
+
+    def _get_cache_key(self, req, args):
+        """
+        Return a hashable representation of the response to the given
+        request with the given query arguments, identifying the output
+        format unless it is JSON.
+        """
+        cache_key = self._normalise_args(args)
+        output_format = self._get_format(req)
+        if output_format != 'json':
+            cache_key += ((None, output_format),)
+        return cache_key
+
+    @classmethod
+    def _get_etag(cls, table_name, cache_key, server_modified):
+        """
+        Return a strong entity tag for the result of querying the given
+        table as described by the given normalised query arguments,
+        valid until the table's last update time changes.
+        """
+        return hashlib.sha1(repr(
+            (table_name, server_modified.isoformat(), cache_key)
+        )).hexdigest()
+
+    def _get_validators(self, req, table_name, cache_key):
+        """
+        Return a (last update time, entity tag, headers) tuple for the
+        result of querying the given table as described by the given
+        normalised query arguments, where the headers carry both validators.
+        """
+        server_modified = self._get_last_update(req, table_name)
+        etag = self._get_etag(table_name, cache_key, server_modified)
+        headers = [
+            (
+                'Last-Modified',
+                format_date_time(mktime(server_modified.timetuple()))
+            ),
+            ('ETag', '"%s"' % etag)
+        ]
+        return (server_modified, etag, headers)
+
+    @classmethod
+    def _not_modified(cls, req, etag, server_modified, headers):
+        """
+        Return a 304 Not Modified response carrying the given headers if
+        the given request is conditional, and the client's copy of the
+        response has the given entity tag or is at least as recent as
+        the given last update time; otherwise return None.
+        As HTTP requires, If-None-Match takes precedence over
+        If-Modified-Since. Both the identity variant of a response and
+        its variants compressed in any content coding match.
+        """
+        if 'HTTP_IF_NONE_MATCH' in req.environ:
+            modified = etag not in req.if_none_match
+            for encoding in CONTENT_CODINGS:
+                if modified and etag + '-' + encoding in req.if_none_match:
+                    # Validate the variant the client holds
+                    headers = cls._encoded_headers(headers, encoding)
+                    modified = False
+        else:
+            modified = not (
+                req.if_modified_since and
+                req.if_modified_since >= server_modified
+            )
+        if modified:
+            return None
+        return webob.exc.HTTPNotModified(headers=headers)
+
+    @classmethod
+    def _encoded_headers(cls, headers, encoding):
+        """
+        Return a copy of the given response headers in which the entity tag
+        is that of the response compressed in the given content coding,
+        suffixed by '-' and the content coding, as CompressionMiddleware
+        tags compressed responses.
+        """
+        return [
+            (
+                name,
+                value[:-1] + '-' + encoding + '"' if name == 'ETag' else value
+            )
+            for (name, value) in headers
+        ]
+
+    def _cached_response(self, req, entry, headers):
+        """
+        Build a response to the given request from the given cache entry,
+        compressed if the entry has a compressed body the client accepts.
+        The compressed body, being a different representation, has its own
+        entity tag; see _encoded_headers.
+        """
+        headers.extend(entry.headers)
+        headers.append(('Vary', 'Accept-Encoding'))
+        if entry.gzip_body is not None and accepts_gzip(req):
+            headers = self._encoded_headers(headers, 'gzip')
+            headers.append(('Content-Encoding', 'gzip'))
+            return self._build_body_response(req, entry.gzip_body, headers)
+        return self._build_body_response(req, entry.body, headers)
+
+    def _stored_response(self, req, table_name, server_modified, headers):
+        """
+        Build a response to the given request from the body of the given
+        table stored on disk for the given last update time, compressed if
+        the client accepts it, or return None if there is no such body.
+        The body is sent using the server's wsgi.file_wrapper, if any,
+        which may use sendfile, so any database connection is released
+        first, to leave the file wrapper unwrapped.
+        """
+        stored = self.store.open(
+            table_name, server_modified, accepts_gzip(req),
+            self._get_format(req)
         )
+        if stored is None:
+            return None
+        (body_file, size, encoding) = stored
+        if self.DBCONN_KEY in req.environ:
+            del req.environ[self.DBCONN_KEY]
+            self._release_resources(req)
+        headers.append(('Vary', 'Accept-Encoding'))
+        if encoding is not None:
+            headers = self._encoded_headers(headers, encoding)
+            headers.append(('Content-Encoding', encoding))
+        file_wrapper = req.environ.get('wsgi.file_wrapper', FileWrapper)
+        response = self._build_body_response(req, '', headers)
+        response.app_iter = file_wrapper(body_file, self.chunk_size)
+        response.content_length = size
+        return response
 
     @classmethod
     def _version_identifier(cls):
@@ -60,58 +421,342 @@ class APIv1App(APIVersion):
             self='/v1/reports/' + report
         )
 
-    def _get_report_details(self, dbconn, report_name):
+    # Properties of each report which may be chosen using 'fields'
+    REPORT_FIELDS = ('name', 'description', 'lastUpdated', 'links')
+
+    @classmethod
+    def _get_fields(cls, args, allowed, name='fields'):
+        """
+        Return the list of field names requested using the given-named
+        query parameter, which may be repeated and/or comma-separated,
+        or None if no fields were requested.
+        Raise ValueError if any of the requested fields is not allowed.
+        """
+        if name not in args:
+            return None
+        fields = []
+        for value in args[name]:
+            for field in value.split(','):
+                field = field.strip()
+                if not field:
+                    continue
+                if field not in allowed:
+                    raise ValueError("Unknown field '%s'" % field)
+                if field not in fields:
+                    fields.append(field)
+        return fields
+
+    @classmethod
+    def _check_filters(cls, filters, columns):
+        """
+        Raise ValueError if any of the given filters, as returned by
+        parse_filters, names a column which is not among the given columns.
+        Filter column names are put into queries, so must be validated.
+        """
+        for (column, _, _) in filters:
+            if column not in columns:
+                raise ValueError("Unknown field '%s'" % column)
+
+    # Units of time in which bucket intervals may be given, in seconds
+    INTERVAL_UNITS = dict(s=1, m=60, h=3600, d=86400, w=604800)
+
+    @classmethod
+    def _parse_interval(cls, interval):
+        """
+        Return the number of seconds in the given interval, which is
+        a positive whole number, optionally followed by one of the
+        INTERVAL_UNITS, as in '15m'; the default unit is the second.
+        Raise ValueError if the interval is invalid.
+        """
+        multiplier = cls.INTERVAL_UNITS.get(interval[-1:], None)
+        if multiplier is not None:
+            interval = interval[:-1]
+        else:
+            multiplier = 1
+        if not interval.isdigit() or not int(interval):
+            raise ValueError("Invalid bucket interval")
+        return int(interval) * multiplier
+
+    def _get_points(self, args, fields_args):
+        """
+        Remove the 'points' downsampling parameter from the given query
+        arguments, returning its value, or None if it is absent.
+        The 'ts' and 'value' parameters it requires are taken from
+        the given fields arguments; their columns must hold times or
+        numbers, and numbers, which is checked by DownsampledRecordSet
+        once they have been queried.
+        Raise ValueError if any of these is invalid.
         """
-        Return details about the given-named report.
+        points = args.pop('points', [None])[0]
+        if points is None:
+            return None
+        if not points.isdigit() or not 3 <= int(points) <= self.max_limit:
+            raise ValueError(
+                "The points must be between 3 and %d" % self.max_limit
+            )
+        for name in ('ts', 'value'):
+            if len(fields_args.get(name, [])) != 1:
+                raise ValueError("Downsampling needs one '%s' column" % name)
+        return int(points)
+
+    @classmethod
+    def _get_report_page_links(cls, report, args, marker):
+        """
+        Return a set of links to other pages of the given report's results,
+        in the same form as _get_report_links.
+        The args are the query arguments which produced the current page,
+        and the marker identifies the last result on it.
         """
+        query = dict(args)
+        query['marker'] = [marker]
         return dict(
+            next=cls._get_report_links(report)['self'] + '?' +
+            urllib.urlencode(sorted(query.items()), True)
+        )
+
+    @classmethod
+    def _link_header(cls, links):
+        """
+        Return an RFC 5988 Link header describing the given links,
+        in the form returned by _get_report_links.
+        """
+        return ('Link', ', '.join(
+            '<%s>; rel="%s"' % (href, rel)
+            for (rel, href) in sorted(links.items())
+        ))
+
+    def _get_page_args(self, args):
+        """
+        Remove the 'limit' and 'marker' pagination parameters from
+        the given query arguments, returning their values, or None for
+        those which are absent.
+        Raise ValueError if either is invalid.
+        """
+        limit = args.pop('limit', [None])[0]
+        marker = args.pop('marker', [None])[0]
+        if limit is None:
+            if marker is not None:
+                raise ValueError("A marker requires a limit")
+            return (None, None)
+        if not limit.isdigit() or not 0 < int(limit) <= self.max_limit:
+            raise ValueError(
+                "The limit must be between 1 and %d" % self.max_limit
+            )
+        return (int(limit), marker)
+
+    @classmethod
+    def _encode_marker(cls, values):
+        """
+        Return an opaque marker encoding the given key column values.
+        """
+        return base64.urlsafe_b64encode(json.dumps([
+            value.isoformat() if hasattr(value, 'isoformat') else value
+            for value in values
+        ], default=str)).rstrip('=')
+
+    @classmethod
+    def _decode_marker(cls, marker, key_columns):
+        """
+        Return the key column values encoded in the given marker.
+        Raise ValueError if the marker is invalid.
+        """
+        try:
+            padding = '=' * (-len(marker) % 4)
+            values = json.loads(
+                base64.urlsafe_b64decode(str(marker) + padding)
+            )
+        except (TypeError, ValueError):
+            raise ValueError("Invalid marker")
+        if not isinstance(values, list) or len(values) != len(key_columns) \
+                or any(isinstance(value, (list, dict)) for value in values):
+            raise ValueError("Invalid marker")
+        return values
+
+    def _get_page_header(self, report, args, page, key_columns):
+        """
+        Return a Link header linking to the page of the given report after
+        the given RecordPage, which was produced by the given query
+        arguments, and ordered by the given key columns.
+        """
+        last_record = page.last_record()
+        marker = self._encode_marker(
+            [last_record[column] for column in key_columns]
+        )
+        return self._link_header(
+            self._get_report_page_links(report, args, marker)
+        )
+
+    def _get_ordering_key(self, dbconn, table_name):
+        """
+        Return a list of the names of the columns which order the results
+        of the given table for pagination. These are configured in the
+        'ordering' section, or else are the table's primary key.
+        Raise ValueError if there are no such columns.
+        """
+        if self.config.has_option('ordering', table_name):
+            key_columns = [
+                column.strip() for column
+                in self.config.get('ordering', table_name).split(',')
+            ]
+        else:
+            key_columns = DBQueries.get_primary_key(
+                dbconn, self.dbname, table_name
+            )
+        if not key_columns:
+            raise ValueError(
+                "Report '%s' has no key, so cannot be paginated" % table_name
+            )
+        return key_columns
+
+    def _get_report_details(self, report_name, comment, last_update, fields):
+        """
+        Return the requested details about the given-named report.
+        """
+        details = dict(
             name=report_name,
-            description=DBQueries.get_table_comment(
-                dbconn, self.dbname, report_name
-            ),
-            lastUpdated=DBQueries.get_table_lastupdate(
-                dbconn, report_name
-            ),
+            description=comment,
+            lastUpdated=last_update,
             links=self._get_report_links(report_name)
         )
+        return dict(
+            (field, details[field]) for field in fields
+        )
 
     def operation_reports_list(self, req, args):
         """
         List available reports.
+        Details are taken from the catalog, or else fetched using a fixed
+        number of queries however many reports there are, and are skipped
+        entirely if the 'fields' query parameter shows they are not wanted.
         """
-        dbconn = self._connect_db()
-        report_name_iter = DBQueries.get_table_list(dbconn)
-        # The current resultset must be entirely read before another query
-        # can be performed on the same connection.
-        # This means we must either finish reading all report names before
-        # reading all report details, or must use multiple connections.
-        report_names = [report_name for report_name in report_name_iter]
+        try:
+            fields = self._get_fields(args, self.REPORT_FIELDS)
+        except ValueError as err:
+            return (webob.exc.HTTPBadRequest(str(err)), None)
+        if fields is None:
+            fields = self.REPORT_FIELDS
+        tables = self._get_tables_details(req, fields)
         return ([
-            self._get_report_details(dbconn, report_name)
-            for report_name in report_names
+            self._get_report_details(name, comment, last_update, fields)
+            for (name, comment, last_update) in tables
         ], None)
 
     def operation_report_result_set(self, req, args):
         """
         Run a report, generating a result set.
+        The database is not used unless the result set must be generated.
+        If the 'fields' query parameter is given, only the named columns
+        are selected from the database.
+        Other query parameters filter the results, and may be suffixed
+        by an operator, as in 'start__gte=2015-01-01'; see parse_filters.
+        Each must name a column of the report.
+        If the 'bucket' query parameter is given, results are instead
+        aggregated into time buckets; see operation_report_aggregate.
+        If the 'points' query parameter is given, at most that many results
+        are returned, selected to preserve the shape of a chart of the
+        'value' column against the 'ts' column; see lttb.
         """
-        dbconn = self._connect_db()
+        if 'bucket' in args:
+            return self.operation_report_aggregate(req, args)
         table_name = args['report']
         del args['report']
-        server_modified = DBQueries.get_table_lastupdate(dbconn, table_name)
-        headers = [(
-            'Last-Modified',
-            format_date_time(mktime(server_modified.timetuple()))
-        )]
-        # Handle conditional requests
-        if not args:
-            if (
-                req.if_modified_since and
-                req.if_modified_since >= server_modified
-            ):
-                return (webob.exc.HTTPNotModified(), headers)
+        whole = not args
+        cache_key = self._get_cache_key(req, args)
+        page_args = dict(args)
+        if self._get_format(req) != 'json':
+            # Later pages are wanted in the same format
+            page_args['format'] = [self._get_format(req)]
+        self._set_dictionary_columns(req, args)
+        # The requested fields are validated only if the database is used
+        fields_args = dict(
+            (name, args.pop(name)) for name in (
+                ('fields', 'ts', 'value') if 'points' in args else ('fields',)
+            ) if name in args
+        )
+        try:
+            (limit, marker) = self._get_page_args(args)
+            points = self._get_points(args, fields_args)
+            if points is not None and limit is not None:
+                raise ValueError("Downsampled results cannot be paginated")
+            filters = DBQueries.parse_filters(args)
+        except ValueError as err:
+            return (webob.exc.HTTPBadRequest(str(err)), None)
+        (server_modified, etag, headers) = self._get_validators(
+            req, table_name, cache_key
+        )
+        # Handle conditional requests before any data is queried
+        not_modified = self._not_modified(
+            req, etag, server_modified,
+            headers + self._get_vary_headers(req)
+        )
+        if not_modified is not None:
+            return (not_modified, None)
+        if self.cache is not None:
+            entry = self.cache.get(table_name, cache_key, server_modified)
+            if entry is not None:
+                return (self._cached_response(req, entry, headers), None)
+        if self.store is not None and whole:
+            response = self._stored_response(
+                req, table_name, server_modified, headers
+            )
+            if response is not None:
+                return (response, None)
+        dbconn = self._connect_db(req)
+        try:
+            if fields_args or filters:
+                table_columns = self._get_columns(req, table_name)
+                self._check_filters(filters, table_columns)
+            columns = None
+            if fields_args:
+                columns = self._get_fields(fields_args, table_columns)
+                if columns is not None and not columns:
+                    raise ValueError("No fields requested")
+            if points is not None:
+                (ts_column, value_column) = [
+                    self._get_fields(fields_args, table_columns, name)[0]
+                    for name in ('ts', 'value')
+                ]
+                if columns is not None:
+                    # The downsampler needs the time and value columns
+                    columns.extend(
+                        column for column in (ts_column, value_column)
+                        if column not in columns
+                    )
+            if limit is not None:
+                key_columns = self._get_ordering_key(dbconn, table_name)
+                after = None
+                if marker is not None:
+                    after = self._decode_marker(marker, key_columns)
+        except ValueError as err:
+            return (webob.exc.HTTPBadRequest(str(err)), None)
         try:
-            result_set = DBQueries.filter_table(dbconn, table_name, args)
+            if points is not None:
+                # Count the results first, as each result set must be read
+                # entirely before the next query on the same connection
+                count = DBQueries.count_table(
+                    dbconn, table_name, filters, value_column
+                )
+                result_set = DBQueries.filter_table(
+                    dbconn, table_name, filters, [ts_column], columns=columns
+                )
+            elif limit is None:
+                result_set = DBQueries.filter_table(
+                    dbconn, table_name, filters, columns=columns
+                )
+            else:
+                width = None
+                if columns is not None:
+                    # Also select the key columns, to build the marker
+                    width = len(columns)
+                    columns = columns + [
+                        column for column in key_columns
+                        if column not in columns
+                    ]
+                # Fetch one extra result, to find out if there are more
+                result_set = RecordPage(DBQueries.filter_table(
+                    dbconn, table_name, filters, key_columns, after,
+                    limit + 1, columns
+                ), limit, width)
             # Pylint warns about catch-all exception handlers like that below.
             # The rationale is that this "prohibits the use of tailored
             # responses" - but that is exactly what we are attempting to do.
@@ -120,7 +765,136 @@ class APIv1App(APIVersion):
         except:
             # Don't leak information about the database
             return (webob.exc.HTTPBadRequest(), [])
-        return (result_set, headers)
+        if points is not None:
+            # The types of the columns are only known once they are queried
+            try:
+                result_set = DownsampledRecordSet(
+                    result_set, count, points, ts_column, value_column
+                )
+            except ValueError as err:
+                return (webob.exc.HTTPBadRequest(str(err)), None)
+        page_headers = []
+        if limit is not None and result_set.more:
+            page_headers.append(self._get_page_header(
+                table_name, page_args, result_set, key_columns
+            ))
+        headers.extend(page_headers)
+        return self._cacheable_response(
+            req, table_name, cache_key, server_modified, result_set,
+            headers, page_headers, whole
+        )
+
+    def _cacheable_response(
+        self, req, table_name, cache_key, server_modified, result_set,
+        headers, entry_headers, whole=False
+    ):
+        """
+        Return a (body, headers) tuple responding to the given request
+        with the given result set, which is cached, together with
+        the given entry headers, as it is streamed, if there is a cache,
+        and stored on disk if there is a store and it is the whole table.
+        """
+        store = self.store is not None and whole
+        if self.cache is None and not store:
+            return (result_set, headers)
+        response = self._build_response(req, result_set, headers)
+        if store:
+            response.app_iter = self.store.capture(
+                response.app_iter, table_name, server_modified,
+                self._get_format(req)
+            )
+        if self.cache is not None:
+            response.app_iter = self.cache.capture(
+                response.app_iter, table_name, cache_key, server_modified,
+                entry_headers
+            )
+        return (response, None)
+
+    def operation_report_aggregate(self, req, args):
+        """
+        Aggregate a report's results, grouping them by the values of
+        the columns named by the 'group_by' query parameter, and computing
+        the aggregates named by the 'aggregate' query parameter, such as
+        'sum(bytes)', for each group. Results are counted if no aggregates
+        are named. Other query parameters filter the results as for
+        report_result_set.
+        If the 'bucket' query parameter gives an interval, such as '5m',
+        results are also grouped into buckets of that length by the time
+        in the column named by the 'ts' query parameter, which also orders
+        values for the 'first' and 'last' aggregates.
+        The aggregation is performed by the database, and only one
+        result per group is returned.
+        """
+        table_name = args['report']
+        del args['report']
+        cache_key = ('aggregate',) + self._get_cache_key(req, args)
+        self._set_dictionary_columns(req, args)
+        # The requested columns are validated only if the database is used
+        group_args = dict(
+            (name, args.pop(name)) for name in ('group_by', 'ts')
+            if name in args
+        )
+        try:
+            aggregates = DBQueries.parse_aggregates([
+                spec.strip() for value in args.pop('aggregate', ['count'])
+                for spec in value.split(',') if spec.strip()
+            ])
+            bucket_seconds = None
+            if 'bucket' in args:
+                bucket_seconds = self._parse_interval(args.pop('bucket')[0])
+            filters = DBQueries.parse_filters(args)
+        except ValueError as err:
+            return (webob.exc.HTTPBadRequest(str(err)), None)
+        (server_modified, etag, headers) = self._get_validators(
+            req, table_name, cache_key
+        )
+        not_modified = self._not_modified(
+            req, etag, server_modified,
+            headers + self._get_vary_headers(req)
+        )
+        if not_modified is not None:
+            return (not_modified, None)
+        if self.cache is not None:
+            entry = self.cache.get(table_name, cache_key, server_modified)
+            if entry is not None:
+                return (self._cached_response(req, entry, headers), None)
+        dbconn = self._connect_db(req)
+        try:
+            columns = self._get_columns(req, table_name)
+            self._check_filters(filters, columns)
+            group_by = self._get_fields(group_args, columns, 'group_by') or []
+            ts_column = None
+            if 'ts' in group_args:
+                ts_column = self._get_fields(group_args, columns, 'ts')[0]
+            for (function, column) in aggregates:
+                if column is not None and column not in columns:
+                    raise ValueError("Unknown field '%s'" % column)
+                if (
+                    function in DBQueries.ORDERED_AGGREGATE_FUNCTIONS and
+                    ts_column is None
+                ):
+                    raise ValueError(
+                        "Aggregate '%s' needs a 'ts' column" % function
+                    )
+            if bucket_seconds is not None and ts_column is None:
+                raise ValueError("Buckets need a 'ts' column")
+        except ValueError as err:
+            return (webob.exc.HTTPBadRequest(str(err)), None)
+        try:
+            result_set = DBQueries.aggregate_table(
+                dbconn, table_name, filters, group_by, aggregates,
+                ts_column, bucket_seconds
+            )
+            # Pylint warns about catch-all exception handlers like that below,
+            # but as in operation_report_result_set, this is deliberate.
+            # pylint: disable=W0702
+        except:
+            # Don't leak information about the database
+            return (webob.exc.HTTPBadRequest(), [])
+        return self._cacheable_response(
+            req, table_name, cache_key, server_modified, result_set,
+            headers, []
+        )
 
 APIVersion.version_classes.append(APIv1App)
 
@@ -136,4 +910,112 @@ def app_factory(global_config, **local_config):
     config_file = ConfigParser.SafeConfigParser()
     if not config_file.read(config_file_name):
         raise ValueError("Cannot read config file '%s'" % config_file_name)
-    return APIv1App(config_file)
+    return APIv1App(config_file, local_config)
+
+
+class APIv1AppTestCase(TestCase):
+
+    """
+    Unit tests for the parts of APIv1App which need no database.
+    """
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    def testMarkerRoundTrip(self):
+        """
+        Test that a marker holds the values of several key columns,
+        with times in ISO 8601 format, and is safe in URLs.
+        """
+        # pylint: disable=W0212
+        marker = APIv1App._encode_marker(
+            [u'p1', 7, datetime(2015, 1, 2, 3, 4, 5), None, 2.5]
+        )
+        self.assertNotIn('=', marker)
+        self.assertEqual(marker, urllib.quote(marker))
+        self.assertEqual(
+            APIv1App._decode_marker(marker, ['a', 'b', 'c', 'd', 'e']),
+            [u'p1', 7, u'2015-01-02T03:04:05', None, 2.5]
+        )
+
+    def testCheckFilters(self):
+        """
+        Test that filters of unknown columns are rejected.
+        """
+        # pylint: disable=W0212
+        columns = ['id', 'project']
+        APIv1App._check_filters(
+            DBQueries.parse_filters(dict(id__gte=['1'], project=['a'])),
+            columns
+        )
+        for args in [
+            {'bytes': ['1']},
+            {'id; DROP TABLE usage': ['1']},
+            {'id__like': ['1']}
+        ]:
+            self.assertRaises(
+                ValueError, APIv1App._check_filters,
+                DBQueries.parse_filters(args), columns
+            )
+
+    def testNotModified(self):
+        """
+        Test answering conditional requests with 304 Not Modified when
+        the client holds any variant of the current response, carrying
+        the headers of the variant it holds.
+        """
+        # pylint: disable=W0212
+        server_modified = as_utc(datetime(2015, 6, 1, 12))
+        headers = [
+            ('Last-Modified', 'Mon, 01 Jun 2015 12:00:00 GMT'),
+            ('ETag', '"tag"'), ('Vary', 'Accept')
+        ]
+        for (request_headers, etag) in [
+            ({'If-None-Match': '"tag"'}, '"tag"'),
+            ({'If-None-Match': '"other", "tag-gzip"'}, '"tag-gzip"'),
+            ({'If-None-Match': '"tag-br"'}, '"tag-br"'),
+            ({'If-None-Match': '*'}, '"tag"'),
+            ({'If-None-Match': '"stale"'}, None),
+            ({'If-None-Match': '"tag-bogus"'}, None),
+            # If-None-Match takes precedence over If-Modified-Since
+            ({
+                'If-None-Match': '"stale"',
+                'If-Modified-Since': 'Mon, 01 Jun 2015 12:00:00 GMT'
+            }, None),
+            ({'If-Modified-Since': 'Mon, 01 Jun 2015 12:00:00 GMT'}, '"tag"'),
+            ({'If-Modified-Since': 'Mon, 01 Jun 2015 11:59:59 GMT'}, None),
+            ({}, None)
+        ]:
+            response = APIv1App._not_modified(
+                webob.Request.blank('/', headers=request_headers), 'tag',
+                server_modified, headers
+            )
+            if etag is None:
+                self.assertIsNone(response, request_headers)
+                continue
+            self.assertEqual(response.status_int, 304, request_headers)
+            self.assertEqual(response.headers['ETag'], etag)
+            self.assertEqual(response.headers['Vary'], 'Accept')
+
+    def testMalformedMarkers(self):
+        """
+        Test that malformed markers are rejected with ValueError,
+        which is reported as a bad request.
+        """
+        # pylint: disable=W0212
+        for marker in [
+            '', 'not a marker!', u'caf\xe9',
+            base64.urlsafe_b64encode('[1, '),
+            base64.urlsafe_b64encode('\xff\xfe'),
+            base64.urlsafe_b64encode('{"id": 1}'),
+            base64.urlsafe_b64encode('[[1], 2]'),
+            APIv1App._encode_marker([1, 2, 3])
+        ]:
+            self.assertRaises(
+                ValueError, APIv1App._decode_marker, marker, ['id', 'ts']
+            )
+
+
+if __name__ == '__main__':
+    test_main()
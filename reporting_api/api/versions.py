@@ -14,20 +14,21 @@ class VersionsApp(Application):
     of APIs understood by another WSGI application.
     """
 
-    def __init__(self):
-        super(VersionsApp, self).__init__(None)
+    def __init__(self, settings=None):
+        super(VersionsApp, self).__init__(None, settings)
 
     def operation_api_version_list(self, req, params):
         """
         Return a list of available API versions.
+        The list never changes, so is rendered only once.
         """
-        return (
+        return (self._static_response(req, lambda: (
             [
                 version.api_version_detail(req, params)
                 for version in APIVersion.version_classes
             ],
             None
-        )
+        )), None)
 
     def operation_api_version_details(self, req, params):
         """
@@ -41,4 +42,4 @@ def app_factory(global_config, **settings):
     """
     A factory function which returns WSGI version-list applications.
     """
-    return VersionsApp()
+    return VersionsApp(settings)
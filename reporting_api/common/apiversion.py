@@ -54,9 +54,11 @@ class APIVersion(KeystoneApplication):
             links=links
         )
 
-    @classmethod
-    def operation_api_version_details(cls, req, params):
+    def operation_api_version_details(self, req, params):
         """
         Return details of this API version.
+        These never change, so are rendered only once.
         """
-        return (cls.api_version_detail(req, params), None)
+        return (self._static_response(
+            req, lambda: (self.api_version_detail(req, params), None)
+        ), None)
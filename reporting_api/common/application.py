@@ -5,22 +5,213 @@ which responds to requests according to a Swagger API specification.
 
 from webob import Request, Response
 import abc
+import hashlib
 import webob.dec
 import webob.exc
+import zlib
+from unittest import main as test_main, TestCase
 from urlparse import parse_qs
-from swaggerapp.specification import SwaggerSpecification
-from swaggerapp.encoder import JSONStreamingEncoder
+from swaggerapp.backends import get_backend
+from swaggerapp.encoder import (
+    DEFAULT_CHUNK_SIZE, FORMATS, JSON_MEDIA_TYPE, get_engine
+)
+from reporting_api.common.cache import accepts_gzip, gzip_compress
 import logging
 
 
-# Pylint warns that the following class has too few public methods.
-# It is not intended to have many (or even any) public methods,
+# Pylint warns that the following classes have too few public methods.
+# They are not intended to have many (or even any) public methods,
 # so this is not a problem, so the following comment silences the warning.
 # Apparently, pylint assumes (falsely) that a class without public methods
-# is being abused as a mere holder of data - but the below class is being
-# used as a holder of code, as is common accepted practice in OOP.
+# is being abused as a mere holder of data - but the below classes are being
+# used as holders of code, as is common accepted practice in OOP.
 # pylint: disable=R0903
 
+class ClosingIter(object):
+
+    """
+    Wrap a WSGI app_iter so that the given callbacks are invoked
+    once the server closes it, which happens after the response
+    has been entirely sent or abandoned.
+    """
+
+    def __init__(self, app_iter, callbacks):
+        self.app_iter = app_iter
+        self.callbacks = callbacks
+
+    def __iter__(self):
+        return iter(self.app_iter)
+
+    def close(self):
+        """
+        Close the wrapped app_iter, then run each callback exactly once.
+        """
+        try:
+            if hasattr(self.app_iter, 'close'):
+                self.app_iter.close()
+        finally:
+            run_callbacks(self.callbacks)
+
+
+def run_callbacks(callbacks):
+    """
+    Remove and invoke each of the given callbacks in turn,
+    logging rather than propagating any errors, so that every one is run.
+    """
+    while callbacks:
+        callback = callbacks.pop(0)
+        try:
+            callback()
+        # Pylint warns about catch-all exception handlers like that below,
+        # but a failure to release one resource must not leak the rest.
+        # pylint: disable=W0702
+        except:
+            logging.exception("Error releasing request resources")
+
+
+def best_media_type(accept, offers):
+    """
+    Return whichever of the given media types is best accepted according
+    to the given Accept header value, preferring earlier media types when
+    several are accepted equally, or None if none is acceptable.
+    Each media type takes the quality of the most specific media range
+    matching it.
+    """
+    ranges = dict()
+    for item in accept.split(','):
+        params = item.strip().split(';')
+        media_range = params[0].strip().lower()
+        if not media_range:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            (key, _, value) = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ranges[media_range] = quality
+    (best, best_quality) = (None, 0.0)
+    for offer in offers:
+        quality = 0.0
+        for media_range in (offer, offer.split('/')[0] + '/*', '*/*'):
+            if media_range in ranges:
+                quality = ranges[media_range]
+                break
+        if quality > best_quality:
+            (best, best_quality) = (offer, quality)
+    return best
+
+
+class ResponseDescriptor(object):
+
+    """
+    Describes, once and for all, how the response to requests routed
+    to one Swagger operation is built: its status line, the top-level
+    JSON type of its body and whether that is an array, the headers
+    added to every response with a body, and the bound method handling
+    the operation, if there is one.
+    It also lists the output formats the operation produces, as
+    (name, media type, encoder class) tuples, most preferred first,
+    and the headers of responses in each format, which replace
+    Content-Type, and add Vary: Accept if there is a choice of formats.
+    """
+
+    __slots__ = (
+        'status', 'expected_type', 'array_not_object', 'headers', 'handler',
+        'formats', 'format_headers'
+    )
+
+    def __init__(
+        self, status, expected_type, headers, handler=None, formats=()
+    ):
+        self.status = status
+        self.expected_type = expected_type
+        if expected_type is None:
+            # Not sure what type to return
+            self.array_not_object = None
+        elif 'array' == expected_type:
+            # The specification says we're to return an array
+            self.array_not_object = True
+        elif 'object' == expected_type:
+            # The specification says we're to supply an object
+            self.array_not_object = False
+        else:
+            # A JSON response must be either an object or an array
+            raise ValueError(
+                "Cannot convert type '%s' into a valid JSON top-level type"
+                % expected_type
+            )
+        self.headers = headers
+        self.handler = handler
+        self.formats = tuple(formats)
+        vary = [('Vary', 'Accept')] if len(self.formats) > 1 else []
+        self.format_headers = dict(
+            (name, tuple([('Content-Type', media_type)] + [
+                (header, value) for (header, value) in headers
+                if header != 'Content-Type'
+            ] + vary))
+            for (name, media_type, _) in self.formats
+        )
+
+
+class StaticResponse(object):
+
+    """
+    A response which never changes, rendered once with a strong ETag and
+    a precomputed Content-Length, and also, unless compress_level is 0
+    or compression would not make it smaller, compressed once using gzip,
+    for clients which accept that.
+    Requests whose If-None-Match header matches the ETag of the variant
+    they would be sent are answered with 304 Not Modified.
+    """
+
+    def __init__(self, status, body, headers, compress_level=6):
+        self.status = status
+        etag = hashlib.sha1(body).hexdigest()
+        gzip_body = None
+        if compress_level:
+            gzip_body = gzip_compress(body, compress_level)
+            if len(gzip_body) >= len(body):
+                # Tiny bodies only grow when compressed
+                gzip_body = None
+        vary = [('Vary', 'Accept-Encoding')] if gzip_body else []
+        self.variants = [self._variant(etag, body, headers + vary)]
+        if gzip_body is not None:
+            self.variants.append(self._variant(
+                etag + '-gzip', gzip_body,
+                headers + [('Content-Encoding', 'gzip')] + vary
+            ))
+
+    @classmethod
+    def _variant(cls, etag, body, headers):
+        """
+        Return an (ETag, body, headers) tuple describing a variant of
+        this response.
+        """
+        return (etag, body, list(headers) + [
+            ('ETag', '"%s"' % etag), ('Content-Length', str(len(body)))
+        ])
+
+    def response(self, req):
+        """
+        Return a new response to the given request.
+        """
+        if len(self.variants) > 1 and accepts_gzip(req):
+            (etag, body, headers) = self.variants[1]
+        else:
+            (etag, body, headers) = self.variants[0]
+        if etag in req.if_none_match:
+            return Response(status=304, headerlist=[
+                (name, value) for (name, value) in headers
+                if name in ('ETag', 'Vary')
+            ])
+        return Response(
+            status=self.status, headerlist=list(headers), app_iter=[body]
+        )
+
+
 class Application(object):
 
     """
@@ -30,9 +221,111 @@ class Application(object):
 
     __metaclass__ = abc.ABCMeta
 
-    def __init__(self, configuration):
+    # WSGI environment key holding callbacks to run once the response
+    # to the current request has been sent
+    CLEANUP_KEY = 'reporting_api.cleanup'
+
+    # WSGI environment key holding the name of the output format
+    # negotiated for the current request
+    FORMAT_KEY = 'reporting_api.format'
+
+    # WSGI environment key holding a dictionary of any keyword arguments
+    # specific to the encoder of the current request's output format
+    ENCODER_OPTIONS_KEY = 'reporting_api.encoder_options'
+
+    def __init__(self, configuration, settings=None):
+        """
+        The configuration is this application's parsed INI file (if any),
+        and the settings are those given in its Paste Deploy section.
+        The 'output_chunk_size' setting gives the size, in bytes,
+        of the chunks in which response bodies are written,
+        the 'json_engine' setting names the JSON encoding engine,
+        the 'json_backend' setting names the serialiser used to encode
+        batches of rows, by default 'json', or is 'auto' to use the fastest
+        one installed, and the 'static_compress_level' setting gives the gzip
+        compression level of responses which never change, or is 0 not to
+        compress them.
+        Responses are JSON, unless an operation's Swagger specification
+        says it produces other media types, of the formats in
+        swaggerapp.encoder.FORMATS, in which case the format is negotiated
+        from the request's 'format' parameter or Accept header; see
+        _negotiate_format.
+        """
         super(Application, self).__init__()
         self.config = configuration
+        self.settings = settings or dict()
+        self.chunk_size = int(
+            self.settings.get('output_chunk_size', DEFAULT_CHUNK_SIZE)
+        )
+        self.encoder_class = get_engine(
+            self.settings.get('json_engine', 'generator')
+        )
+        self.json_backend = get_backend(
+            self.settings.get('json_backend', 'json')
+        )
+        # Bound methods handling operations, and error response classes for
+        # operations without them, by method name; see _get_handler
+        self._handlers = dict()
+        self._handler_errors = dict()
+        # Headers added to every response with a body
+        self._static_headers = tuple(
+            [('Content-Type', JSON_MEDIA_TYPE)] + self._headers()
+        )
+        # Output formats as (media type, encoder class) tuples, by name;
+        # which of them each operation offers is given by the media types
+        # its Swagger specification says it produces
+        self._formats = dict(json=(JSON_MEDIA_TYPE, self.encoder_class))
+        self._formats.update(FORMATS)
+        # Level at which responses which never change are compressed,
+        # or 0 not to compress them
+        self.static_compress_level = int(
+            self.settings.get('static_compress_level', 6)
+        )
+        # StaticResponses by Route and key; see _static_response
+        self._static_responses = dict()
+        # ResponseDescriptors by Route, and for OPTIONS requests
+        self._descriptors = dict()
+        self._options_descriptor = ResponseDescriptor(
+            '200 OK', None, self._static_headers,
+            formats=[self._get_format_details('json')]
+        )
+
+    @classmethod
+    def _on_close(cls, req, callback):
+        """
+        Arrange for the given callable to be invoked once the response
+        to the given request has been entirely sent, or abandoned.
+        This is used to hold resources, such as database connections,
+        for exactly as long as a streamed response body needs them.
+        """
+        req.environ.setdefault(cls.CLEANUP_KEY, []).append(callback)
+
+    @classmethod
+    def _attach_cleanup(cls, req, response):
+        """
+        Ensure any callbacks registered using _on_close for this request
+        will run when the given response is finished with.
+        """
+        callbacks = req.environ.get(cls.CLEANUP_KEY)
+        if not callbacks:
+            return response
+        if (
+            isinstance(response, webob.exc.WSGIHTTPException) or
+            not isinstance(response, Response)
+        ):
+            # Error bodies are generated on demand and hold no resources
+            run_callbacks(callbacks)
+        else:
+            response.app_iter = ClosingIter(response.app_iter, callbacks)
+        return response
+
+    @classmethod
+    def _release_resources(cls, req):
+        """
+        Run any callbacks registered using _on_close for this request now,
+        as its response turns out not to need the resources they release.
+        """
+        run_callbacks(req.environ.get(cls.CLEANUP_KEY, []))
 
     def _get_method(self, func_name):
         """
@@ -41,6 +334,149 @@ class Application(object):
         """
         return getattr(self, func_name, None)
 
+    def _get_handler(self, method_name):
+        """
+        Return the bound method with the given name handling an operation,
+        or None if there is no such public method, in which case
+        _handler_errors holds the class of error response to give instead.
+        Each name is looked up only once.
+        """
+        if method_name in self._handlers:
+            return self._handlers[method_name]
+        method = None
+        if method_name.startswith('_'):
+            # Attempt to call a private method
+            self._handler_errors[method_name] = webob.exc.HTTPForbidden
+        else:
+            method = self._get_method(method_name)
+            if method is None:
+                # Method specified in interface specification,
+                # but no matching Python method found
+                logging.warning(
+                    self.__class__.__name__ +
+                    " has no method '" +
+                    method_name + "'"
+                )
+                self._handler_errors[method_name] = \
+                    webob.exc.HTTPNotImplemented
+        self._handlers[method_name] = method
+        return method
+
+    def _get_format_details(self, name):
+        """
+        Return a (name, media type, encoder class) tuple describing
+        the output format with the given name.
+        """
+        return (name,) + self._formats[name]
+
+    def _get_route_formats(self, route):
+        """
+        Return a list of (name, media type, encoder class) tuples describing
+        the output formats of the given route's operation, in the order of
+        the media types its specification says it produces, ignoring those
+        with no encoder. JSON is always produced, if nothing else.
+        """
+        produces = route.operation.get(
+            'produces', route.spec.spec.get('produces', [JSON_MEDIA_TYPE])
+        )
+        names = dict(
+            (media_type, name)
+            for (name, (media_type, _)) in self._formats.items()
+        )
+        formats = [
+            self._get_format_details(names[media_type])
+            for media_type in produces if media_type in names
+        ]
+        return formats or [self._get_format_details('json')]
+
+    def _negotiate_format(self, req, args):
+        """
+        Return the name of the output format of the response to the
+        given request, given by its 'format' query argument, which is
+        removed from the given arguments, or else by its Accept header,
+        or None if the requested format is not offered.
+        Without either, or if the Accept header accepts none of
+        the formats offered, the most preferred format is chosen.
+        """
+        formats = self._get_descriptor(req).formats
+        if 'format' in args:
+            name = args.pop('format')[0]
+            if name in [details[0] for details in formats]:
+                return name
+            return None
+        accept = req.environ.get('HTTP_ACCEPT')
+        if accept and len(formats) > 1:
+            media_type = best_media_type(
+                accept, [details[1] for details in formats]
+            )
+            for (name, offer, _) in formats:
+                if offer == media_type:
+                    return name
+        return formats[0][0]
+
+    def _get_format(self, req):
+        """
+        Return the name of the output format negotiated for the given
+        request, which is JSON until one has been negotiated.
+        """
+        return req.environ.get(self.FORMAT_KEY, 'json')
+
+    def _get_format_headers(self, req):
+        """
+        Return the headers added to every response with a body
+        to the given request, given the negotiated output format.
+        """
+        descriptor = self._get_descriptor(req)
+        return descriptor.format_headers.get(
+            self._get_format(req), descriptor.headers
+        )
+
+    def _get_vary_headers(self, req):
+        """
+        Return the Vary headers of a response with a body to the given
+        request, which a 304 Not Modified response to it must also carry.
+        """
+        return [
+            (name, value) for (name, value) in self._get_format_headers(req)
+            if name == 'Vary'
+        ]
+
+    def _get_encoder(self, req):
+        """
+        Return an encoder of the output format negotiated for the given
+        request, given any options set for it by the request's handler.
+        """
+        return self._formats[self._get_format(req)][1](
+            chunk_size=self.chunk_size, backend=self.json_backend,
+            **req.environ.get(self.ENCODER_OPTIONS_KEY, {})
+        )
+
+    def _get_descriptor(self, req):
+        """
+        Return the ResponseDescriptor for the given request, describing
+        the operation to which it was routed, which is computed only
+        the first time each operation is requested.
+        """
+        route = req.environ['swagger'].get('route')
+        if (
+            route is None or route.operation is None or
+            "options" == req.environ['REQUEST_METHOD'].lower()
+        ):
+            return self._options_descriptor
+        descriptor = self._descriptors.get(route)
+        if descriptor is None:
+            descriptor = ResponseDescriptor(
+                self._expected_status(req, route.operation),
+                route.spec.resolve_refs(
+                    self._expected_schema(route.operation)
+                ),
+                self._static_headers,
+                self._get_handler(route.handler_name),
+                self._get_route_formats(route)
+            )
+            self._descriptors[route] = descriptor
+        return descriptor
+
     @classmethod
     def _expected_response(cls, operation):
         """
@@ -99,8 +535,32 @@ class Application(object):
         """
         return []
 
-    @classmethod
-    def _build_response(cls, req, return_value_iter, headers=None):
+    def _response_headers(self, headers=None):
+        """
+        Return the given list of response headers, plus those which should
+        be added to every response with a body.
+        """
+        if not headers:
+            headers = []
+        headers.extend(self._static_headers)
+        return headers
+
+    def _build_body_response(self, req, body, headers=None):
+        """
+        Build an HTTP response to the given request, with the given
+        already-encoded response body.
+        """
+        descriptor = self._get_descriptor(req)
+        if not headers:
+            headers = []
+        headers.extend(self._get_format_headers(req))
+        return Response(
+            status=descriptor.status,
+            body=body,
+            headers=headers
+        )
+
+    def _build_response(self, req, return_value_iter, headers=None):
         """
         Build an HTTP response to the given request, with response body
         containing the data output by the given iterator.
@@ -108,94 +568,64 @@ class Application(object):
         """
         if isinstance(return_value_iter, webob.exc.WSGIHTTPException):
             return return_value_iter
-        swagger = req.environ['swagger']
-        spec = swagger['spec']
-        if 'operation' in swagger:
-            operation = swagger['operation']
-        else:
-            operation = None
-        if operation:
-            schema = cls._expected_schema(operation)
-            expected_type = spec.resolve_refs(schema)
-        else:
-            schema = None
-            expected_type = None
-        status = cls._expected_status(req, operation)
+        descriptor = self._get_descriptor(req)
         if not headers:
             headers = []
-        """
-        TODO: XML response support, depending on content negotiation.
-        """
-        headers.append(('Content-Type', 'application/json'))
-        for tup in cls._headers():
-            headers.append(tup)
+        headers.extend(self._get_format_headers(req))
         if return_value_iter is None:
             return_value_iter = iter()
-        if expected_type is None:
-            # Not sure what type to return
-            array_not_object = None
-        elif 'array' == expected_type:
-            # The specification says we're to return an array
-            array_not_object = True
-        elif 'object' == expected_type:
-            # The specification says we're to supply an object
-            array_not_object = False
-        else:
-            # A JSON response must be either an object or an array
-            raise ValueError(
-                "Cannot convert type '%s' into a valid JSON top-level type"
-                % expected_type
-            )
-        encoder = JSONStreamingEncoder()
-        json_iter = encoder.to_json(return_value_iter, array_not_object)
+        body_iter = self._get_encoder(req).to_chunks(
+            return_value_iter, descriptor.array_not_object
+        )
         return Response(
-            status=status,
-            app_iter=json_iter,
+            status=descriptor.status,
+            app_iter=body_iter,
             headers=headers
         )
 
-    @classmethod
-    def _allowed_methods(cls, spec, path):
-        """
-        Which HTTP methods are allowed by the specification?
-        An OPTIONS method is permitted whether or not the specification
-        says so, since we synthesise those.
-        """
-        if spec is None:
-            methods = []
-        elif path is None:
-            methods = [
-                method.upper() for method in SwaggerSpecification.methods
-                if method != 'options'
-            ]
-        else:
-            methods = [
-                method.upper() for method in SwaggerSpecification.methods
-                if method != 'options' and method in path
-            ]
-        # Synthesise an OPTIONS method
-        methods.append('OPTIONS')
-        return methods
-
-    @classmethod
-    def _options_response(cls, req):
+    def _options_response(self, req):
         """
         Respond to OPTIONS requests meaningfully,
         implementing HATEOAS using the information in the Swagger catalogs.
+        The response for each path is rendered only once; see
+        _static_response.
         """
-        swagger = req.environ['swagger']
-        spec = swagger['spec']
-        path = swagger['path']
-        methods = cls._allowed_methods(spec, path)
-        if spec is None:
-            result = None
-        elif path is None:
-            result = spec
-        else:
-            result = path
-        headers = []
-        headers.append(('Allow', ','.join(methods)))
-        return cls._build_response(req, result, headers)
+        route = req.environ['swagger'].get('route')
+        if route is None:
+            # TODO: Include a link to the schema
+            return webob.exc.HTTPNotFound()
+        return self._static_response(
+            req, lambda: (route.path, [('Allow', ','.join(route.allow))]),
+            'options'
+        )
+
+    def _static_response(self, req, build, key=None):
+        """
+        Return a response to the given request, whose body is the value,
+        and whose headers include the headers, in the (value, headers) tuple
+        returned by calling build. This response must never change, so it
+        is built, encoded and compressed only the first time it is requested
+        for the operation to which the request was routed, the negotiated
+        output format and the given hashable key, and thereafter is served
+        from memory; see StaticResponse.
+        """
+        cache_key = (
+            req.environ['swagger'].get('route'), self._get_format(req), key
+        )
+        static = self._static_responses.get(cache_key)
+        if static is None:
+            (value, headers) = build()
+            descriptor = self._get_descriptor(req)
+            static = StaticResponse(
+                descriptor.status,
+                ''.join(self._get_encoder(req).to_chunks(
+                    value, descriptor.array_not_object
+                )),
+                (headers or []) + list(self._get_format_headers(req)),
+                self.static_compress_level
+            )
+            self._static_responses[cache_key] = static
+        return static.response(req)
 
     def _check_auth(self, req):
         """
@@ -207,9 +637,23 @@ class Application(object):
     @webob.dec.wsgify
     def __call__(self, req_dict):
         """
-        Match the given request in the Swagger specification.
-        Requires WSGI environment information from either SwaggerMapper
-        or SwaggerMiddleware.
+        Dispatch the given request, ensuring that resources it acquired
+        are released once the response is finished with.
+        """
+        req = Request(req_dict.environ)
+        try:
+            response = self._dispatch(req)
+        # Release resources whatever went wrong, then re-raise.
+        # pylint: disable=W0702
+        except:
+            run_callbacks(req.environ.get(self.CLEANUP_KEY, []))
+            raise
+        return self._attach_cleanup(req, response)
+
+    def _dispatch(self, req):
+        """
+        Dispatch the given request to the handler of the Swagger operation
+        it was routed to by SwaggerMiddleware.
 
         Respond with one of several things:
         - For an OPTIONS request, respond with part/all of the spec
@@ -217,10 +661,9 @@ class Application(object):
         - For a request that doesn't map to an operationId in the schema,
           or maps to something not defined in Python, or maps to a private
           method whose name begins with an underscore, an HTTP error
-        - The result of calling self.operation_<operationId>, which is expected to
-          return a ( body, headers ) tuple.
+        - The result of calling self.operation_<operationId>, which is
+          expected to return a ( body, headers ) tuple.
         """
-        req = Request(req_dict.environ)
         if "options" == req.environ['REQUEST_METHOD'].lower():
             # Intercept this request to return an OPTIONS response
             return self._options_response(req)
@@ -228,62 +671,31 @@ class Application(object):
         if not self._check_auth(req):
             # Authentication or authorisation failed
             return webob.exc.HTTPUnauthorized()
-        if 'wsgiorg.routing_args' in req.environ:
-            routing_args = req.environ['wsgiorg.routing_args']
-            method_params = routing_args[1]
-            if method_params:
-                method_name = method_params['method']
-            else:
-                # TODO: Include a link to the schema
-                return webob.exc.HTTPNotFound()
-        elif 'swagger' in req.environ:
-            swagger = req.environ['swagger']
-            logging.debug(swagger)
-            path = swagger['path']
-            operation = swagger['operation']
-            # If no Swagger path matched, 404 Not Found
-            if path is None:
-                logging.warning("No path matched requested URL")
-                # TODO: Include a link to the schema
-                return webob.exc.HTTPNotFound()
-            # If Swagger path matched, but no operation matched the HTTP
-            # method, HTTP Method Not Allowed
-            if operation is None:
-                logging.warning(
-                    "No matching operation in path in API specification"
-                )
-                logging.debug(path)
-                # Include an Allow header listing acceptable request methods
-                headers = []
-                methods = self._allowed_methods(swagger, path)
-                headers.append(('Allow', ','.join(methods)))
-                # TODO: Include a link to the schema
-                return webob.exc.HTTPMethodNotAllowed(headers=headers)
-            if 'operationId' not in operation:
-                # This condition is also checked at API spec load time
-                raise ValueError("No operationId in Swagger specification")
-            method_name = 'operation_' + operation['operationId']
-            method_params = swagger['parameters']
-        else:
-            logging.error(
-                "Neither wsgiorg.routing_args nor swagger in environment"
-            )
+        swagger = req.environ.get('swagger')
+        if swagger is None:
+            logging.error("No swagger in environment")
             logging.debug(req.environ)
             # TODO: Include a link to the schema
             return webob.exc.HTTPNotFound()
-        if method_name.startswith('_'):
-            # Attempt to call a private method
-            return webob.exc.HTTPForbidden()
-        method = self._get_method(method_name)
-        if method is None:
-            # Method specified in interface specification,
-            # but no matching Python method found
+        route = swagger['route']
+        # If no Swagger path matched, 404 Not Found
+        if route is None:
+            logging.warning("No path matched requested URL")
+            # TODO: Include a link to the schema
+            return webob.exc.HTTPNotFound()
+        # If Swagger path matched, but no operation matched the HTTP
+        # method, HTTP Method Not Allowed
+        if route.operation is None:
             logging.warning(
-                self.__class__.__name__ +
-                " has no method '" +
-                method_name + "'"
+                "No matching operation in path in API specification"
             )
-            return webob.exc.HTTPNotImplemented()
+            # Include an Allow header listing acceptable request methods
+            headers = [('Allow', ','.join(route.allow))]
+            # TODO: Include a link to the schema
+            return webob.exc.HTTPMethodNotAllowed(headers=headers)
+        method = self._get_descriptor(req).handler
+        if method is None:
+            return self._handler_errors[route.handler_name]()
         if ('QUERY_STRING' in req.environ) and req.environ['QUERY_STRING']:
             try:
                 query_params = parse_qs(
@@ -295,8 +707,111 @@ class Application(object):
                 )
         else:
             query_params = dict()
-        query_params.update(method_params)
+        query_params.update(swagger['parameters'])
+        output_format = self._negotiate_format(req, query_params)
+        if output_format is None:
+            return webob.exc.HTTPNotAcceptable(
+                "Unsupported output format requested"
+            )
+        req.environ[self.FORMAT_KEY] = output_format
         result, headers = method(req, query_params)
-        if isinstance(result, webob.exc.HTTPException):
+        if isinstance(result, (webob.exc.HTTPException, Response)):
+            # Already a complete response
             return result
         return self._build_response(req, result, headers)
+
+
+class StaticResponseTestCase(TestCase):
+
+    """
+    Unit tests for pre-rendered static responses.
+    """
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    BODY = '{"versions":[%s]}' % ','.join(['{"id":"v1"}'] * 50)
+
+    def setUp(self):
+        self.static = StaticResponse(
+            '200 OK', self.BODY, [('Content-Type', JSON_MEDIA_TYPE)]
+        )
+        self.etag = hashlib.sha1(self.BODY).hexdigest()
+
+    def testIdentity(self):
+        """
+        Test the uncompressed variant, whose ETag is the SHA-1 of its body.
+        """
+        response = self.static.response(Request.blank('/'))
+        self.assertEqual(response.status, '200 OK')
+        self.assertEqual(response.headers['ETag'], '"%s"' % self.etag)
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(
+            response.headers['Content-Length'], str(len(self.BODY))
+        )
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.body, self.BODY)
+
+    def testGzip(self):
+        """
+        Test the pre-compressed variant, sent to clients accepting gzip.
+        """
+        response = self.static.response(Request.blank(
+            '/', headers={'Accept-Encoding': 'gzip, deflate'}
+        ))
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['ETag'], '"%s-gzip"' % self.etag)
+        self.assertEqual(
+            zlib.decompress(response.body, 16 + zlib.MAX_WBITS), self.BODY
+        )
+        self.assertEqual(
+            response.headers['Content-Length'], str(len(response.body))
+        )
+
+    def testUncompressed(self):
+        """
+        Test that there is no compressed variant if compression is disabled
+        or would not make the body smaller.
+        """
+        for static in [
+            StaticResponse('200 OK', 'x', []),
+            StaticResponse('200 OK', self.BODY, [], compress_level=0)
+        ]:
+            self.assertEqual(len(static.variants), 1)
+            response = static.response(Request.blank(
+                '/', headers={'Accept-Encoding': 'gzip'}
+            ))
+            self.assertNotIn('Content-Encoding', response.headers)
+            self.assertNotIn('Vary', response.headers)
+
+    def testNotModified(self):
+        """
+        Test that a request whose If-None-Match header matches the ETag
+        of the variant it would be sent is answered with 304 Not Modified.
+        """
+        for (if_none_match, accept_encoding, status) in [
+            ('"%s"' % self.etag, None, 304),
+            ('"other", "%s"' % self.etag, None, 304),
+            ('"%s-gzip"' % self.etag, 'gzip', 304),
+            ('*', None, 304),
+            ('"%s"' % self.etag, 'gzip', 200),
+            ('"%s-gzip"' % self.etag, None, 200),
+            ('"stale"', None, 200)
+        ]:
+            headers = {'If-None-Match': if_none_match}
+            if accept_encoding is not None:
+                headers['Accept-Encoding'] = accept_encoding
+            response = self.static.response(
+                Request.blank('/', headers=headers)
+            )
+            self.assertEqual(response.status_int, status, if_none_match)
+            if status == 304:
+                self.assertEqual(
+                    sorted(response.headers.keys()), ['ETag', 'Vary']
+                )
+                self.assertEqual(response.body, '')
+
+
+if __name__ == '__main__':
+    test_main()
@@ -26,8 +26,8 @@ class KeystoneApplication(Application):
 
     INI_SECTION = 'keystone_authtoken'
 
-    def __init__(self, configuration):
-        super(KeystoneApplication, self).__init__(configuration)
+    def __init__(self, configuration, settings=None):
+        super(KeystoneApplication, self).__init__(configuration, settings)
         self.required_role = self.config.get('authorisation', 'required_role')
         if self.required_role is None:
             raise ValueError("No required role supplied")
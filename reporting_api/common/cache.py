@@ -0,0 +1,296 @@
+"""
+An in-process cache of encoded response bodies.
+"""
+
+import threading
+import zlib
+from collections import OrderedDict
+from unittest import main as test_main, TestCase
+
+
+def gzip_compress(body, level=6):
+    """
+    Return the given string compressed in gzip format.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+def accepts_gzip(req):
+    """
+    Return True if the given request says that it accepts responses
+    compressed using gzip. A request without an Accept-Encoding header
+    is not taken to accept compressed responses, though HTTP allows it.
+    """
+    return 'HTTP_ACCEPT_ENCODING' in req.environ \
+        and bool(req.accept_encoding.quality('gzip'))
+
+
+# Pylint warns that the following class has too few public methods.
+# It is not intended to have many (or even any) public methods,
+# so this is not a problem, so the following comment silences the warning.
+# Apparently, pylint assumes (falsely) that a class without public methods
+# is being abused as a mere holder of data - but the below class is being
+# used as a holder of code, as is common accepted practice in OOP.
+# pylint: disable=R0903
+
+class CacheEntry(object):
+
+    """
+    A cached response body, optionally with a gzip-compressed copy,
+    and a list of (name, value) tuples of headers specific to the body.
+    """
+
+    def __init__(self, last_update, body, gzip_body=None, headers=None):
+        self.last_update = last_update
+        self.headers = headers or []
+        self.body = body
+        self.gzip_body = gzip_body
+        self.size = len(body) + len(gzip_body or '')
+
+
+class ResponseCache(object):
+
+    """
+    A thread-safe, memory-bounded, least-recently-used cache of
+    encoded response bodies, each of which is the result of querying a
+    table in a particular way.
+
+    Entries are keyed by table name and a hashable key describing the
+    query, and are valid only for a particular last update time of the
+    table. Once a newer last update time is seen for a table, all of its
+    entries are discarded.
+    Bodies larger than max_entry_bytes are not cached, so that huge
+    responses are still streamed, and the least recently used entries
+    are evicted to keep the total size within max_bytes.
+    """
+
+    def __init__(
+        self, max_bytes, max_entry_bytes, compress=False, compress_level=6
+    ):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.compress = compress
+        self.compress_level = compress_level
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.last_updates = dict()
+        self.size = 0
+        self.counters = dict(
+            hits=0, misses=0, insertions=0, evictions=0, invalidations=0,
+            oversized=0
+        )
+
+    def _remove(self, key):
+        """
+        Remove the entry with the given key.
+        The caller must hold the lock.
+        """
+        self.size -= self.entries.pop(key).size
+
+    def _check_last_update(self, table_name, last_update):
+        """
+        Discard every entry for the given table if its last update time
+        differs from the given one.
+        The caller must hold the lock.
+        """
+        if self.last_updates.get(table_name, last_update) != last_update:
+            for key in [
+                key for key in self.entries if key[0] == table_name
+            ]:
+                self._remove(key)
+                self.counters['invalidations'] += 1
+        self.last_updates[table_name] = last_update
+
+    def get(self, table_name, key, last_update):
+        """
+        Return the CacheEntry for the given table, key and last update time,
+        or None if there is no such entry.
+        """
+        with self.lock:
+            self._check_last_update(table_name, last_update)
+            entry = self.entries.pop((table_name, key), None)
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            # Re-insert the entry to mark it most recently used
+            self.entries[(table_name, key)] = entry
+            self.counters['hits'] += 1
+            return entry
+
+    def put(self, table_name, key, last_update, body, headers=None):
+        """
+        Cache the given response body, and any headers specific to it,
+        for the given table, key and last update time, if it is small enough.
+        """
+        if len(body) > self.max_entry_bytes:
+            with self.lock:
+                self.counters['oversized'] += 1
+            return
+        gzip_body = None
+        if self.compress:
+            gzip_body = gzip_compress(body, self.compress_level)
+        entry = CacheEntry(last_update, body, gzip_body, headers)
+        with self.lock:
+            self._check_last_update(table_name, last_update)
+            if (table_name, key) in self.entries:
+                self._remove((table_name, key))
+            while self.entries and self.size + entry.size > self.max_bytes:
+                self._remove(self.entries.iterkeys().next())
+                self.counters['evictions'] += 1
+            if self.size + entry.size > self.max_bytes:
+                return
+            self.entries[(table_name, key)] = entry
+            self.size += entry.size
+            self.counters['insertions'] += 1
+
+    def capture(self, chunks, table_name, key, last_update, headers=None):
+        """
+        A generator which passes through the given chunks of a response body,
+        and once they have all been passed through, caches the whole body,
+        and any headers specific to it, if it is small enough.
+        A body which is not read to the end is not cached.
+        """
+        captured = []
+        size = 0
+        for chunk in chunks:
+            if captured is not None:
+                size += len(chunk)
+                if size > self.max_entry_bytes:
+                    captured = None
+                    with self.lock:
+                        self.counters['oversized'] += 1
+                else:
+                    captured.append(chunk)
+            yield chunk
+        if captured is not None:
+            self.put(
+                table_name, key, last_update, ''.join(captured), headers
+            )
+
+    def stats(self):
+        """
+        Return a dictionary of statistics describing this cache.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            stats.update(
+                entries=len(self.entries),
+                size=self.size,
+                max_bytes=self.max_bytes
+            )
+        return stats
+
+
+class ResponseCacheTestCase(TestCase):
+
+    """
+    Unit tests for the response cache.
+    """
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    def testHitAndMiss(self):
+        """
+        Test that a cached body and its headers are found again
+        by table, key and last update time.
+        """
+        cache = ResponseCache(1000, 100)
+        cache.put('usage', 'a', 1, 'body', [('Link', '<next>')])
+        entry = cache.get('usage', 'a', 1)
+        self.assertEqual(entry.body, 'body')
+        self.assertEqual(entry.headers, [('Link', '<next>')])
+        self.assertIsNone(entry.gzip_body)
+        self.assertIsNone(cache.get('usage', 'b', 1))
+        self.assertIsNone(cache.get('other', 'a', 1))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+        self.assertEqual((stats['entries'], stats['size']), (1, 4))
+
+    def testEviction(self):
+        """
+        Test that the least recently used entries are evicted
+        to keep the total size within max_bytes.
+        """
+        cache = ResponseCache(30, 30)
+        for key in 'abc':
+            cache.put('usage', key, 1, key * 10)
+        self.assertIsNotNone(cache.get('usage', 'a', 1))
+        cache.put('usage', 'd', 1, 'd' * 10)
+        self.assertIsNone(cache.get('usage', 'b', 1))
+        for key in 'acd':
+            self.assertEqual(cache.get('usage', key, 1).body, key * 10)
+        cache.put('usage', 'e', 1, 'e' * 25)
+        self.assertEqual(list(cache.entries), [('usage', 'e')])
+        stats = cache.stats()
+        self.assertEqual((stats['evictions'], stats['size']), (4, 25))
+
+    def testMaxEntryBytes(self):
+        """
+        Test that bodies larger than max_entry_bytes are not cached,
+        and that max_entry_bytes is at most max_bytes.
+        """
+        cache = ResponseCache(100, 15)
+        cache.put('usage', 'a', 1, 'a' * 16)
+        self.assertIsNone(cache.get('usage', 'a', 1))
+        self.assertEqual(cache.stats()['oversized'], 1)
+        self.assertEqual(ResponseCache(10, 15).max_entry_bytes, 10)
+
+    def testInvalidation(self):
+        """
+        Test that a new last update time of a table discards its entries,
+        but not those of other tables.
+        """
+        cache = ResponseCache(1000, 100)
+        cache.put('usage', 'a', 1, 'old')
+        cache.put('usage', 'b', 1, 'old')
+        cache.put('other', 'a', 1, 'kept')
+        self.assertIsNone(cache.get('usage', 'a', 2))
+        self.assertIsNone(cache.get('usage', 'b', 2))
+        self.assertEqual(cache.get('other', 'a', 1).body, 'kept')
+        stats = cache.stats()
+        self.assertEqual(stats['invalidations'], 2)
+        self.assertEqual((stats['entries'], stats['size']), (1, 4))
+        cache.put('usage', 'a', 2, 'new')
+        self.assertEqual(cache.get('usage', 'a', 2).body, 'new')
+
+    def testCompress(self):
+        """
+        Test that a gzip-compressed copy is cached and counted if asked for.
+        """
+        cache = ResponseCache(1000, 1000, compress=True)
+        body = '[%s]' % ','.join(['"value"'] * 50)
+        cache.put('usage', 'a', 1, body)
+        entry = cache.get('usage', 'a', 1)
+        self.assertEqual(
+            zlib.decompress(entry.gzip_body, 16 + zlib.MAX_WBITS), body
+        )
+        self.assertEqual(entry.size, len(body) + len(entry.gzip_body))
+
+    def testCapture(self):
+        """
+        Test that a streamed body is cached once it has been read whole,
+        but not if it is abandoned or grows too large.
+        """
+        cache = ResponseCache(1000, 10)
+        chunks = ['ab', 'cd', 'ef']
+        self.assertEqual(
+            list(cache.capture(iter(chunks), 'usage', 'whole', 1)), chunks
+        )
+        self.assertEqual(cache.get('usage', 'whole', 1).body, 'abcdef')
+        partial = cache.capture(iter(chunks), 'usage', 'partial', 1)
+        self.assertEqual(partial.next(), 'ab')
+        partial.close()
+        self.assertIsNone(cache.get('usage', 'partial', 1))
+        chunks = ['0123456', '789ab']
+        self.assertEqual(
+            list(cache.capture(iter(chunks), 'usage', 'large', 1)), chunks
+        )
+        self.assertIsNone(cache.get('usage', 'large', 1))
+        self.assertEqual(cache.stats()['oversized'], 1)
+
+
+if __name__ == '__main__':
+    test_main()
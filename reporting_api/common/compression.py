@@ -0,0 +1,587 @@
+"""
+A WSGI filter which compresses response bodies as they are streamed.
+"""
+
+import gzip
+import time
+import zlib
+from StringIO import StringIO
+from unittest import main as test_main, TestCase
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class ZlibCompressor(object):
+
+    """
+    Incrementally compresses a body in the 'deflate' format, that is,
+    zlib-wrapped DEFLATE data.
+    """
+
+    WBITS = zlib.MAX_WBITS
+
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, self.WBITS)
+
+    def compress(self, data):
+        """
+        Return as much compressed output for the given data as is ready,
+        which may be none.
+        """
+        return self.compressor.compress(data)
+
+    def sync(self):
+        """
+        Return the compressed output for all data given so far,
+        such that the client can decompress all of it, without ending
+        the compressed stream.
+        """
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        """
+        Return the remainder of the compressed output, ending the stream.
+        """
+        return self.compressor.flush()
+
+
+class GzipCompressor(ZlibCompressor):
+
+    """
+    Incrementally compresses a body in the 'gzip' format.
+    """
+
+    WBITS = 16 + zlib.MAX_WBITS
+
+
+class BrotliCompressor(ZlibCompressor):
+
+    """
+    Incrementally compresses a body in the 'br' format,
+    using the 'brotli' module, if installed.
+    """
+
+    # pylint: disable=W0231
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def sync(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class ZstdCompressor(ZlibCompressor):
+
+    """
+    Incrementally compresses a body in the 'zstd' format,
+    using the 'zstandard' module, if installed.
+    """
+
+    # pylint: disable=W0231
+    def __init__(self, level):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def sync(self):
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+
+# Compressors by content coding, in the order preferred
+# when a client accepts several equally.
+# Levels are given on zlib's scale of 1 to 9, to which brotli's and zstd's
+# scales are close enough at the bottom to be used unchanged.
+COMPRESSORS = (
+    ('zstd', ZstdCompressor if zstandard is not None else None),
+    ('br', BrotliCompressor if brotli is not None else None),
+    ('gzip', GzipCompressor),
+    ('deflate', ZlibCompressor)
+)
+
+# The names of all content codings which may be produced
+CONTENT_CODINGS = tuple(name for (name, _) in COMPRESSORS)
+
+# Media types of bodies worth compressing, including any with the +json
+# or +xml structured syntax suffix, such as the compact JSON format's
+COMPRESSIBLE_TYPES = (
+    'application/json', 'application/x-ndjson', 'application/xml',
+    'text/*', '*+json', '*+xml'
+)
+
+
+def _parse_accept_encoding(value):
+    """
+    Return a dictionary of the quality values of the content codings
+    listed in the given Accept-Encoding header value.
+    """
+    qualities = dict()
+    for item in value.split(','):
+        params = item.strip().split(';')
+        name = params[0].strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            (key, _, number) = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+    return qualities
+
+
+def _is_compressible(content_type, types):
+    """
+    Return True if the given Content-Type header value names
+    one of the given media types, which may end in '/*', or be '*'
+    followed by a structured syntax suffix such as '+json'.
+    """
+    media_type = content_type.split(';')[0].strip().lower()
+    for pattern in types:
+        if pattern.endswith('/*'):
+            if media_type.startswith(pattern[:-1]):
+                return True
+        elif pattern.startswith('*+'):
+            if media_type.endswith(pattern[1:]):
+                return True
+        elif media_type == pattern:
+            return True
+    return False
+
+
+class CompressingIter(object):
+
+    """
+    Wrap a WSGI app_iter so that its chunks are compressed as they pass,
+    by the compressor found in the given state once the first non-empty
+    chunk has been produced, as an application may start its response
+    only then.
+    If there is no compressor, chunks are passed through unchanged.
+    Compressed output is flushed, so that the client can decompress
+    everything received so far, after the first chunk, to keep the time
+    to first byte low, and after that whenever flush_size bytes of input
+    or flush_interval seconds have passed since the last flush, so that
+    memory use stays bounded and slow responses still trickle out.
+    Both are only checked as each chunk arrives: a filter cannot yield
+    while the application is producing its next chunk, so output held by
+    the compressor during a stall is flushed with the chunk that ends it,
+    however long that takes.
+    """
+
+    def __init__(self, app_iter, state, flush_size, flush_interval):
+        self.app_iter = app_iter
+        self.state = state
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+    def __iter__(self):
+        chunks = iter(self.app_iter)
+        # The response need only be started before the first non-empty chunk
+        first = None
+        for chunk in chunks:
+            if chunk:
+                first = chunk
+                break
+        compressor = self.state['compressor']
+        if compressor is None:
+            if first is not None:
+                yield first
+            for chunk in chunks:
+                yield chunk
+            return
+        if first is not None:
+            yield compressor.compress(first) + compressor.sync()
+        (pending, last_flush) = (0, time.time())
+        for chunk in chunks:
+            output = compressor.compress(chunk)
+            pending += len(chunk)
+            if (
+                pending >= self.flush_size or
+                time.time() - last_flush >= self.flush_interval
+            ):
+                output += compressor.sync()
+                (pending, last_flush) = (0, time.time())
+            if output:
+                yield output
+        yield compressor.finish()
+
+    def close(self):
+        """
+        Close the wrapped app_iter.
+        """
+        if hasattr(self.app_iter, 'close'):
+            self.app_iter.close()
+
+
+class CompressionMiddleware(object):
+
+    """
+    A WSGI filter which compresses the bodies of responses in the content
+    coding best accepted by the client, chunk by chunk as they are
+    streamed, so that, unlike filters which compress the whole body
+    before responding, memory use stays bounded and the first bytes are
+    sent as soon as they are produced.
+
+    Responses are passed through unchanged if they are already encoded,
+    forbid transformation, have no body, are not of a compressible
+    media type, or are known to be smaller than min_size bytes.
+    Bodies known to be smaller than large_size bytes are compressed at
+    compress_level; larger bodies, and streamed bodies of unknown length,
+    which are typically large, at the cheaper large_compress_level.
+    Each entity tag of a compressed response is suffixed by '-' and
+    the content coding, as the compressed body is a different
+    representation.
+    """
+
+    def __init__(
+        self, application, encodings=CONTENT_CODINGS, compress_level=6,
+        large_compress_level=1, large_size=1024 * 1024, min_size=256,
+        flush_size=64 * 1024, flush_interval=1.0,
+        types=COMPRESSIBLE_TYPES
+    ):
+        self.application = application
+        compressors = dict(COMPRESSORS)
+        for name in encodings:
+            if name not in compressors:
+                raise ValueError("Unknown content coding '%s'" % name)
+        # Content codings which are not available are silently skipped
+        self.compressors = [
+            (name, compressors[name]) for name in encodings
+            if compressors[name] is not None
+        ]
+        self.compress_level = compress_level
+        self.large_compress_level = large_compress_level
+        self.large_size = large_size
+        self.min_size = min_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.types = types
+
+    def _choose_encoding(self, environ):
+        """
+        Return the name and compressor class of the content coding
+        the client best accepts, or (None, None) to send the body as it is.
+        A request without an Accept-Encoding header is not taken to accept
+        compressed responses, though HTTP allows it.
+        """
+        if 'HTTP_ACCEPT_ENCODING' not in environ:
+            return (None, None)
+        qualities = _parse_accept_encoding(environ['HTTP_ACCEPT_ENCODING'])
+        (best, best_quality) = ((None, None), 0.0)
+        for (name, compressor) in self.compressors:
+            quality = qualities.get(name, qualities.get('*', 0.0))
+            if quality > best_quality:
+                (best, best_quality) = ((name, compressor), quality)
+        return best
+
+    def _is_eligible(self, status, headers):
+        """
+        Return True if a response with the given status and headers
+        may be compressed.
+        """
+        code = int(status.split(None, 1)[0])
+        if code < 200 or code in (204, 304):
+            return False
+        content_type = None
+        for (name, value) in headers:
+            name = name.lower()
+            if name == 'content-encoding' and value.strip().lower() not in (
+                '', 'identity'
+            ):
+                return False
+            if name == 'cache-control' and 'no-transform' in value.lower():
+                return False
+            if name == 'content-length' and value.strip().isdigit() and \
+                    int(value) < self.min_size:
+                return False
+            if name == 'content-type':
+                content_type = value
+        return content_type is not None and _is_compressible(
+            content_type, self.types
+        )
+
+    def _get_level(self, headers):
+        """
+        Return the compression level for a body with the given headers.
+        """
+        for (name, value) in headers:
+            if name.lower() == 'content-length' and value.strip().isdigit():
+                if int(value) < self.large_size:
+                    return self.compress_level
+        return self.large_compress_level
+
+    @classmethod
+    def _add_vary(cls, headers):
+        """
+        Return the given headers, with Accept-Encoding added to Vary.
+        """
+        for (name, value) in headers:
+            if name.lower() == 'vary' and 'accept-encoding' in [
+                field.strip().lower() for field in value.split(',')
+            ]:
+                return headers
+        return headers + [('Vary', 'Accept-Encoding')]
+
+    @classmethod
+    def _encode_headers(cls, headers, encoding):
+        """
+        Return the given headers, adjusted for a body compressed
+        using the given content coding.
+        """
+        encoded = []
+        for (name, value) in headers:
+            lower = name.lower()
+            if lower == 'content-length':
+                continue
+            if lower == 'etag' and value.endswith('"'):
+                value = value[:-1] + '-' + encoding + '"'
+            encoded.append((name, value))
+        encoded.append(('Content-Encoding', encoding))
+        return encoded
+
+    def __call__(self, environ, start_response):
+        state = dict(started=False, compressor=None)
+
+        def compressing_start_response(status, headers, exc_info=None):
+            """
+            Decide whether to compress the response, and start it with
+            headers adjusted accordingly.
+            """
+            state.update(started=True, compressor=None)
+            if not self._is_eligible(status, headers):
+                return start_response(status, headers, exc_info)
+            headers = self._add_vary(headers)
+            (encoding, compressor) = self._choose_encoding(environ)
+            if encoding is None:
+                return start_response(status, headers, exc_info)
+            compressor = compressor(self._get_level(headers))
+            state['compressor'] = compressor
+            write = start_response(
+                status, self._encode_headers(headers, encoding), exc_info
+            )
+            return lambda data: write(
+                compressor.compress(data) + compressor.sync()
+            )
+
+        app_iter = self.application(environ, compressing_start_response)
+        if state['started'] and state['compressor'] is None:
+            return app_iter
+        return CompressingIter(
+            app_iter, state, self.flush_size, self.flush_interval
+        )
+
+
+def filter_factory(global_config, **local_config):
+    """
+    A factory function which produces compression WSGI filters.
+    """
+    options = dict()
+    if 'encodings' in local_config:
+        options['encodings'] = local_config['encodings'].split()
+    if 'types' in local_config:
+        options['types'] = tuple(local_config['types'].split())
+    for name in (
+        'compress_level', 'large_compress_level', 'large_size', 'min_size',
+        'flush_size'
+    ):
+        if name in local_config:
+            options[name] = int(local_config[name])
+    if 'flush_interval' in local_config:
+        options['flush_interval'] = float(local_config['flush_interval'])
+
+    def compression_filter(app):
+        """
+        Wrap the given WSGI application in a compression filter.
+        """
+        return CompressionMiddleware(app, **options)
+    return compression_filter
+
+
+class CompressionTestCase(TestCase):
+
+    """
+    Unit tests for the compression filter.
+    """
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    BODY = '{"columns":["name"],"rows":[%s]}' % ','.join(['["value"]'] * 100)
+
+    def respond(
+        self, content_type, accept_encoding='gzip', headers=(), chunks=None,
+        status='200 OK', **options
+    ):
+        """
+        Return the status, headers and list of body chunks of a response
+        with the given status, type, further headers and chunks, by default
+        the test body, from an application wrapped in a compression filter
+        with the given options, to a request accepting the given content
+        codings, if any.
+        """
+        def application(environ, start_response):
+            """
+            Respond with the test chunks.
+            """
+            # pylint: disable=W0613
+            start_response(
+                status, [('Content-Type', content_type)] + list(headers)
+            )
+            return [self.BODY] if chunks is None else chunks
+        environ = dict()
+        if accept_encoding is not None:
+            environ['HTTP_ACCEPT_ENCODING'] = accept_encoding
+        started = []
+        output = list(CompressionMiddleware(application, **options)(
+            environ, lambda status, headers, exc_info=None: started.append(
+                (status, dict(headers))
+            )
+        ))
+        return started[0] + (output,)
+
+    def testCompressible(self):
+        """
+        Test recognising compressible media types.
+        """
+        for content_type in (
+            'application/json', 'text/csv; charset=utf-8',
+            'application/vnd.reporting.compact+json', 'image/svg+xml'
+        ):
+            self.assertTrue(
+                _is_compressible(content_type, COMPRESSIBLE_TYPES)
+            )
+        for content_type in (
+            'application/vnd.apache.parquet', 'application/jsonx',
+            'image/png'
+        ):
+            self.assertFalse(
+                _is_compressible(content_type, COMPRESSIBLE_TYPES)
+            )
+
+    def testChooseEncoding(self):
+        """
+        Test choosing the content coding best accepted by the client.
+        """
+        # pylint: disable=W0212
+        self.assertEqual(
+            _parse_accept_encoding('gzip;q=0.5, BR, identity;q=0, x;q=?,'),
+            dict(gzip=0.5, br=1.0, identity=0.0, x=0.0)
+        )
+        middleware = CompressionMiddleware(None, encodings=('gzip', 'deflate'))
+        for (accept_encoding, expected) in [
+            ('deflate;q=0.5, *;q=0.8', 'gzip'),
+            ('deflate, gzip', 'gzip'),
+            ('gzip;q=0, br', None),
+            (None, None)
+        ]:
+            environ = dict()
+            if accept_encoding is not None:
+                environ['HTTP_ACCEPT_ENCODING'] = accept_encoding
+            self.assertEqual(
+                middleware._choose_encoding(environ)[0], expected
+            )
+
+    def testStreamed(self):
+        """
+        Test that a streamed response is compressed chunk by chunk,
+        with output flushed whenever flush_size bytes or flush_interval
+        seconds have passed, and its headers adjusted.
+        """
+        chunks = [self.BODY] * 4
+        for options in [
+            dict(flush_size=len(self.BODY), flush_interval=3600),
+            dict(flush_size=1024 * 1024, flush_interval=0)
+        ]:
+            (_, headers, output) = self.respond(
+                'application/json', chunks=chunks, headers=[
+                    ('ETag', '"tag"'),
+                    ('Content-Length', str(len(''.join(chunks))))
+                ], **options
+            )
+            self.assertEqual(headers['Content-Encoding'], 'gzip')
+            self.assertEqual(headers['ETag'], '"tag-gzip"')
+            self.assertEqual(headers['Vary'], 'Accept-Encoding')
+            self.assertNotIn('Content-Length', headers)
+            # Each chunk can be decompressed as soon as it is received
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            for (count, data) in enumerate(output[:len(chunks)]):
+                self.assertEqual(
+                    decompressor.decompress(data), self.BODY,
+                    'Chunk %d not flushed' % count
+                )
+            self.assertEqual(
+                gzip.GzipFile(fileobj=StringIO(''.join(output))).read(),
+                ''.join(chunks)
+            )
+
+    def testCompactCompressed(self):
+        """
+        Test that a compact JSON response is compressed.
+        """
+        (_, headers, output) = self.respond(
+            'application/vnd.reporting.compact+json'
+        )
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(
+            gzip.GzipFile(fileobj=StringIO(''.join(output))).read(),
+            self.BODY
+        )
+
+    def testNotAccepted(self):
+        """
+        Test that a compressible response is sent as it is, though varying
+        by Accept-Encoding, to a client accepting no content coding.
+        """
+        (_, headers, output) = self.respond(
+            'application/json', accept_encoding=None
+        )
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(output, [self.BODY])
+
+    def testIneligiblePassed(self):
+        """
+        Test that responses which must not or need not be compressed
+        are passed through.
+        """
+        for (status, headers, chunks) in [
+            ('304 Not Modified', [], []),
+            ('200 OK', [('Content-Length', '10')], ['0123456789']),
+            ('200 OK', [('Cache-Control', 'no-transform')], [self.BODY]),
+            ('200 OK', [('Content-Encoding', 'br')], [self.BODY])
+        ]:
+            (_, started, output) = self.respond(
+                'application/json', status=status, headers=headers,
+                chunks=chunks
+            )
+            self.assertNotIn('Vary', started)
+            self.assertEqual(output, chunks)
+
+    def testIncompressiblePassed(self):
+        """
+        Test that a response of an incompressible type is passed through.
+        """
+        (_, headers, output) = self.respond(
+            'application/vnd.apache.arrow.stream'
+        )
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(output, [self.BODY])
+
+
+if __name__ == '__main__':
+    test_main()
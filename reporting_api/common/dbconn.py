@@ -2,8 +2,15 @@
 Represents a connection to an RDBMS.
 """
 
+import sys
+import threading
+import time
+from collections import deque
+from itertools import chain, imap
+from operator import itemgetter
+from unittest import main as test_main, TestCase
 import mysql.connector
-from mysql.connector import InterfaceError
+from mysql.connector import Error, FieldFlag, FieldType, InterfaceError
 
 
 class DBConnection(object):
@@ -11,8 +18,14 @@ class DBConnection(object):
     Represents a connection to an RDBMS.
     """
 
-    def __init__(self, **kwargs):
+    def __init__(
+        self, fetch_batch_size=None, fetch_batch_memory=None, **kwargs
+    ):
         """
+        Rows of large result sets are fetched fetch_batch_size at a time,
+        or if that is not given, in batches of about fetch_batch_memory
+        bytes, which are passed on to ResultSet.
+
         MySQL stores TIMESTAMP values as UTC, but automatically converts them
         to/from the 'current time zone' on output/input (respectively).
         By default, the 'current time zone' is the server's time zone,
@@ -22,7 +35,28 @@ class DBConnection(object):
         """
         if 'time_zone' not in kwargs:
             kwargs['time_zone'] = '+00:00'
+        self.fetch_batch_size = fetch_batch_size
+        self.fetch_batch_memory = fetch_batch_memory
         self.conn = mysql.connector.connect(**kwargs)
+        self.created = time.time()
+
+    def is_reusable(self):
+        """
+        Return True if this connection may be handed to another user.
+        A connection still holding unread rows from an unbuffered cursor
+        (for instance because a client abandoned a streamed response)
+        cannot run another query, so must not be reused.
+        """
+        return not self.conn.unread_result
+
+    def close(self):
+        """
+        Close this connection, ignoring errors from an already-dead one.
+        """
+        try:
+            self.conn.close()
+        except Error:
+            pass
 
     def _before_db(self):
         """
@@ -76,6 +110,205 @@ class DBConnection(object):
         return self.conn.converter.escape(identifier)
 
 
+class PoolTimeout(RuntimeError):
+
+    """
+    Raised when no pooled connection became available in time.
+    """
+
+
+class ConnectionPool(object):
+
+    """
+    A bounded, thread-safe pool of DBConnections.
+
+    Between min_size and max_size connections are kept open.
+    Idle connections beyond min_size are closed after idle_timeout seconds,
+    and any connection is closed once it is older than max_lifetime seconds,
+    so that server-side timeouts and failovers are tolerated.
+    A timeout or lifetime of 0 disables the corresponding eviction.
+    Connections are opened by calling factory, by default DBConnection,
+    with the remaining keyword arguments.
+    """
+
+    # Connections idle for longer than this many seconds are pinged,
+    # and reconnected if necessary, before being handed out again
+    PING_AFTER_IDLE = 30
+
+    def __init__(
+        self, min_size=0, max_size=10, idle_timeout=300, max_lifetime=3600,
+        acquire_timeout=30, factory=DBConnection, **kwargs
+    ):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(
+                "Invalid pool size bounds %d..%d" % (min_size, max_size)
+            )
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.acquire_timeout = acquire_timeout
+        self.factory = factory
+        self.connect_args = kwargs
+        self.lock = threading.Condition()
+        # Idle connections, most recently released at the right
+        self.idle = deque()
+        self.size = 0
+        self.closed = False
+        self.counters = dict(
+            created=0, closed=0, acquired=0, waited=0, timeouts=0
+        )
+        for _ in range(min_size):
+            self.size += 1
+            self.idle.append((self._create(), time.time()))
+
+    def _create(self):
+        """
+        Open a new connection.
+        The caller must already have reserved a slot by incrementing size.
+        """
+        try:
+            conn = self.factory(**self.connect_args)
+        # Give back the reserved slot whatever went wrong, then re-raise.
+        # pylint: disable=W0702
+        except:
+            with self.lock:
+                self.size -= 1
+                self.lock.notify()
+            raise
+        with self.lock:
+            self.counters['created'] += 1
+        return conn
+
+    def _discard(self, conn):
+        """
+        Close a connection which was counted against this pool.
+        The caller must hold the lock.
+        """
+        conn.close()
+        self.size -= 1
+        self.counters['closed'] += 1
+        self.lock.notify()
+
+    def _expired(self, conn, now):
+        """
+        Has the given connection outlived its maximum lifetime?
+        """
+        return self.max_lifetime and now - conn.created > self.max_lifetime
+
+    def _evict(self, now):
+        """
+        Close idle connections which have been idle or alive for too long.
+        The caller must hold the lock.
+        """
+        kept = deque()
+        while self.idle:
+            conn, released = self.idle.popleft()
+            if self._expired(conn, now) or (
+                self.idle_timeout and
+                now - released > self.idle_timeout and
+                self.size > self.min_size
+            ):
+                self._discard(conn)
+            else:
+                kept.append((conn, released))
+        self.idle = kept
+
+    def acquire(self):
+        """
+        Check a connection out of this pool, opening one if none is idle
+        and the pool is not yet full, or else waiting for one to be
+        released. Raise PoolTimeout if none becomes available in time.
+        """
+        deadline = None
+        with self.lock:
+            while True:
+                now = time.time()
+                self._evict(now)
+                if self.idle:
+                    # Reuse the most recently used, hence warmest, connection
+                    conn, released = self.idle.pop()
+                    self.counters['acquired'] += 1
+                    break
+                if self.size < self.max_size:
+                    self.size += 1
+                    self.counters['acquired'] += 1
+                    conn = None
+                    break
+                if deadline is None:
+                    self.counters['waited'] += 1
+                    deadline = now + self.acquire_timeout
+                if now >= deadline:
+                    self.counters['timeouts'] += 1
+                    raise PoolTimeout(
+                        "No database connection available after %ss"
+                        % self.acquire_timeout
+                    )
+                self.lock.wait(deadline - now)
+        if conn is None:
+            return self._create()
+        if now - released > self.PING_AFTER_IDLE:
+            conn._before_db()
+        return conn
+
+    def release(self, conn):
+        """
+        Return a connection previously obtained from acquire.
+        Connections which cannot safely be reused are closed instead.
+        """
+        with self.lock:
+            if (
+                not self.closed and
+                conn.is_reusable() and
+                not self._expired(conn, time.time())
+            ):
+                self.idle.append((conn, time.time()))
+                self.lock.notify()
+            else:
+                self._discard(conn)
+
+    def close(self):
+        """
+        Close all idle connections.
+        Connections currently checked out are closed upon release.
+        """
+        with self.lock:
+            while self.idle:
+                self._discard(self.idle.popleft()[0])
+            self.closed = True
+
+    def stats(self):
+        """
+        Return a dictionary of statistics describing this pool.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            stats.update(
+                size=self.size,
+                idle=len(self.idle),
+                in_use=self.size - len(self.idle),
+                min_size=self.min_size,
+                max_size=self.max_size
+            )
+        return stats
+
+
+# Number of rows fetched per round trip while the width of rows is unknown
+INITIAL_BATCH_SIZE = 64
+# Upper bound on the number of rows fetched per round trip
+MAX_BATCH_SIZE = 10000
+# Approximate memory, in bytes, which each fetched batch of rows may occupy
+DEFAULT_BATCH_MEMORY = 1024 * 1024
+
+
+def _row_size(row):
+    """
+    Estimate the memory, in bytes, occupied by the given row.
+    """
+    values = row.values() if isinstance(row, dict) else row
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in values)
+
+
 # Pylint warns that the following class has too few public methods.
 # The class has the sole public method that it is intended to have,
 # so the following comment disables the warning.
@@ -85,10 +318,50 @@ class CursorIter(object):
 
     """
     Iterate over a cursor's emitted rows.
+    Rows are fetched from the cursor in batches, to avoid the overhead of a
+    fetch per row. If no batch size is given, the batch size adapts to the
+    width of the rows, so that each batch occupies about batch_memory bytes.
     """
 
-    def __init__(self, cursor):
+    def __init__(self, cursor, batch_size=None, batch_memory=None):
         self.cursor = cursor
+        self.batch_size = batch_size
+        self.batch_memory = batch_memory or DEFAULT_BATCH_MEMORY
+        self.rows = self._rows()
+
+    def __iter__(self):
+        return self
+
+    def _rows(self):
+        """
+        Return an iterator over the rows in each batch.
+        """
+        return chain.from_iterable(self.batches())
+
+    def _adapted_batch_size(self, batch):
+        """
+        Given a batch of rows, return the number of such rows
+        which fit within the memory budget for a batch.
+        """
+        sample = batch[:INITIAL_BATCH_SIZE]
+        row_size = sum(_row_size(row) for row in sample) / len(sample)
+        return max(1, min(MAX_BATCH_SIZE, self.batch_memory // row_size))
+
+    def batches(self):
+        """
+        A generator which successively yields non-empty lists of rows
+        fetched from this cursor, until the cursor is exhausted.
+        """
+        size = self.batch_size or INITIAL_BATCH_SIZE
+        while True:
+            batch = self.cursor.fetchmany(size)
+            if batch:
+                yield batch
+            if len(batch) < size:
+                # A short batch means the cursor is exhausted
+                return
+            if not self.batch_size:
+                size = self._adapted_batch_size(batch)
 
     def next(self):
         """
@@ -96,10 +369,7 @@ class CursorIter(object):
         Raise StopIteration if the cursor is exhausted,
         ie all of its rows have already been read.
         """
-        row = self.cursor.fetchone()
-        if row is None:
-            raise StopIteration()
-        return row
+        return self.rows.next()
 
 
 class CursorSliceIter(CursorIter):
@@ -109,18 +379,18 @@ class CursorSliceIter(CursorIter):
     so that the n'th column of each row is emitted.
     """
 
-    def __init__(self, cursor, index):
-        super(CursorSliceIter, self).__init__(cursor)
+    def __init__(self, cursor, index, batch_size=None, batch_memory=None):
         self.index = index
+        super(CursorSliceIter, self).__init__(
+            cursor, batch_size, batch_memory
+        )
 
-    def next(self):
+    def _rows(self):
         """
-        Return one column of the next row yielded by this cursor.
-        Raise StopIteration if the cursor is exhausted,
-        ie all of its rows have already been read.
+        Return an iterator over one column of the rows in each batch.
         """
-        row = super(CursorSliceIter, self).next()
-        return row[self.index]
+        rows = super(CursorSliceIter, self)._rows()
+        return imap(itemgetter(self.index), rows)
 
 
 # Pylint warns that the following class has too few public methods.
@@ -135,13 +405,25 @@ class ResultSet(object):
 
     """
     An iterable SQL result set.
+    Iteration yields rows, which are fetched from the database in batches
+    of the given size, or of a size adapted to fit the given memory budget.
     """
 
-    def __init__(self, cursor):
+    def __init__(self, cursor, batch_size=None, batch_memory=None):
         self.cursor = cursor
+        self.batch_size = batch_size
+        self.batch_memory = batch_memory
 
     def __iter__(self):
-        return CursorIter(self.cursor)
+        return CursorIter(self.cursor, self.batch_size, self.batch_memory)
+
+    def iter_batches(self):
+        """
+        Return an iterator over successive lists of rows.
+        """
+        return CursorIter(
+            self.cursor, self.batch_size, self.batch_memory
+        ).batches()
 
 
 # Pylint warns that the following classes have too few public methods.
@@ -158,9 +440,406 @@ class ResultSetSlice(ResultSet):
     An iterable slice through an SQL result set.
     """
 
-    def __init__(self, cursor, index):
-        super(ResultSetSlice, self).__init__(cursor)
+    def __init__(self, cursor, index, batch_size=None, batch_memory=None):
+        super(ResultSetSlice, self).__init__(cursor, batch_size, batch_memory)
         self.index = index
 
     def __iter__(self):
-        return CursorSliceIter(self.cursor, self.index)
+        return CursorSliceIter(
+            self.cursor, self.index, self.batch_size, self.batch_memory
+        )
+
+
+# The kind of value, as understood by the JSON encoder's RowEncoder,
+# returned for each MySQL column type. Other types are of kind 'other'.
+FIELD_KINDS = dict(
+    [(getattr(FieldType, name), 'integer') for name in (
+        'TINY', 'SHORT', 'LONG', 'LONGLONG', 'INT24', 'YEAR'
+    )] +
+    [(getattr(FieldType, name), 'float') for name in ('FLOAT', 'DOUBLE')] +
+    [(getattr(FieldType, name), 'decimal') for name in (
+        'DECIMAL', 'NEWDECIMAL'
+    )] +
+    [(getattr(FieldType, name), 'datetime') for name in (
+        'DATETIME', 'TIMESTAMP'
+    )] +
+    [(getattr(FieldType, name), 'date') for name in ('DATE', 'NEWDATE')] +
+    [(FieldType.TIME, 'time')] +
+    [(getattr(FieldType, name), 'string') for name in (
+        'VARCHAR', 'VAR_STRING', 'STRING', 'ENUM', 'SET',
+        'TINY_BLOB', 'MEDIUM_BLOB', 'LONG_BLOB', 'BLOB'
+    )]
+)
+
+# The MySQL character set number of binary strings
+BINARY_CHARSET = 63
+
+
+def column_kind(column):
+    """
+    Return the kind of the values of the column with the given cursor
+    description: a kind from FIELD_KINDS, 'unsigned' for unsigned integers,
+    which may exceed the range of signed 64-bit integers, 'binary' for
+    binary strings, such as BLOBs, or 'other'.
+    """
+    kind = FIELD_KINDS.get(column[1], 'other')
+    flags = (column[7] if len(column) > 7 else None) or 0
+    if kind == 'integer' and flags & FieldFlag.UNSIGNED:
+        return 'unsigned'
+    if kind == 'string':
+        # Text in a binary collation is also flagged as binary,
+        # so the character set is used where the connector gives it
+        if len(column) > 8 and column[8] is not None:
+            binary = column[8] == BINARY_CHARSET
+        else:
+            binary = flags & FieldFlag.BINARY
+        if binary:
+            return 'binary'
+    return kind
+
+
+class RecordSet(ResultSet):
+
+    """
+    An iterable SQL result set, whose rows are dictionaries
+    mapping column names to values.
+    The rows are fetched from the database as tuples, and the column
+    names and types are also made available, so that consumers able to
+    handle tuples (such as the streaming JSON encoder) can avoid building
+    a dictionary per row.
+    """
+
+    def row_schema(self):
+        """
+        Return a list of (column name, kind of value) tuples.
+        """
+        return [
+            (column[0], column_kind(column))
+            for column in self.cursor.description
+        ]
+
+    def column_names(self):
+        """
+        Return a list of the names of the columns in this result set.
+        """
+        return [column[0] for column in self.cursor.description]
+
+    def iter_tuples(self):
+        """
+        Return an iterator over the rows of this result set as tuples.
+        """
+        return super(RecordSet, self).__iter__()
+
+    def __iter__(self):
+        names = self.column_names()
+        return imap(lambda row: dict(zip(names, row)), self.iter_tuples())
+
+
+class RecordPage(RecordSet):
+
+    """
+    A page of an SQL result set, whose rows are all read into memory
+    when the page is constructed, so that its last row is known before
+    it is iterated over. The result set must be limited (for instance
+    using an SQL LIMIT clause) to at most one row more than the page size;
+    the presence of that extra row shows that there is another page.
+    If a width is given, only that many leading columns of each row are
+    returned; any further columns are selected only so that they are
+    available from last_record().
+    """
+
+    def __init__(self, record_set, page_size, width=None):
+        super(RecordPage, self).__init__(
+            record_set.cursor, record_set.batch_size, record_set.batch_memory
+        )
+        # Read the whole result set, so the connection may be reused
+        rows = list(record_set.iter_tuples())
+        self.more = len(rows) > page_size
+        rows = rows[:page_size]
+        self.last = dict(zip(
+            super(RecordPage, self).column_names(), rows[-1]
+        )) if rows else None
+        self.width = width
+        if width is not None:
+            rows = [row[:width] for row in rows]
+        self.rows = rows
+
+    def last_record(self):
+        """
+        Return the last row of this page as a dictionary mapping the name of
+        every selected column to its value, or None if the page is empty.
+        """
+        return self.last
+
+    def row_schema(self):
+        return super(RecordPage, self).row_schema()[:self.width]
+
+    def column_names(self):
+        return super(RecordPage, self).column_names()[:self.width]
+
+    def iter_tuples(self):
+        return iter(self.rows)
+
+    def iter_batches(self):
+        """
+        Return an iterator over this page's single batch of rows.
+        """
+        if self.rows:
+            return iter([self.rows])
+        return iter([])
+
+
+class FakeConnection(object):
+
+    """
+    A stand-in for a DBConnection, recording how a pool treats it.
+    """
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.created = time.time()
+        self.unread_result = False
+        self.closed = False
+        self.pings = 0
+
+    def is_reusable(self):
+        """
+        Return True unless unread rows have been left behind.
+        """
+        return not self.unread_result
+
+    def close(self):
+        """
+        Record that this connection has been closed.
+        """
+        self.closed = True
+
+    def _before_db(self):
+        """
+        Record that this connection has been pinged.
+        """
+        self.pings += 1
+
+
+class ConnectionPoolTestCase(TestCase):
+
+    """
+    Unit tests for the connection pool, using fake connections.
+    """
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    @classmethod
+    def pool(cls, **kwargs):
+        """
+        Return a pool of fake connections with the given settings.
+        """
+        return ConnectionPool(factory=FakeConnection, host='db', **kwargs)
+
+    def testBounds(self):
+        """
+        Test that min_size connections are opened at once,
+        and that invalid bounds are rejected.
+        """
+        pool = self.pool(min_size=2, max_size=3)
+        self.assertEqual(pool.stats()['size'], 2)
+        self.assertEqual(pool.stats()['idle'], 2)
+        self.assertEqual(pool.idle[0][0].kwargs, dict(host='db'))
+        for (min_size, max_size) in [(0, 0), (-1, 1), (3, 2)]:
+            self.assertRaises(
+                ValueError, self.pool, min_size=min_size, max_size=max_size
+            )
+
+    def testAcquireRelease(self):
+        """
+        Test that released connections are reused, most recent first.
+        """
+        pool = self.pool(max_size=2)
+        first = pool.acquire()
+        second = pool.acquire()
+        self.assertIsNot(first, second)
+        self.assertEqual(pool.stats()['in_use'], 2)
+        pool.release(first)
+        pool.release(second)
+        self.assertIs(pool.acquire(), second)
+        stats = pool.stats()
+        self.assertEqual(stats['created'], 2)
+        self.assertEqual(stats['acquired'], 3)
+        self.assertEqual((stats['idle'], stats['in_use']), (1, 1))
+
+    def testAcquireTimeout(self):
+        """
+        Test that acquiring from a full pool waits for a connection
+        to be released, or raises PoolTimeout if none is in time.
+        """
+        pool = self.pool(max_size=1, acquire_timeout=0)
+        conn = pool.acquire()
+        self.assertRaises(PoolTimeout, pool.acquire)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+        pool.acquire_timeout = 10
+        timer = threading.Timer(0.05, pool.release, [conn])
+        timer.start()
+        self.assertIs(pool.acquire(), conn)
+        timer.join()
+        self.assertEqual(pool.stats()['waited'], 2)
+
+    def testIdleEviction(self):
+        """
+        Test that connections idle for too long are closed, down to
+        min_size, and that the rest are pinged before reuse.
+        """
+        pool = self.pool(min_size=1, max_size=3, idle_timeout=60)
+        conns = [pool.acquire(), pool.acquire()]
+        for conn in conns:
+            pool.release(conn)
+        long_ago = time.time() - 120
+        pool.idle = deque((conn, long_ago) for (conn, _) in pool.idle)
+        conn = pool.acquire()
+        self.assertEqual(pool.stats()['closed'], 1)
+        self.assertEqual(pool.stats()['size'], 1)
+        self.assertEqual(conn.pings, 1)
+        self.assertEqual([item.closed for item in conns].count(True), 1)
+
+    def testMaxLifetime(self):
+        """
+        Test that connections older than max_lifetime are not reused,
+        whether released or idle when expired.
+        """
+        pool = self.pool(max_lifetime=60)
+        conn = pool.acquire()
+        conn.created -= 120
+        pool.release(conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()['size'], 0)
+        conn = pool.acquire()
+        pool.release(conn)
+        conn.created -= 120
+        self.assertIsNot(pool.acquire(), conn)
+        self.assertTrue(conn.closed)
+
+    def testUnreadResult(self):
+        """
+        Test that a connection with unread rows is closed on release.
+        """
+        pool = self.pool()
+        conn = pool.acquire()
+        conn.unread_result = True
+        pool.release(conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()['size'], 0)
+        self.assertIsNot(pool.acquire(), conn)
+
+    def testClose(self):
+        """
+        Test that closing a pool closes idle connections at once,
+        and those in use when released.
+        """
+        pool = self.pool(min_size=1)
+        idle = pool.idle[0][0]
+        busy = pool.acquire()
+        self.assertIs(busy, idle)
+        busy = pool.acquire()
+        pool.release(idle)
+        pool.close()
+        self.assertTrue(idle.closed)
+        self.assertFalse(busy.closed)
+        pool.release(busy)
+        self.assertTrue(busy.closed)
+        self.assertEqual(pool.stats()['size'], 0)
+
+
+class FakeCursor(object):
+
+    """
+    A stand-in for a cursor, holding the given rows and recording
+    how many rows each fetch requested.
+    """
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.fetches = []
+
+    def fetchmany(self, size):
+        """
+        Return up to the given number of the remaining rows.
+        """
+        self.fetches.append(size)
+        (batch, self.rows) = (self.rows[:size], self.rows[size:])
+        return batch
+
+
+class CursorIterTestCase(TestCase):
+
+    """
+    Unit tests for fetching rows from cursors in batches.
+    """
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    def testFixedBatches(self):
+        """
+        Test fetching rows in batches of a fixed size, stopping after
+        a short batch or an empty one.
+        """
+        for (count, sizes, fetches) in [
+            (10, [4, 4, 2], [4, 4, 4]),
+            (8, [4, 4], [4, 4, 4]),
+            (0, [], [4])
+        ]:
+            cursor = FakeCursor((i, 'row') for i in range(count))
+            batches = list(CursorIter(cursor, batch_size=4).batches())
+            self.assertEqual([len(batch) for batch in batches], sizes)
+            self.assertEqual(cursor.fetches, fetches)
+        cursor = FakeCursor((i, 'row') for i in range(10))
+        self.assertEqual(
+            list(CursorIter(cursor, batch_size=4)),
+            [(i, 'row') for i in range(10)]
+        )
+
+    def testAdaptiveBatches(self):
+        """
+        Test that, without a batch size, the first batch is of
+        INITIAL_BATCH_SIZE rows, and later ones fit the memory budget,
+        within bounds.
+        """
+        row = (1, 'x' * 100, 2.5)
+        for (batch_memory, expected) in [
+            (10 * _row_size(row), 10),
+            (1, 1),
+            (1024 * 1024 * 1024, MAX_BATCH_SIZE)
+        ]:
+            cursor = FakeCursor([row] * (INITIAL_BATCH_SIZE + 5))
+            batches = list(
+                CursorIter(cursor, batch_memory=batch_memory).batches()
+            )
+            self.assertEqual(
+                cursor.fetches[:2], [INITIAL_BATCH_SIZE, expected]
+            )
+            self.assertEqual(
+                sum(len(batch) for batch in batches), INITIAL_BATCH_SIZE + 5
+            )
+        # Wider rows give smaller batches
+        # pylint: disable=W0212
+        narrow = CursorIter(FakeCursor([]), batch_memory=1024 * 1024)
+        self.assertGreater(
+            narrow._adapted_batch_size([(1,)] * 10),
+            narrow._adapted_batch_size([(1, 'x' * 1000)] * 10)
+        )
+
+    def testSlice(self):
+        """
+        Test iterating over one column of a cursor's rows.
+        """
+        cursor = FakeCursor((i, 'row%d' % i) for i in range(5))
+        self.assertEqual(
+            list(CursorSliceIter(cursor, 1, batch_size=2)),
+            ['row%d' % i for i in range(5)]
+        )
+
+
+if __name__ == '__main__':
+    test_main()
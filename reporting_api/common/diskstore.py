@@ -0,0 +1,339 @@
+"""
+An on-disk store of encoded and compressed response bodies.
+"""
+
+import errno
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import urllib
+import zlib
+from datetime import datetime
+from unittest import main as test_main, TestCase
+
+
+class DiskStore(object):
+
+    """
+    A store of the encoded response bodies of whole tables, each written
+    to a file together with a gzip-compressed copy, so that they can be
+    served straight from disk, using sendfile where the server supports it.
+
+    Each table has at most one stored body in each output format, named
+    by the file extension, which is valid only for a particular last
+    update time of the table; a body for a newer last update time
+    replaces it. Bodies are written by capturing them as they
+    are first streamed, to temporary files which are renamed into place
+    once complete, so that partly written bodies are never served, even
+    by other processes sharing the directory.
+    Bodies smaller than min_bytes are not stored, as they are better
+    served from memory.
+    """
+
+    # Prefix of the names of files still being written
+    TEMP_PREFIX = '.tmp-'
+
+    def __init__(self, directory, compress_level=6, min_bytes=0):
+        self.directory = directory
+        self.compress_level = compress_level
+        self.min_bytes = min_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.lock = threading.Lock()
+        # (table, extension) tuples of bodies being written by this process
+        self.writing = set()
+        self.counters = dict(
+            hits=0, misses=0, writes=0, abandoned=0, undersized=0, errors=0
+        )
+
+    @classmethod
+    def _prefix(cls, table_name):
+        """
+        Return the prefix of the names of the files of the given table,
+        which is never a prefix of another table's.
+        """
+        return urllib.quote(table_name, safe='') + '@'
+
+    def _paths(self, table_name, last_update, extension):
+        """
+        Return the paths of the files holding the body of the given table,
+        for the given last update time, with the given file extension,
+        and its gzip-compressed copy.
+        """
+        path = os.path.join(
+            self.directory, self._prefix(table_name) +
+            last_update.strftime('%Y%m%dT%H%M%S.%f') + '.' + extension
+        )
+        return (path, path + '.gz')
+
+    def _count(self, counter):
+        """
+        Increment the given counter.
+        """
+        with self.lock:
+            self.counters[counter] += 1
+
+    def open(self, table_name, last_update, gzip=False, extension='json'):
+        """
+        Return a (file, size, content coding) tuple for the stored body of
+        the given table for the given last update time, with the given file
+        extension, compressed using gzip if requested, or None if there is
+        no such body.
+        The content coding is None if the body is not compressed.
+        """
+        (path, gzip_path) = self._paths(table_name, last_update, extension)
+        for (candidate, encoding) in (
+            ((gzip_path, 'gzip'),) if gzip else ()
+        ) + ((path, None),):
+            try:
+                body_file = open(candidate, 'rb')
+            except IOError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+                continue
+            self._count('hits')
+            # The opened file remains readable even if it is replaced
+            return (body_file, os.fstat(body_file.fileno()).st_size, encoding)
+        self._count('misses')
+        return None
+
+    def _remove_stale(self, table_name, keep, extension):
+        """
+        Remove the given table's files with the given file extension,
+        other than those with the given paths.
+        """
+        prefix = self._prefix(table_name)
+        suffixes = ('.' + extension, '.' + extension + '.gz')
+        keep = [os.path.basename(path) for path in keep]
+        for name in os.listdir(self.directory):
+            if (
+                name.startswith(prefix) and name.endswith(suffixes) and
+                name not in keep
+            ):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    # Another process may have removed it first
+                    pass
+
+    def capture(self, chunks, table_name, last_update, extension='json'):
+        """
+        A generator which passes through the given chunks of the body of
+        the given table, and once they have all been passed through, stores
+        the whole body for the given last update time, with the given file
+        extension, if it is large enough.
+        A body which is not read to the end is not stored, and neither is
+        a body which this process is already storing, or has stored.
+        Errors writing files are logged, and do not interrupt the body.
+        """
+        (path, gzip_path) = self._paths(table_name, last_update, extension)
+        writing = (table_name, extension)
+        with self.lock:
+            if writing in self.writing or os.path.exists(path):
+                files = None
+            else:
+                self.writing.add(writing)
+                files = []
+        if files is None:
+            for chunk in chunks:
+                yield chunk
+            return
+        complete = False
+        try:
+            for target in (path, gzip_path):
+                (handle, temp_path) = tempfile.mkstemp(
+                    prefix=self.TEMP_PREFIX, dir=self.directory
+                )
+                files.append((os.fdopen(handle, 'wb'), temp_path, target))
+            compressor = zlib.compressobj(
+                self.compress_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+            )
+        except (IOError, OSError):
+            logging.exception("Cannot store response body")
+            self._count('errors')
+            compressor = None
+        size = 0
+        try:
+            for chunk in chunks:
+                if compressor is not None:
+                    try:
+                        files[0][0].write(chunk)
+                        files[1][0].write(compressor.compress(chunk))
+                    except (IOError, OSError):
+                        logging.exception("Cannot store response body")
+                        self._count('errors')
+                        compressor = None
+                size += len(chunk)
+                yield chunk
+            complete = True
+            if compressor is None:
+                return
+            if size < self.min_bytes:
+                self._count('undersized')
+                return
+            try:
+                files[1][0].write(compressor.flush())
+                for (body_file, temp_path, target) in files:
+                    body_file.close()
+                # The uncompressed body is renamed into place last,
+                # as its presence marks the body as stored
+                for (body_file, temp_path, target) in reversed(files):
+                    os.rename(temp_path, target)
+                self._remove_stale(
+                    table_name, (path, gzip_path), extension
+                )
+                self._count('writes')
+            except (IOError, OSError):
+                logging.exception("Cannot store response body")
+                self._count('errors')
+        finally:
+            if not complete:
+                self._count('abandoned')
+            for (body_file, temp_path, target) in files:
+                body_file.close()
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            with self.lock:
+                self.writing.discard(writing)
+
+    def stats(self):
+        """
+        Return a dictionary of statistics describing this store.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+        stats.update(directory=self.directory)
+        return stats
+
+
+class DiskStoreTestCase(TestCase):
+
+    """
+    Unit tests for the on-disk store, in a temporary directory.
+    """
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    CHUNKS = ['[', ','.join(['{"id":%d}' % i for i in range(50)]), ']']
+    BODY = ''.join(CHUNKS)
+    OLD = datetime(2015, 6, 1)
+    NEW = datetime(2015, 6, 2)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = DiskStore(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def store_body(self, table_name, last_update, extension='json'):
+        """
+        Pass the test body through the store, reading it to the end.
+        """
+        self.assertEqual(list(self.store.capture(
+            iter(self.CHUNKS), table_name, last_update, extension
+        )), self.CHUNKS)
+
+    def testCaptureAndOpen(self):
+        """
+        Test that a body read to the end is stored with a gzip-compressed
+        copy, and that no temporary files are left behind.
+        """
+        self.store_body('usage', self.OLD)
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            'usage@20150601T000000.000000.json',
+            'usage@20150601T000000.000000.json.gz'
+        ])
+        (body_file, size, encoding) = self.store.open('usage', self.OLD)
+        with body_file:
+            self.assertEqual(body_file.read(), self.BODY)
+        self.assertEqual((size, encoding), (len(self.BODY), None))
+        (body_file, size, encoding) = self.store.open(
+            'usage', self.OLD, gzip=True
+        )
+        with body_file:
+            self.assertEqual(zlib.decompress(
+                body_file.read(), 16 + zlib.MAX_WBITS
+            ), self.BODY)
+        self.assertEqual(encoding, 'gzip')
+        self.assertIsNone(self.store.open('usage', self.NEW))
+        self.assertIsNone(self.store.open('usage', self.OLD, extension='csv'))
+        stats = self.store.stats()
+        self.assertEqual(
+            (stats['writes'], stats['hits'], stats['misses']), (1, 2, 2)
+        )
+        # A body already stored is passed through, not stored again
+        self.store_body('usage', self.OLD)
+        self.assertEqual(self.store.stats()['writes'], 1)
+
+    def testGzipFallback(self):
+        """
+        Test that the uncompressed body is opened if its compressed copy
+        is missing.
+        """
+        self.store_body('usage', self.OLD)
+        os.remove(os.path.join(
+            self.directory, 'usage@20150601T000000.000000.json.gz'
+        ))
+        (body_file, size, encoding) = self.store.open(
+            'usage', self.OLD, gzip=True
+        )
+        with body_file:
+            self.assertEqual(body_file.read(), self.BODY)
+        self.assertIsNone(encoding)
+
+    def testAbandoned(self):
+        """
+        Test that a body which is not read to the end is not stored.
+        """
+        chunks = self.store.capture(iter(self.CHUNKS), 'usage', self.OLD)
+        self.assertEqual(chunks.next(), self.CHUNKS[0])
+        chunks.close()
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(self.store.stats()['abandoned'], 1)
+        self.assertEqual(self.store.writing, set())
+        self.assertIsNone(self.store.open('usage', self.OLD))
+
+    def testMinBytes(self):
+        """
+        Test that a body smaller than min_bytes is not stored.
+        """
+        self.store.min_bytes = len(self.BODY) + 1
+        self.store_body('usage', self.OLD)
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(self.store.stats()['undersized'], 1)
+        self.store.min_bytes = len(self.BODY)
+        self.store_body('usage', self.OLD)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+    def testRemoveStale(self):
+        """
+        Test that storing a newer body removes only the stale files
+        of the same table and file extension.
+        """
+        for table_name in ('usage', 'usage@2', 'usage_2'):
+            self.store_body(table_name, self.OLD)
+        self.store_body('usage', self.OLD, 'csv')
+        self.store_body('usage', self.NEW)
+        self.assertIsNone(self.store.open('usage', self.OLD))
+        stored = self.store.open('usage', self.NEW)
+        self.assertIsNotNone(stored)
+        stored[0].close()
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            'usage%402@20150601T000000.000000.json',
+            'usage%402@20150601T000000.000000.json.gz',
+            'usage@20150601T000000.000000.csv',
+            'usage@20150601T000000.000000.csv.gz',
+            'usage@20150602T000000.000000.json',
+            'usage@20150602T000000.000000.json.gz',
+            'usage_2@20150601T000000.000000.json',
+            'usage_2@20150601T000000.000000.json.gz'
+        ])
+
+
+if __name__ == '__main__':
+    test_main()
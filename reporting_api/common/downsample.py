@@ -0,0 +1,248 @@
+"""
+Downsampling of time series result sets to a budget of points.
+"""
+
+import calendar
+from datetime import date, datetime, time, timedelta
+from itertools import ifilter, islice
+from unittest import main as test_main, TestCase
+from reporting_api.common.dbconn import RecordSet
+
+# Kinds of columns (see RecordSet.row_schema) whose values can be plotted,
+# as values and as times respectively
+VALUE_KINDS = ('integer', 'unsigned', 'float', 'decimal')
+TIME_KINDS = VALUE_KINDS + ('datetime', 'date', 'time')
+
+
+def _as_number(value):
+    """
+    Return the given value of a column as a number which can be plotted,
+    treating dates and times as seconds.
+    """
+    if isinstance(value, datetime):
+        return calendar.timegm(value.utctimetuple()) \
+            + value.microsecond / 1e6
+    if isinstance(value, date):
+        return float(calendar.timegm(value.timetuple()))
+    if isinstance(value, time):
+        return value.hour * 3600 + value.minute * 60 + value.second \
+            + value.microsecond / 1e6
+    if hasattr(value, 'total_seconds'):
+        return value.total_seconds()
+    return float(value)
+
+
+def lttb(rows, count, threshold, x_index, y_index):
+    """
+    A generator which selects at most threshold of the given rows,
+    which number count and are ordered by their x_index'th value,
+    using the Largest-Triangle-Three-Buckets algorithm, so that a chart of
+    their y_index'th values against their x_index'th values keeps its shape.
+    Rows missing either value cannot be plotted, so are skipped, and fewer
+    than threshold rows may then be selected.
+    The first and last rows are always selected, and the rest are divided
+    into threshold - 2 buckets, from each of which the row forming the
+    largest triangle with the previously selected row and the average of
+    the next bucket is selected.
+    Only two buckets of rows are held in memory at once.
+    If count is at most threshold, every row is passed through.
+    """
+    rows = ifilter(
+        lambda row: row[x_index] is not None and row[y_index] is not None,
+        rows
+    )
+    if count <= threshold or threshold < 3:
+        for row in rows:
+            yield row
+        return
+    buckets = threshold - 2
+    every = float(count - 2) / buckets
+
+    def bucket(index):
+        """
+        Read the rows of the given bucket, or of the last row if index
+        is buckets.
+        """
+        if index == buckets:
+            return list(islice(rows, 1))
+        start = int(index * every) + 1
+        end = int((index + 1) * every) + 1
+        return list(islice(rows, end - start))
+
+    try:
+        selected = rows.next()
+    except StopIteration:
+        return
+    yield selected
+    current = bucket(0)
+    # The last row read, which ends the selection
+    last = current[-1] if current else selected
+    for index in range(buckets):
+        following = bucket(index + 1)
+        if following:
+            last = following[-1]
+        if not current:
+            current = following
+            continue
+        if following:
+            avg_x = sum(
+                _as_number(row[x_index]) for row in following
+            ) / len(following)
+            avg_y = sum(
+                _as_number(row[y_index]) for row in following
+            ) / len(following)
+        else:
+            (avg_x, avg_y) = (
+                _as_number(current[-1][x_index]),
+                _as_number(current[-1][y_index])
+            )
+        (sel_x, sel_y) = (
+            _as_number(selected[x_index]), _as_number(selected[y_index])
+        )
+        # Twice the area of the triangle, which orders rows just as well
+        selected = max(current, key=lambda row: abs(
+            (sel_x - avg_x) * (_as_number(row[y_index]) - sel_y) -
+            (sel_x - _as_number(row[x_index])) * (avg_y - sel_y)
+        ))
+        yield selected
+        current = following
+    # The result set may have grown or shrunk since it was counted, so read
+    # it all, to free the connection, and end with whichever row is last
+    for row in rows:
+        last = row
+    if last is not selected:
+        yield last
+
+
+class DownsampledRecordSet(RecordSet):
+
+    """
+    A record set consisting of at most a given number of points selected
+    from another record set of a known size, using lttb.
+    Raise ValueError unless the x column holds numbers, dates or times,
+    and the y column numbers, so that no error can occur once the selected
+    points are being streamed.
+    """
+
+    # The number of selected rows in each batch
+    BATCH_SIZE = 1000
+
+    def __init__(self, record_set, count, points, x_column, y_column):
+        super(DownsampledRecordSet, self).__init__(
+            record_set.cursor, record_set.batch_size, record_set.batch_memory
+        )
+        self.record_set = record_set
+        self.count = count
+        self.points = points
+        schema = record_set.row_schema()
+        names = [name for (name, kind) in schema]
+        self.x_index = names.index(x_column)
+        self.y_index = names.index(y_column)
+        if schema[self.x_index][1] not in TIME_KINDS:
+            raise ValueError("Field '%s' is not a time or number" % x_column)
+        if schema[self.y_index][1] not in VALUE_KINDS:
+            raise ValueError("Field '%s' is not numeric" % y_column)
+
+    def iter_tuples(self):
+        return lttb(
+            self.record_set.iter_tuples(), self.count, self.points,
+            self.x_index, self.y_index
+        )
+
+    def iter_batches(self):
+        """
+        Return an iterator over successive lists of selected rows.
+        """
+        rows = self.iter_tuples()
+        while True:
+            batch = list(islice(rows, self.BATCH_SIZE))
+            if not batch:
+                return
+            yield batch
+
+
+# Pylint warns that the following class has too few public methods.
+# It is a stand-in for a database result set, so that is expected.
+# pylint: disable=R0903
+class ExampleRecordSet(RecordSet):
+
+    """
+    An example result set, with tuple rows described by a schema.
+    """
+
+    # pylint: disable=W0231
+    def __init__(self, schema, rows):
+        self.schema = schema
+        self.rows = rows
+        (self.cursor, self.batch_size, self.batch_memory) = (None, None, None)
+
+    def row_schema(self):
+        return self.schema
+
+    def iter_tuples(self):
+        return iter(self.rows)
+
+
+class DownsampleTestCase(TestCase):
+
+    """
+    Unit tests for downsampling.
+    """
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    def testShape(self):
+        """
+        Test that the first, last and most outlying points are selected.
+        """
+        rows = [(x, 0) for x in range(10)]
+        rows[4] = (4, 100)
+        self.assertEqual(
+            list(lttb(rows, len(rows), 3, 0, 1)), [(0, 0), (4, 100), (9, 0)]
+        )
+
+    def testNulls(self):
+        """
+        Test that points missing either value are skipped.
+        """
+        rows = [
+            (datetime(2000, 1, 1, 0, minute), None if minute % 3 else minute)
+            for minute in range(12)
+        ] + [(None, 5)]
+        selected = list(lttb(rows, len(rows), 3, 0, 1))
+        self.assertEqual(selected[0], rows[0])
+        self.assertEqual(selected[-1], rows[9])
+        self.assertFalse([row for row in selected if None in row])
+        self.assertEqual(
+            list(lttb(rows[:4], 4, 10, 0, 1)), [rows[0], rows[3]]
+        )
+
+    def testTimes(self):
+        """
+        Test that times are plotted as seconds.
+        """
+        self.assertEqual(_as_number(date(1970, 1, 2)), 86400.0)
+        self.assertEqual(_as_number(time(1, 0, 30)), 3630.0)
+        self.assertEqual(_as_number(timedelta(minutes=2)), 120.0)
+
+    def testKinds(self):
+        """
+        Test that only numbers, dates and times may be downsampled.
+        """
+        schema = [('ts', 'datetime'), ('value', 'float'), ('name', 'string')]
+        record_set = ExampleRecordSet(schema, [])
+        DownsampledRecordSet(record_set, 0, 3, 'ts', 'value')
+        DownsampledRecordSet(record_set, 0, 3, 'value', 'value')
+        for (x_column, y_column) in [
+            ('ts', 'name'), ('name', 'value'), ('value', 'ts')
+        ]:
+            self.assertRaises(
+                ValueError, DownsampledRecordSet,
+                record_set, 0, 3, x_column, y_column
+            )
+
+
+if __name__ == '__main__':
+    test_main()
@@ -0,0 +1,800 @@
+"""
+A pre-forking WSGI server, which serves an application from several
+worker processes sharing one listening socket, so that requests are
+not all served under a single interpreter lock.
+"""
+
+import errno
+import logging
+import os
+import random
+import resource
+import select
+import signal
+import socket
+import SocketServer
+import threading
+import time
+from unittest import main as test_main, TestCase
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from paste.deploy import loadapp
+from paste.deploy.loadwsgi import SERVER, loadcontext
+
+
+def _rss_bytes():
+    """
+    Return the resident set size of this process in bytes.
+    Where /proc is not available, the peak resident set size is returned.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        # Linux reports the peak in kilobytes
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _RequestHandler(WSGIRequestHandler):
+
+    """
+    Handles a request, logging it rather than writing it to standard error.
+    """
+
+    # pylint: disable=W0622
+    def log_message(self, format, *args):
+        logging.debug("%s - %s", self.client_address[0], format % args)
+
+
+class _WorkerServer(SocketServer.ThreadingMixIn, WSGIServer):
+
+    """
+    A WSGI server, handling each request in its own thread, which accepts
+    connections from a listening socket created by the master process,
+    and reports the start and end of each request to its worker.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, listener, application, worker):
+        WSGIServer.__init__(
+            self, listener.getsockname()[:2], _RequestHandler,
+            bind_and_activate=False
+        )
+        self.socket.close()
+        self.socket = listener
+        (host, self.server_port) = listener.getsockname()[:2]
+        self.server_name = socket.getfqdn(host)
+        self.setup_environ()
+        self.set_app(application)
+        self.worker = worker
+
+    def get_request(self):
+        (connection, address) = self.socket.accept()
+        # The listening socket does not block, as several workers
+        # wait on it, but connections must
+        connection.setblocking(1)
+        return (connection, address)
+
+    def process_request(self, request, client_address):
+        self.worker.request_started()
+        try:
+            SocketServer.ThreadingMixIn.process_request(
+                self, request, client_address
+            )
+        except Exception:
+            self.worker.request_finished()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            SocketServer.ThreadingMixIn.process_request_thread(
+                self, request, client_address
+            )
+        finally:
+            self.worker.request_finished()
+
+    def handle_error(self, request, client_address):
+        logging.exception(
+            "Error handling request from %s", client_address[0]
+        )
+
+
+class _Worker(object):
+
+    """
+    A worker process, which loads the application and serves requests
+    from the shared listening socket until it is asked to stop, the
+    master process goes away, or it is due to be recycled, then stops
+    accepting connections and finishes the requests in progress.
+    Once the application is loaded, a byte is written to the file
+    descriptor ready, which is then closed.
+    """
+
+    def __init__(self, master, listener, ready):
+        self.master = master
+        self.listener = listener
+        self.ready = ready
+        self.master_pid = os.getppid()
+        self.alive = True
+        self.active = 0
+        self.served = 0
+        self.idle = threading.Condition()
+        # Recycling points are spread out, so that workers started together
+        # are not all replaced at once
+        self.max_requests = master.max_requests
+        if self.max_requests:
+            self.max_requests += random.randint(
+                0, self.max_requests // 10
+            )
+
+    def _stop_handler(self, sig, frame):
+        """
+        Stop accepting connections on receipt of a signal.
+        """
+        # pylint: disable=W0613
+        self.alive = False
+
+    def request_started(self):
+        """
+        Count a request which has been accepted.
+        """
+        with self.idle:
+            self.active += 1
+            self.served += 1
+            if self.max_requests and self.served >= self.max_requests:
+                logging.info(
+                    "Recycling worker %d after %d requests",
+                    os.getpid(), self.served
+                )
+                self.alive = False
+
+    def request_finished(self):
+        """
+        Count a request which has been completed, and recycle this worker
+        if it has grown too large.
+        """
+        with self.idle:
+            self.active -= 1
+            self.idle.notify_all()
+        if self.master.max_rss and self.alive:
+            rss = _rss_bytes()
+            if rss > self.master.max_rss:
+                logging.info(
+                    "Recycling worker %d with a resident set of %d bytes",
+                    os.getpid(), rss
+                )
+                self.alive = False
+
+    def run(self):
+        """
+        Load the application and serve requests until stopped.
+        """
+        signal.signal(signal.SIGTERM, self._stop_handler)
+        # The master process handles these, and stops its workers
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        server = _WorkerServer(
+            self.listener, self.master.app_factory(), self
+        )
+        server.timeout = self.master.POLL_INTERVAL
+        os.write(self.ready, b'.')
+        os.close(self.ready)
+        logging.info("Worker %d started", os.getpid())
+        while self.alive and os.getppid() == self.master_pid:
+            # Leave connections to other workers while all threads are busy
+            with self.idle:
+                while self.active >= self.master.threads and self.alive:
+                    self.idle.wait(self.master.POLL_INTERVAL)
+            if self.alive:
+                server.handle_request()
+        self.listener.close()
+        with self.idle:
+            while self.active:
+                self.idle.wait(self.master.POLL_INTERVAL)
+        logging.info(
+            "Worker %d stopped after %d requests", os.getpid(), self.served
+        )
+
+
+class PreforkServer(object):
+
+    """
+    A master process which binds a listening socket, then forks the given
+    number of worker processes, each of which loads the application by
+    calling app_factory and serves up to the given number of requests
+    at once in threads, all accepting connections from that socket.
+    Loading the application after forking means that no database
+    connections or threads are shared between processes.
+
+    Workers which exit are replaced, after a delay which grows while
+    they keep failing soon after starting. A worker recycles itself,
+    finishing its requests and exiting to be replaced, after serving
+    about max_requests requests, or once its resident set exceeds max_rss
+    bytes; each is disabled if zero.
+    On SIGHUP a new generation of workers is started, reloading the
+    application, and the old workers are stopped gracefully once a new
+    worker has loaded it, so that an application which fails to load
+    leaves the old workers serving.
+    On exit, including by a SystemExit raised by a signal handler, the
+    workers are stopped gracefully, and killed if they have not finished
+    their requests within graceful_timeout seconds.
+    """
+
+    # Seconds between checks of the workers; also the longest delay
+    # before a worker notices it has been asked to stop
+    POLL_INTERVAL = 1.0
+
+    # Workers failing sooner than this many seconds after starting
+    # are replaced after a growing delay, of at most MAX_RESPAWN_DELAY
+    MIN_WORKER_LIFETIME = 5
+    MAX_RESPAWN_DELAY = 60
+
+    def __init__(
+        self, app_factory, host, port, workers=2, threads=10,
+        max_requests=0, max_rss=0, graceful_timeout=30, backlog=128
+    ):
+        if workers < 1 or threads < 1:
+            raise ValueError("At least one worker and thread are required")
+        self.app_factory = app_factory
+        self.address = (host, port)
+        self.worker_count = workers
+        self.threads = threads
+        self.max_requests = max_requests
+        self.max_rss = max_rss
+        self.graceful_timeout = graceful_timeout
+        self.backlog = backlog
+        self.listener = None
+        # Maps the pids of running workers to (generation, start time)
+        self.workers = dict()
+        # Maps the pids of workers asked to stop to their kill deadlines
+        self.stopping = dict()
+        # Maps the pids of workers which have not yet loaded the application
+        # to the read ends of the pipes on which they report having done so
+        self.starting = dict()
+        self.generation = 0
+        self.reloading = False
+        self.respawn_delay = 0
+        self.next_spawn = 0
+
+    def bind(self):
+        """
+        Create the listening socket, unless it already exists.
+        """
+        if self.listener is not None:
+            return
+        (family, socktype, proto, _, address) = socket.getaddrinfo(
+            self.address[0], self.address[1], 0, socket.SOCK_STREAM
+        )[0]
+        listener = socket.socket(family, socktype, proto)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(address)
+        listener.listen(self.backlog)
+        listener.setblocking(0)
+        self.listener = listener
+
+    def _reload_handler(self, sig, frame):
+        """
+        Start a new generation of workers on receipt of a signal.
+        """
+        # pylint: disable=W0613
+        self.reloading = True
+
+    def _signal(self, pid, sig):
+        """
+        Send the given signal to the given worker, if it still exists.
+        """
+        try:
+            os.kill(pid, sig)
+        except OSError as err:
+            if err.errno != errno.ESRCH:
+                raise
+
+    def _retire(self, pid):
+        """
+        Ask the given worker to stop gracefully.
+        """
+        if pid not in self.stopping:
+            self._signal(pid, signal.SIGTERM)
+            self.stopping[pid] = time.time() + self.graceful_timeout
+
+    def _reap(self):
+        """
+        Collect the exit statuses of workers which have exited,
+        and kill those which have outstayed their graceful timeout.
+        """
+        while self.workers:
+            try:
+                (pid, status) = os.waitpid(-1, os.WNOHANG)
+            except OSError as err:
+                if err.errno != errno.ECHILD:
+                    raise
+                break
+            if not pid:
+                break
+            if pid not in self.workers:
+                continue
+            (generation, started) = self.workers.pop(pid)
+            self.stopping.pop(pid, None)
+            ready = self.starting.pop(pid, None)
+            if ready is not None:
+                os.close(ready)
+            if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+                logging.info("Worker %d exited", pid)
+                self.respawn_delay = 0
+                continue
+            logging.error("Worker %d failed with status %d", pid, status)
+            if (
+                generation == self.generation and
+                time.time() - started < self.MIN_WORKER_LIFETIME
+            ):
+                self.respawn_delay = min(
+                    max(1, 2 * self.respawn_delay), self.MAX_RESPAWN_DELAY
+                )
+                self.next_spawn = time.time() + self.respawn_delay
+        for (pid, deadline) in self.stopping.items():
+            if time.time() > deadline:
+                logging.error("Killing worker %d", pid)
+                self._signal(pid, signal.SIGKILL)
+
+    def _wait_ready(self, timeout):
+        """
+        Wait up to timeout seconds for starting workers to report that
+        they have loaded the application, and once one of the current
+        generation has, retire the workers of earlier generations.
+        """
+        pids = dict((ready, pid) for (pid, ready) in self.starting.items())
+        try:
+            (readable, _, _) = select.select(pids.keys(), [], [], timeout)
+        except select.error as err:
+            # Interrupted early by signals
+            if err.args[0] != errno.EINTR:
+                raise
+            return
+        loaded = False
+        for ready in readable:
+            pid = pids[ready]
+            # Workers which fail to load the application exit,
+            # closing the pipe without writing to it
+            if os.read(ready, 1) and self.workers[pid][0] == self.generation:
+                loaded = True
+            os.close(ready)
+            del self.starting[pid]
+        if loaded:
+            for (pid, (generation, _)) in self.workers.items():
+                if generation != self.generation:
+                    self._retire(pid)
+
+    def _run_worker(self, ready):
+        """
+        Serve requests in a newly-forked worker process, then exit it,
+        never returning.
+        """
+        status = 1
+        try:
+            _Worker(self, self.listener, ready).run()
+            status = 0
+        except Exception:
+            logging.exception("Worker %d failed", os.getpid())
+        finally:
+            # pylint: disable=W0212
+            os._exit(status)
+
+    def _spawn(self):
+        """
+        Start workers of the current generation until there are enough.
+        """
+        if time.time() < self.next_spawn:
+            return
+        current = sum(
+            1 for (generation, _) in self.workers.values()
+            if generation == self.generation
+        )
+        for _ in range(self.worker_count - current):
+            (ready_read, ready_write) = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                # Until the worker installs its own handlers, a signal must
+                # not run those of the master, which would clean up after it
+                for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                    signal.signal(sig, signal.SIG_DFL)
+                os.close(ready_read)
+                for ready in self.starting.values():
+                    os.close(ready)
+                self._run_worker(ready_write)
+            os.close(ready_write)
+            self.workers[pid] = (self.generation, time.time())
+            self.starting[pid] = ready_read
+
+    def _stop(self):
+        """
+        Stop all workers, waiting up to graceful_timeout seconds
+        for them to finish their requests.
+        """
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, signal.SIG_IGN)
+        for pid in self.workers.keys():
+            self._retire(pid)
+        while self.workers:
+            self._reap()
+            time.sleep(0.1)
+        self.listener.close()
+
+    def serve_forever(self):
+        """
+        Bind the listening socket if necessary,
+        then supervise workers until interrupted.
+        """
+        self.bind()
+        signal.signal(signal.SIGHUP, self._reload_handler)
+        logging.info(
+            "Serving on %s:%s with %d workers",
+            self.address[0], self.address[1], self.worker_count
+        )
+        try:
+            while True:
+                self._reap()
+                if self.reloading:
+                    self.reloading = False
+                    self.generation += 1
+                    self.next_spawn = 0
+                    logging.info(
+                        "Starting worker generation %d", self.generation
+                    )
+                self._spawn()
+                self._wait_ready(self.POLL_INTERVAL)
+        finally:
+            self._stop()
+
+
+def add_arguments(parser):
+    """
+    Add the options of the pre-forking server to the given
+    argparse argument parser.
+    """
+    parser.add_argument('--workers', action='store', type=int, default=0,
+                        help="Serve from this many pre-forked worker "
+                        "processes, rather than from the configured "
+                        "Paste server in a single process")
+    parser.add_argument('--threads', action='store', type=int, default=10,
+                        help="Requests served at once by each worker")
+    parser.add_argument('--max-requests', action='store', type=int,
+                        default=0,
+                        help="Replace each worker after about this many "
+                        "requests; 0 never replaces them")
+    parser.add_argument('--max-rss', action='store', type=int, default=0,
+                        help="Replace each worker once its resident set "
+                        "exceeds this many MiB; 0 never replaces them")
+    parser.add_argument('--graceful-timeout', action='store', type=int,
+                        default=30,
+                        help="Seconds stopping workers may take to finish "
+                        "their requests before they are killed")
+
+
+def paste_server(config_uri, args):
+    """
+    Return a PreforkServer configured by the given parsed arguments,
+    listening on the host and port of the server of the given Paste Deploy
+    configuration, whose workers each load its application.
+    """
+    config = loadcontext(SERVER, config_uri).config()
+    return PreforkServer(
+        lambda: loadapp(config_uri),
+        config.get('host', '127.0.0.1'), int(config.get('port', 8080)),
+        workers=args.workers, threads=args.threads,
+        max_requests=args.max_requests, max_rss=args.max_rss * 1024 * 1024,
+        graceful_timeout=args.graceful_timeout
+    )
+
+
+class _WorkerExit(Exception):
+
+    """
+    Raised in place of exiting a forked worker process under test.
+    """
+
+    pass
+
+
+class PreforkServerTestCase(TestCase):
+
+    """
+    Unit tests for the supervision of workers, with process management
+    stubbed so that no processes are forked or signalled.
+    """
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    FAILED = 1 << 8
+    KILLED = signal.SIGKILL
+
+    def setUp(self):
+        # pylint: disable=W0603
+        global _rss_bytes
+        # Silence the errors logged for failing workers
+        logging.disable(logging.CRITICAL)
+        self.saved = (os.fork, os.waitpid, os.kill, os.pipe, _rss_bytes)
+        self.next_pid = 100
+        self.forked = []
+        # Queued results of waitpid
+        self.exited = []
+        self.signals = []
+        # Pids for which kill fails as they have already exited
+        self.gone = set()
+        # Maps pids to the write ends of their ready pipes
+        self.writers = dict()
+        self.writer = None
+        self.rss = 0
+        os.fork = self.fork
+        os.waitpid = self.waitpid
+        os.kill = self.kill
+        os.pipe = self.pipe
+        _rss_bytes = lambda: self.rss
+        self.server = PreforkServer(
+            None, '127.0.0.1', 0, workers=2,
+            max_requests=100, max_rss=1000
+        )
+
+    def tearDown(self):
+        # pylint: disable=W0603
+        global _rss_bytes
+        (os.fork, os.waitpid, os.kill, os.pipe, _rss_bytes) = self.saved
+        for ready in self.server.starting.values():
+            os.close(ready)
+        for writer in self.writers.values():
+            os.close(writer)
+        logging.disable(logging.NOTSET)
+
+    def pipe(self):
+        """
+        Create a pipe, keeping a copy of its write end, which the master
+        closes, so that the test can report the worker's readiness.
+        """
+        (ready_read, ready_write) = self.saved[3]()
+        self.writer = os.dup(ready_write)
+        return (ready_read, ready_write)
+
+    def fork(self):
+        """
+        Pretend to fork a worker, returning its pid to the master.
+        """
+        pid = self.next_pid
+        self.next_pid += 1
+        self.forked.append(pid)
+        self.writers[pid] = self.writer
+        return pid
+
+    def waitpid(self, pid, options):
+        """
+        Return the next queued exit status, or none.
+        """
+        # pylint: disable=W0613
+        if self.exited:
+            return self.exited.pop(0)
+        return (0, 0)
+
+    def kill(self, pid, sig):
+        """
+        Record a signal sent to a worker which has not yet exited.
+        """
+        if pid in self.gone:
+            raise OSError(errno.ESRCH, os.strerror(errno.ESRCH))
+        self.signals.append((pid, sig))
+
+    def loaded(self, pid, success=True):
+        """
+        Report that the given worker has loaded the application,
+        or has failed to.
+        """
+        writer = self.writers.pop(pid)
+        if success:
+            os.write(writer, b'.')
+        os.close(writer)
+
+    def testSpawn(self):
+        """
+        Test that workers are forked until there are enough.
+        """
+        self.server._spawn()
+        self.assertEqual(self.forked, [100, 101])
+        self.assertEqual(
+            sorted(self.server.workers), sorted(self.server.starting)
+        )
+        self.assertEqual(
+            [generation for (generation, _) in self.server.workers.values()],
+            [0, 0]
+        )
+        self.server._spawn()
+        self.assertEqual(self.forked, [100, 101])
+
+    def testWorkerSignals(self):
+        """
+        Test that forked workers do not run the master's signal handlers.
+        """
+        sigs = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+        saved = [signal.getsignal(sig) for sig in sigs]
+        handlers = []
+
+        def run_worker(ready):
+            """
+            Record the signal handlers the worker starts with.
+            """
+            os.close(ready)
+            handlers.extend(signal.getsignal(sig) for sig in sigs)
+            raise _WorkerExit()
+        os.fork = lambda: 0
+        self.server._run_worker = run_worker
+        try:
+            for sig in sigs:
+                signal.signal(sig, self.server._reload_handler)
+            self.assertRaises(_WorkerExit, self.server._spawn)
+        finally:
+            for (sig, handler) in zip(sigs, saved):
+                signal.signal(sig, handler)
+        self.assertEqual(handlers, [signal.SIG_DFL] * 3)
+
+    def testReap(self):
+        """
+        Test that exited workers are collected and replaced.
+        """
+        self.server._spawn()
+        self.exited = [(100, 0), (999, 0)]
+        self.server._reap()
+        self.assertEqual(list(self.server.workers), [101])
+        self.assertEqual(list(self.server.starting), [101])
+        self.assertEqual(self.server.respawn_delay, 0)
+        self.server._spawn()
+        self.assertEqual(self.forked, [100, 101, 102])
+
+    def testBackoff(self):
+        """
+        Test that workers failing soon after starting are replaced after
+        a growing delay, and others at once.
+        """
+        self.server._spawn()
+        self.exited = [(100, self.FAILED)]
+        self.server._reap()
+        self.assertEqual(self.server.respawn_delay, 1)
+        self.assertTrue(self.server.next_spawn > time.time())
+        self.server._spawn()
+        self.assertEqual(self.forked, [100, 101])
+        self.exited = [(101, self.KILLED)]
+        self.server._reap()
+        self.assertEqual(self.server.respawn_delay, 2)
+        self.server.respawn_delay = 40
+        self.server.next_spawn = 0
+        self.server._spawn()
+        self.exited = [(102, self.FAILED)]
+        self.server._reap()
+        self.assertEqual(
+            self.server.respawn_delay, self.server.MAX_RESPAWN_DELAY
+        )
+        # Long-lived workers are replaced at once
+        self.server.next_spawn = 0
+        self.server.workers[103] = (
+            0, time.time() - self.server.MIN_WORKER_LIFETIME - 1
+        )
+        self.exited = [(103, self.FAILED)]
+        self.server._reap()
+        self.assertEqual(self.server.next_spawn, 0)
+        self.server._spawn()
+        # As are workers exiting cleanly, which reset the delay
+        self.exited = [(104, 0)]
+        self.server._reap()
+        self.assertEqual(self.server.respawn_delay, 0)
+        self.server._spawn()
+        self.assertEqual(self.forked, [100, 101, 102, 103, 104, 105, 106])
+
+    def testRetire(self):
+        """
+        Test that workers are asked to stop once, and killed once they have
+        outstayed the graceful timeout.
+        """
+        self.server._spawn()
+        before = time.time()
+        self.server._retire(100)
+        self.server._retire(100)
+        self.assertEqual(self.signals, [(100, signal.SIGTERM)])
+        self.assertTrue(
+            before + self.server.graceful_timeout <=
+            self.server.stopping[100] <=
+            time.time() + self.server.graceful_timeout
+        )
+        # Workers which have already exited are not an error
+        self.gone.add(101)
+        self.server._retire(101)
+        self.assertEqual(sorted(self.server.stopping), [100, 101])
+        self.server._reap()
+        self.assertEqual(self.signals, [(100, signal.SIGTERM)])
+        self.server.stopping[100] = time.time() - 1
+        self.server._reap()
+        self.assertEqual(
+            self.signals, [(100, signal.SIGTERM), (100, signal.SIGKILL)]
+        )
+        self.exited = [(100, self.KILLED), (101, 0)]
+        self.server._reap()
+        self.assertEqual(self.server.workers, dict())
+        self.assertEqual(self.server.stopping, dict())
+
+    def testGenerations(self):
+        """
+        Test that old workers are retired once a new worker has loaded the
+        application, and not before.
+        """
+        self.server._spawn()
+        self.loaded(100)
+        self.server._wait_ready(0)
+        self.assertEqual(list(self.server.starting), [101])
+        self.server.generation += 1
+        self.server._spawn()
+        self.assertEqual(self.forked, [100, 101, 102, 103])
+        self.server._wait_ready(0)
+        self.assertEqual(self.signals, [])
+        # A worker of the old generation is not a replacement
+        self.loaded(101)
+        self.server._wait_ready(0)
+        self.assertEqual(self.signals, [])
+        # Nor is one failing to load the application
+        self.loaded(102, success=False)
+        self.server._wait_ready(0)
+        self.assertEqual(self.signals, [])
+        self.assertEqual(list(self.server.starting), [103])
+        self.loaded(103)
+        self.server._wait_ready(0)
+        self.assertEqual(
+            sorted(self.signals),
+            [(100, signal.SIGTERM), (101, signal.SIGTERM)]
+        )
+        self.assertEqual(self.server.starting, dict())
+        # Old workers failing do not delay new ones
+        self.exited = [(100, self.FAILED)]
+        self.server._reap()
+        self.assertEqual(self.server.respawn_delay, 0)
+        self.exited = [(102, self.FAILED)]
+        self.server._reap()
+        self.assertEqual(self.server.respawn_delay, 1)
+
+    def testRecycleByRequests(self):
+        """
+        Test that a worker stops after serving about max_requests requests.
+        """
+        worker = _Worker(self.server, None, None)
+        self.assertTrue(100 <= worker.max_requests <= 110)
+        worker.max_requests = 3
+        for _ in range(2):
+            worker.request_started()
+            self.assertEqual(worker.active, 1)
+            worker.request_finished()
+            self.assertEqual(worker.active, 0)
+            self.assertTrue(worker.alive)
+        worker.request_started()
+        self.assertFalse(worker.alive)
+        worker.request_finished()
+        self.assertEqual(worker.served, 3)
+        self.assertEqual(worker.active, 0)
+
+    def testRecycleByRSS(self):
+        """
+        Test that a worker stops once its resident set exceeds max_rss.
+        """
+        worker = _Worker(self.server, None, None)
+        self.rss = 1000
+        worker.request_started()
+        worker.request_finished()
+        self.assertTrue(worker.alive)
+        self.rss = 1001
+        worker.request_started()
+        worker.request_finished()
+        self.assertFalse(worker.alive)
+        self.server.max_rss = 0
+        worker = _Worker(self.server, None, None)
+        worker.request_started()
+        worker.request_finished()
+        self.assertTrue(worker.alive)
+
+
+if __name__ == '__main__':
+    test_main()
@@ -0,0 +1,111 @@
+#!/usr/bin/python
+
+"""
+Serialisers used to encode whole batches of rows into JSON at once.
+"""
+
+import json
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class JSONBackend(object):
+
+    """
+    Encodes batches of rows, each a dictionary, using Python's 'json' module.
+    The output is identical to that of JSONStreamingEncoder, provided that
+    dates and times have already been converted to strings.
+    """
+
+    name = 'json'
+
+    def __init__(self):
+        self.encoder = json.JSONEncoder(separators=(',', ':'))
+
+    def dumps_rows(self, rows):
+        """
+        Return the JSON encoding of the given list of rows,
+        as a comma-separated list of JSON objects without enclosing brackets.
+        Raise TypeError or ValueError if some value cannot be encoded.
+        """
+        return self.encoder.encode(rows)[1:-1]
+
+
+# Rows of values which other encoders are prone to encode differently
+# from Python's 'json' module: floating-point numbers needing full precision
+# or an exponent, integers too large for 64 bits, and strings with
+# non-ASCII characters, escapes and forward slashes
+EXACTNESS_PROBE = [
+    dict(value=0.1 + 0.2),
+    dict(value=1e-7),
+    dict(value=1e22),
+    dict(value=2 ** 64 + 1),
+    dict(value=-2 ** 63),
+    dict(value=u'caf\xe9 \u2603 "a\\b"\n</c>')
+]
+
+
+class UJSONBackend(JSONBackend):
+
+    """
+    Encodes batches of rows using the 'ujson' module, if installed
+    in a version whose output is exactly that of Python's 'json' module.
+    Versions which output floating-point numbers with less precision,
+    or in another form, are refused.
+    """
+
+    name = 'ujson'
+
+    def __init__(self):
+        super(UJSONBackend, self).__init__()
+        if ujson is None:
+            raise ValueError("The 'ujson' module is not installed")
+        try:
+            exact = self.dumps_rows(EXACTNESS_PROBE) == super(
+                UJSONBackend, self
+            ).dumps_rows(EXACTNESS_PROBE)
+        except (TypeError, ValueError, OverflowError):
+            exact = False
+        if not exact:
+            raise ValueError(
+                "The installed 'ujson' module does not encode exactly "
+                "as the 'json' module does"
+            )
+
+    def dumps_rows(self, rows):
+        try:
+            return ujson.dumps(
+                rows, ensure_ascii=True, escape_forward_slashes=False,
+                double_precision=17
+            )[1:-1]
+        except OverflowError as err:
+            # Let the encoder encode integers too large for ujson
+            raise ValueError(str(err))
+
+
+# The available JSON backends, by name, fastest first
+BACKENDS = [
+    ('ujson', UJSONBackend),
+    ('json', JSONBackend)
+]
+
+
+def get_backend(name='json'):
+    """
+    Return an instance of the JSON backend with the given name,
+    or if the name is 'auto', of the fastest installed backend.
+    Every backend's output is identical to that of the 'json' backend,
+    which is the default.
+    """
+    for (backend_name, backend) in BACKENDS:
+        if name == backend_name:
+            return backend()
+        if name == 'auto':
+            try:
+                return backend()
+            except ValueError:
+                pass
+    raise ValueError("Unknown JSON backend '%s'" % name)
@@ -4,10 +4,231 @@
 Encode values suitable for output.
 """
 
+import csv
 import json
+import sys
+from json.encoder import encode_basestring_ascii
 from datetime import datetime
+from itertools import chain, imap
+from timeit import timeit
+from swaggerapp.backends import get_backend
 from unittest import main as test_main, TestCase
 
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+try:
+    import pyarrow.parquet as parquet
+except ImportError:
+    parquet = None
+
+
+# Default size, in bytes, of the chunks of output yielded by coalesce
+DEFAULT_CHUNK_SIZE = 32 * 1024
+# Default size, in bytes, of the first chunk of output yielded by coalesce
+DEFAULT_FIRST_CHUNK_SIZE = 1024
+
+
+def coalesce(
+    fragments,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    first_chunk_size=DEFAULT_FIRST_CHUNK_SIZE
+):
+    """
+    A generator which gathers the given small string fragments into
+    chunks of at least chunk_size bytes (except perhaps the last),
+    so that consumers such as WSGI servers and compressors see
+    a few large writes rather than very many tiny ones.
+    Only about one chunk is held in memory at a time.
+
+    To keep the time to first byte low, the first chunk is flushed once it
+    reaches first_chunk_size bytes, and each subsequent chunk may be twice
+    the size of the previous one, until chunk_size is reached.
+    """
+    threshold = min(first_chunk_size, chunk_size)
+    buf = []
+    buffered = 0
+    for fragment in fragments:
+        buf.append(fragment)
+        buffered += len(fragment)
+        if buffered >= threshold:
+            yield ''.join(buf)
+            buf = []
+            buffered = 0
+            threshold = min(threshold * 2, chunk_size)
+    if buf:
+        yield ''.join(buf)
+
+
+class RowEncoder(object):
+
+    """
+    Encodes the rows of a homogeneous result set, given as tuples,
+    into JSON objects.
+    The result set's schema is a list of (column name, kind) tuples,
+    where the kind is one of 'integer', 'unsigned', 'float', 'decimal',
+    'datetime', 'date', 'time', 'string', 'binary' or 'other'.
+    The encoded column names, and an encoder for each column's kind of
+    values, are worked out once from the schema rather than once per cell.
+    Output is identical to that of JSONStreamingEncoder given each row as
+    a dictionary mapping column names to values.
+    """
+
+    # Kinds of values encoded as strings using their isoformat method
+    TEMPORAL_KINDS = ('datetime', 'date')
+
+    def __init__(self, encoder, schema):
+        """
+        Build a row encoder for the given schema, which falls back to the
+        given JSONStreamingEncoder for values of unexpected types.
+        If that encoder has a backend, batches of rows are encoded with it.
+        """
+        self.encoder = encoder
+        self.backend = encoder.backend
+        self.names = [name for (name, kind) in schema]
+        self.temporal = [
+            index for (index, (name, kind)) in enumerate(schema)
+            if kind in self.TEMPORAL_KINDS
+        ]
+        value_encoders = dict(
+            integer=self._encode_integer,
+            unsigned=self._encode_integer,
+            string=self._encode_string,
+            binary=self._encode_string,
+            datetime=self._encode_temporal,
+            date=self._encode_temporal
+        )
+        names = self.names
+        # As in a dictionary, a repeated column name takes the last value
+        indices = dict((name, index) for (index, name) in enumerate(names))
+        # Emit columns in the order in which a dictionary holding the row
+        # would iterate over them, for compatibility with dictionary rows
+        self.columns = [
+            (
+                self.encode_value(str(name)) + ':',
+                indices[name],
+                value_encoders.get(schema[indices[name]][1], self._encode)
+            ) for name in dict.fromkeys(names)
+        ]
+        # The encoder of each column's values, in the schema's order
+        self.value_encoders = [
+            value_encoders.get(kind, self._encode) for (name, kind) in schema
+        ]
+
+    def encode_value(self, value):
+        """
+        Return the JSON encoding of the given value of any type.
+        """
+        return ''.join(self.encoder.to_json(value))
+
+    def _encode(self, value):
+        """
+        Return the JSON encoding of a value not expected to be a datetime.
+        """
+        try:
+            return json.dumps(value)
+        except TypeError:
+            return self.encode_value(value)
+
+    def _encode_integer(self, value):
+        """
+        Return the JSON encoding of a value expected to be an integer.
+        """
+        if value.__class__ in (int, long):
+            return str(value)
+        return self._encode(value)
+
+    def _encode_string(self, value):
+        """
+        Return the JSON encoding of a value expected to be a string.
+        """
+        if isinstance(value, basestring):
+            return encode_basestring_ascii(value)
+        return self._encode(value)
+
+    def _encode_temporal(self, value):
+        """
+        Return the JSON encoding of a value expected to be a date or time.
+        """
+        try:
+            return '"' + value.isoformat() + '"'
+        except AttributeError:
+            return self.encode_value(value)
+
+    def encode(self, row):
+        """
+        Return the JSON object encoding the given tuple of column values.
+        """
+        return '{' + ','.join([
+            name + encode(row[index])
+            for (name, index, encode) in self.columns
+        ]) + '}'
+
+    def _as_dict(self, row):
+        """
+        Return the given tuple of column values as a dictionary suitable
+        for a backend, with dates and times already encoded as strings.
+        """
+        if self.temporal:
+            row = list(row)
+            for index in self.temporal:
+                if row[index] is not None:
+                    row[index] = row[index].isoformat()
+        return dict(zip(self.names, row))
+
+    def encode_array(self, row):
+        """
+        Return the JSON array encoding the given tuple of column values,
+        in the schema's order.
+        """
+        return '[' + ','.join([
+            encode(value)
+            for (encode, value) in zip(self.value_encoders, row)
+        ]) + ']'
+
+    def _as_list(self, row):
+        """
+        Return the given tuple of column values as a list suitable for
+        a backend, with dates and times already encoded as strings.
+        """
+        row = list(row)
+        for index in self.temporal:
+            if row[index] is not None:
+                row[index] = row[index].isoformat()
+        return row
+
+    def encode_array_batch(self, rows):
+        """
+        Return the JSON arrays encoding the given list of tuples of
+        column values, separated by commas.
+        """
+        if self.backend is not None:
+            try:
+                return self.backend.dumps_rows(
+                    [self._as_list(row) for row in rows]
+                )
+            except (AttributeError, TypeError, ValueError, OverflowError):
+                # Some value needs this encoder's own handling
+                pass
+        return ','.join([self.encode_array(row) for row in rows])
+
+    def encode_batch(self, rows):
+        """
+        Return the JSON objects encoding the given list of tuples of
+        column values, separated by commas.
+        """
+        if self.backend is not None:
+            try:
+                return self.backend.dumps_rows(
+                    [self._as_dict(row) for row in rows]
+                )
+            except (AttributeError, TypeError, ValueError, OverflowError):
+                # Some value needs this encoder's own handling
+                pass
+        return ','.join([self.encode(row) for row in rows])
+
 
 class JSONStreamingEncoder(object):
 
@@ -22,20 +243,40 @@ class JSONStreamingEncoder(object):
     are not permitted by this encoder.
     """
 
-    def __init__(self, value=None):
+    def __init__(
+        self, value=None, chunk_size=None,
+        first_chunk_size=DEFAULT_FIRST_CHUNK_SIZE, backend=None
+    ):
         """
         Construct a encoder instance, optionally passing in a Python value
         to be encoded.
+        If a chunk_size is given, output is coalesced into chunks
+        of about that many bytes; see coalesce.
+        If a backend (see swaggerapp.backends) is given, result sets
+        offering batches of rows are encoded a batch at a time using it.
         """
         self.terminator = ''
         self.value = value
+        self.chunk_size = chunk_size
+        self.first_chunk_size = first_chunk_size
+        self.backend = backend
 
     def __iter__(self):
         """
         Iterate over chunks of the JSON encoding of the Python value passed in
         at construction time (if any).
         """
-        return self.to_json(self.value)
+        return self.to_chunks(self.value)
+
+    def to_chunks(self, value, array_not_object=None):
+        """
+        Like to_json, but if this encoder has a chunk_size,
+        yield the output in chunks of about that size.
+        """
+        fragments = self.to_json(value, array_not_object)
+        if not self.chunk_size:
+            return fragments
+        return coalesce(fragments, self.chunk_size, self.first_chunk_size)
 
     def start_array(self):
         """
@@ -112,11 +353,44 @@ class JSONStreamingEncoder(object):
             for entry in value:
                 yield entry
 
+    def _rows_to_array(self, value):
+        """
+        Generator function which converts the given result set
+        to a JSON array of JSON objects, one per row.
+        The result set must provide a row_schema method returning
+        a schema as understood by RowEncoder,
+        and an iter_tuples method returning an iterator over its rows.
+        """
+        yield self.start_array()
+        rows = self._encoded_rows(value)
+        for row in rows:
+            yield row
+            break
+        for row in rows:
+            yield ',' + row
+        yield self.end_array()
+
+    def _encoded_rows(self, value):
+        """
+        Given a result set, return an iterator over JSON encodings of
+        its rows, or if it provides an iter_batches method returning an
+        iterator over lists of rows, and this encoder has a backend, of
+        batches of its rows.
+        """
+        row_encoder = RowEncoder(self, value.row_schema())
+        if self.backend is not None and hasattr(value, 'iter_batches'):
+            return imap(row_encoder.encode_batch, value.iter_batches())
+        return imap(row_encoder.encode, value.iter_tuples())
+
     def _to_array(self, value):
         """
         Generator function which converts the given Python value
         to a JSON array, converting it as necessary.
         """
+        if hasattr(value, 'row_schema'):
+            for json_snippet in self._rows_to_array(value):
+                yield json_snippet
+            return
         first = True
         for item in self._make_array_generator(value):
             if first:
@@ -187,9 +461,661 @@ class JSONStreamingEncoder(object):
                 yield chunk
 
 
+class JSONStackEncoder(JSONStreamingEncoder):
+
+    """
+    An alternative engine to JSONStreamingEncoder, producing identical
+    output. Rather than encoding nested values using nested generators,
+    through all of which each fragment of output must pass, it walks the
+    value using an explicit stack, and gathers output into a buffer which
+    is yielded whenever it has grown enough. So its cost does not depend on
+    how deeply values are nested, and nesting depth is not limited by
+    Python's recursion limit.
+    """
+
+    # The maximum number of fragments buffered before being yielded.
+    # Starting from one, the number doubles after each yield up to this.
+    MAX_BUFFERED_FRAGMENTS = 1024
+
+    @staticmethod
+    def _encode_scalar(value):
+        """
+        Return the JSON encoding of the given value as JSONStreamingEncoder
+        would encode it if it is not a container, or None if it cannot be
+        encoded without treating it as a container.
+        """
+        cls = value.__class__
+        if cls is unicode or cls is str:
+            return encode_basestring_ascii(value)
+        if cls is int or cls is long:
+            return str(value)
+        if value is None:
+            return 'null'
+        try:
+            return '"' + value.isoformat() + '"'
+        except AttributeError:
+            pass
+        try:
+            return json.dumps(value)
+        except TypeError:
+            return None
+
+    def _push(self, stack, out, value, array_not_object):
+        """
+        Begin encoding the given value.
+        If it is a container, push a frame for it onto the given stack,
+        where each frame is a list of [ iterator, closer, first ],
+        after appending its opening bracket to the given output buffer.
+        Otherwise append its encoding to the output buffer.
+        """
+        if array_not_object is None:
+            if isinstance(value, list):
+                array_not_object = True
+            elif isinstance(value, dict):
+                array_not_object = False
+            else:
+                encoded = self._encode_scalar(value)
+                if encoded is not None:
+                    out.append(encoded)
+                    return
+                array_not_object = True
+        if array_not_object is False:
+            out.append('{')
+            stack.append([self._make_object_generator(value), '}', True])
+        elif hasattr(value, 'row_schema'):
+            # Rows are encoded whole, so need no frames of their own
+            out.append('[')
+            stack.append([self._encoded_rows(value), None, True])
+        else:
+            out.append('[')
+            stack.append([
+                iter(self._make_array_generator(value)), ']', True
+            ])
+
+    def to_json(self, value, array_not_object=None):
+        """
+        A generator which successively yields chunks of JSON-format data
+        encoding the given value.
+        If array_not_object is True, generate a JSON array.
+        If array_not_object is False, generate a JSON object.
+        Otherwise, output whichever JSON type is most similar to the type of
+        the given value.
+        """
+        stack = []
+        out = []
+        limit = 1
+        self._push(stack, out, value, array_not_object)
+        while stack:
+            frame = stack[-1]
+            try:
+                item = frame[0].next()
+            except StopIteration:
+                stack.pop()
+                out.append(frame[1] or ']')
+                continue
+            if frame[2]:
+                frame[2] = False
+            else:
+                out.append(',')
+            if frame[1] is None:
+                # A pre-encoded row
+                out.append(item)
+            elif frame[1] == '}':
+                out.append(encode_basestring_ascii(item[0]) + ':')
+                self._push(stack, out, item[1], None)
+            else:
+                self._push(stack, out, item, None)
+            if len(out) >= limit:
+                yield ''.join(out)
+                out = []
+                limit = min(limit * 2, self.MAX_BUFFERED_FRAGMENTS)
+        if out:
+            yield ''.join(out)
+
+
+class NDJSONEncoder(JSONStreamingEncoder):
+
+    """
+    Encodes values as newline-delimited JSON: each row of a result set,
+    or each element of any other value encoded as a JSON array, as a JSON
+    value on a line of its own, so that consumers can parse the output
+    incrementally, and split it to parse in parallel.
+    A value encoded as a JSON object is output whole, on one line.
+    Only one row is encoded at a time, so memory use does not depend on
+    the number of rows.
+    """
+
+    def __init__(
+        self, value=None, chunk_size=None,
+        first_chunk_size=DEFAULT_FIRST_CHUNK_SIZE, backend=None
+    ):
+        super(NDJSONEncoder, self).__init__(
+            value, chunk_size, first_chunk_size, backend
+        )
+        # Encodes each line; as it is always given whole values,
+        # they never need to be split across lines
+        self.line_encoder = JSONStackEncoder(backend=backend)
+
+    def to_json(self, value, array_not_object=None):
+        if array_not_object is None:
+            if isinstance(value, dict):
+                array_not_object = False
+            else:
+                array_not_object = not isinstance(value, basestring)
+        if not array_not_object:
+            for json_snippet in self.line_encoder.to_json(
+                value, array_not_object
+            ):
+                yield json_snippet
+            yield '\n'
+        elif hasattr(value, 'row_schema'):
+            row_encoder = RowEncoder(self.line_encoder, value.row_schema())
+            for row in value.iter_tuples():
+                yield row_encoder.encode(row) + '\n'
+        else:
+            for item in self._make_array_generator(value):
+                for json_snippet in self.line_encoder.to_json(item):
+                    yield json_snippet
+                yield '\n'
+
+
+def row_batches(value):
+    """
+    Return the schema of the given result set, or sequence of
+    dictionaries, and an iterator over lists of its rows as tuples.
+    The kinds of the values of dictionaries are not known.
+    """
+    if hasattr(value, 'row_schema'):
+        if hasattr(value, 'iter_batches'):
+            return (value.row_schema(), value.iter_batches())
+        return (value.row_schema(), imap(
+            lambda row: [row], value.iter_tuples()
+        ))
+    if isinstance(value, dict):
+        value = [value]
+    rows = iter(value)
+    for first in rows:
+        names = first.keys()
+        batches = imap(lambda row: [tuple(
+            row.get(name) for name in names
+        )], rows)
+        return (
+            [(name, 'other') for name in names],
+            chain([[tuple(first.get(name) for name in names)]], batches)
+        )
+    return ([], iter([]))
+
+
+class CompactJSONEncoder(JSONStreamingEncoder):
+
+    """
+    Encodes result sets, or other sequences of rows given as dictionaries,
+    as a compact, columnar JSON object, naming the columns only once:
+        {"columns": [names], "rows": [[values], ...]}
+    where each row is an array of values in the order of the columns.
+    The values of the columns named by dictionary_columns which are
+    present are dictionary-encoded: each distinct value is replaced by its
+    index in that column's dictionary, listed, in order of first
+    appearance, after the rows, as in
+        {"columns": ..., "rows": ..., "dictionaries": {name: [values]}}
+    Missing values are not dictionary-encoded.
+    Only one batch of rows is encoded at a time, but each dictionary
+    holds every distinct value of its column.
+    """
+
+    def __init__(
+        self, value=None, chunk_size=None,
+        first_chunk_size=DEFAULT_FIRST_CHUNK_SIZE, backend=None,
+        dictionary_columns=()
+    ):
+        super(CompactJSONEncoder, self).__init__(
+            value, chunk_size, first_chunk_size, backend
+        )
+        self.dictionary_columns = dictionary_columns
+        self.json_encoder = JSONStackEncoder(backend=backend)
+
+    def _dictionary_encoded(self, schema, batches, dictionaries):
+        """
+        Return an iterator over the given batches of rows, in which the
+        values of the columns with the given dictionaries, by index, are
+        replaced by their indices in those dictionaries, which map each
+        value to its index, and the schema of the rows yielded.
+        """
+        schema = list(schema)
+        for index in dictionaries:
+            schema[index] = (schema[index][0], 'integer')
+
+        def encode_rows(rows):
+            """
+            Dictionary-encode the given batch of rows.
+            """
+            encoded = []
+            for row in rows:
+                row = list(row)
+                for (index, dictionary) in dictionaries.iteritems():
+                    value = row[index]
+                    if value is not None:
+                        row[index] = dictionary.setdefault(
+                            value, len(dictionary)
+                        )
+                encoded.append(row)
+            return encoded
+        return (schema, imap(encode_rows, batches))
+
+    def to_json(self, value, array_not_object=None):
+        (schema, batches) = row_batches(value)
+        names = [name for (name, kind) in schema]
+        dictionaries = dict(
+            (names.index(name), dict())
+            for name in self.dictionary_columns if name in names
+        )
+        value_schema = schema
+        if dictionaries:
+            (schema, batches) = self._dictionary_encoded(
+                schema, batches, dictionaries
+            )
+        yield '{"columns":'
+        for json_snippet in self.json_encoder.to_json(names, True):
+            yield json_snippet
+        yield ',"rows":['
+        row_encoder = RowEncoder(self.json_encoder, schema)
+        first = True
+        for rows in batches:
+            if not rows:
+                continue
+            if not first:
+                yield ','
+            first = False
+            yield row_encoder.encode_array_batch(rows)
+        yield ']'
+        if dictionaries:
+            value_encoder = RowEncoder(self.json_encoder, value_schema)
+            yield ',"dictionaries":{' + ','.join([
+                value_encoder.encode_value(str(names[index])) + ':[' +
+                ','.join([
+                    value_encoder.value_encoders[index](item)
+                    for item in sorted(dictionary, key=dictionary.get)
+                ]) + ']'
+                for (index, dictionary) in sorted(dictionaries.items())
+            ]) + '}'
+        yield '}'
+
+
+class CSVEncoder(object):
+
+    """
+    Encodes result sets, or other sequences of rows given as dictionaries,
+    as comma-separated values, with a header line naming the columns.
+    The columns of a result set are those described by its row_schema,
+    which come from its cursor description; those of other rows are the
+    keys of the first row. Missing values are output as empty fields,
+    dates and times in ISO 8601 format, and any nested values as JSON.
+    Strings are encoded using UTF-8.
+    Only one row is encoded at a time, so memory use does not depend on
+    the number of rows.
+    """
+
+    def __init__(
+        self, value=None, chunk_size=None,
+        first_chunk_size=DEFAULT_FIRST_CHUNK_SIZE, backend=None
+    ):
+        """
+        Construct an encoder instance, taking the same arguments
+        as JSONStreamingEncoder, though backends are not used.
+        """
+        self.value = value
+        self.chunk_size = chunk_size
+        self.first_chunk_size = first_chunk_size
+        self.json_encoder = JSONStackEncoder()
+        # The csv module writes each line to this list, which is emptied
+        # as soon as it has been yielded
+        self.lines = []
+        self.writer = csv.writer(self, lineterminator='\r\n')
+
+    def __iter__(self):
+        return self.to_chunks(self.value)
+
+    def write(self, line):
+        """
+        Accept a line of output from the csv module.
+        """
+        self.lines.append(line)
+
+    def to_chunks(self, value, array_not_object=None):
+        """
+        Like to_csv, but if this encoder has a chunk_size,
+        yield the output in chunks of about that size.
+        """
+        fragments = self.to_csv(value)
+        if not self.chunk_size:
+            return fragments
+        return coalesce(fragments, self.chunk_size, self.first_chunk_size)
+
+    def _encode_value(self, value):
+        """
+        Return the given value as a string suitable for a CSV field.
+        """
+        if value is None:
+            return ''
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        if isinstance(value, (str, int, long, float)):
+            return value
+        try:
+            return value.isoformat()
+        except AttributeError:
+            pass
+        if isinstance(value, (dict, list, tuple)):
+            return ''.join(self.json_encoder.to_json(value))
+        return str(value)
+
+    def _line(self, row):
+        """
+        Return the CSV line encoding the given sequence of values.
+        """
+        self.writer.writerow([self._encode_value(value) for value in row])
+        line = ''.join(self.lines)
+        del self.lines[:]
+        return line
+
+    def to_csv(self, value):
+        """
+        A generator which successively yields lines of CSV-format data
+        encoding the given result set or sequence of dictionaries.
+        """
+        if hasattr(value, 'row_schema'):
+            yield self._line([name for (name, kind) in value.row_schema()])
+            for row in value.iter_tuples():
+                yield self._line(row)
+            return
+        if isinstance(value, dict):
+            value = [value]
+        names = None
+        for row in value:
+            if names is None:
+                names = row.keys()
+                yield self._line(names)
+            yield self._line([row.get(name) for name in names])
+
+
+class ArrowStreamEncoder(object):
+
+    """
+    Encodes result sets, or other sequences of rows given as dictionaries,
+    in the Apache Arrow IPC streaming format, using the 'pyarrow' module,
+    if installed: the schema, then a record batch for each batch of rows
+    fetched from the database, so that large result sets are never held
+    in memory whole.
+    The type of each column is mapped from its kind in the result set's
+    row_schema, which comes from its cursor description; see _arrow_type.
+    Unsigned integers become unsigned 64-bit integers, so that none can
+    overflow, binary strings such as BLOBs stay bytes, decimals become
+    floating-point numbers, and times, which are fetched as intervals,
+    and values of other kinds become strings.
+    """
+
+    def __init__(
+        self, value=None, chunk_size=None,
+        first_chunk_size=DEFAULT_FIRST_CHUNK_SIZE, backend=None
+    ):
+        """
+        Construct an encoder instance, taking the same arguments
+        as JSONStreamingEncoder, though backends are not used.
+        """
+        if pyarrow is None:
+            raise ValueError("The 'pyarrow' module is not installed")
+        self.value = value
+        self.chunk_size = chunk_size
+        self.first_chunk_size = first_chunk_size
+        # pyarrow writes its output to this list, which is emptied
+        # as soon as it has been yielded
+        self.buffers = []
+
+    def __iter__(self):
+        return self.to_chunks(self.value)
+
+    # Attribute checked by pyarrow before writing to a Python file object
+    closed = False
+
+    def write(self, data):
+        """
+        Accept some output from pyarrow.
+        """
+        if not isinstance(data, str):
+            data = memoryview(data).tobytes()
+        self.buffers.append(data)
+        return len(data)
+
+    def flush(self):
+        """
+        Do nothing, as output is already held only until it is yielded.
+        """
+        pass
+
+    def _take_output(self):
+        """
+        Return, and forget, the output written so far.
+        """
+        output = ''.join(self.buffers)
+        del self.buffers[:]
+        return output
+
+    def to_chunks(self, value, array_not_object=None):
+        """
+        Like to_arrow, but if this encoder has a chunk_size,
+        yield the output in chunks of about that size.
+        """
+        fragments = self.to_arrow(value)
+        if not self.chunk_size:
+            return fragments
+        return coalesce(fragments, self.chunk_size, self.first_chunk_size)
+
+    @classmethod
+    def _arrow_type(cls, kind):
+        """
+        Return the Arrow type of values of the given kind.
+        """
+        return dict(
+            integer=pyarrow.int64(),
+            unsigned=pyarrow.uint64(),
+            float=pyarrow.float64(),
+            decimal=pyarrow.float64(),
+            datetime=pyarrow.timestamp('us'),
+            date=pyarrow.date32(),
+            binary=pyarrow.binary()
+        ).get(kind, pyarrow.string())
+
+    @classmethod
+    def _converter(cls, kind):
+        """
+        Return a function converting values of the given kind into values
+        of its Arrow type, or None if they need no conversion.
+        """
+        if kind == 'decimal':
+            return float
+        if kind in ('integer', 'unsigned', 'float', 'datetime', 'date'):
+            return None
+        if kind == 'binary':
+            return cls._to_bytes
+
+        def to_unicode(value):
+            """
+            Convert the given value into a Unicode string.
+            """
+            if isinstance(value, str):
+                return value.decode('utf-8', 'replace')
+            return unicode(value)
+        return to_unicode
+
+    @classmethod
+    def _to_bytes(cls, value):
+        """
+        Convert the given binary string, which the connector may return as
+        a bytearray, or as Unicode if it is text in a binary collation,
+        into a byte string.
+        """
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return str(value)
+
+    @classmethod
+    def _record_batch(cls, arrow_schema, converters, rows):
+        """
+        Return an Arrow record batch holding the given list of rows,
+        whose values are converted using the given converters.
+        """
+        arrays = []
+        for (field, convert, values) in zip(
+            arrow_schema, converters, zip(*rows)
+        ):
+            if convert is not None:
+                values = [
+                    None if item is None else convert(item)
+                    for item in values
+                ]
+            arrays.append(pyarrow.array(values, type=field.type))
+        return pyarrow.RecordBatch.from_arrays(
+            arrays, [field.name for field in arrow_schema]
+        )
+
+    def _open_writer(self, arrow_schema):
+        """
+        Return a pyarrow writer of the given schema to this encoder.
+        """
+        return pyarrow.RecordBatchStreamWriter(
+            pyarrow.PythonFile(self, mode='w'), arrow_schema
+        )
+
+    def _write_batch(self, writer, batch):
+        """
+        Write the given record batch using the given writer.
+        """
+        writer.write_batch(batch)
+
+    def _close_writer(self, writer):
+        """
+        Finish writing using the given writer.
+        """
+        writer.close()
+
+    def to_arrow(self, value):
+        """
+        A generator which successively yields pieces of the encoding of
+        the given result set or sequence of dictionaries.
+        """
+        (schema, batches) = row_batches(value)
+        arrow_schema = pyarrow.schema([
+            pyarrow.field(name, self._arrow_type(kind))
+            for (name, kind) in schema
+        ])
+        converters = [self._converter(kind) for (name, kind) in schema]
+        writer = self._open_writer(arrow_schema)
+        for rows in batches:
+            if rows:
+                self._write_batch(writer, self._record_batch(
+                    arrow_schema, converters, rows
+                ))
+                yield self._take_output()
+        self._close_writer(writer)
+        yield self._take_output()
+
+
+class ParquetEncoder(ArrowStreamEncoder):
+
+    """
+    Encodes result sets, or other sequences of rows given as dictionaries,
+    in the Apache Parquet file format, using the 'pyarrow' module, if
+    installed with Parquet support, with the same column types as
+    ArrowStreamEncoder.
+    Batches of rows are gathered into row groups of at least
+    ROW_GROUP_ROWS rows, so about one row group is held in memory at once.
+    The file's metadata is written at its end, so readers need the whole
+    file, though the server never holds it.
+    """
+
+    # The smallest number of rows in each row group but the last
+    ROW_GROUP_ROWS = 64 * 1024
+
+    def __init__(
+        self, value=None, chunk_size=None,
+        first_chunk_size=DEFAULT_FIRST_CHUNK_SIZE, backend=None
+    ):
+        super(ParquetEncoder, self).__init__(
+            value, chunk_size, first_chunk_size, backend
+        )
+        if parquet is None:
+            raise ValueError("The 'pyarrow.parquet' module is not installed")
+        self.pending = []
+        self.pending_rows = 0
+
+    def _open_writer(self, arrow_schema):
+        return parquet.ParquetWriter(
+            pyarrow.PythonFile(self, mode='w'), arrow_schema
+        )
+
+    def _write_batch(self, writer, batch):
+        self.pending.append(batch)
+        self.pending_rows += batch.num_rows
+        if self.pending_rows >= self.ROW_GROUP_ROWS:
+            self._write_row_group(writer)
+
+    def _write_row_group(self, writer):
+        """
+        Write the record batches gathered so far as a row group.
+        """
+        if self.pending:
+            writer.write_table(pyarrow.Table.from_batches(self.pending))
+            self.pending = []
+            self.pending_rows = 0
+
+    def _close_writer(self, writer):
+        self._write_row_group(writer)
+        writer.close()
+
+
+# The available JSON encoding engines, by name
+ENGINES = dict(
+    generator=JSONStreamingEncoder,
+    stack=JSONStackEncoder
+)
+
+
+def get_engine(name):
+    """
+    Return the JSON encoder class with the given name.
+    """
+    if name not in ENGINES:
+        raise ValueError("Unknown JSON encoding engine '%s'" % name)
+    return ENGINES[name]
+
+
+# The media type of JSON
+JSON_MEDIA_TYPE = 'application/json'
+
+# The available output formats other than JSON, by name,
+# as (media type, encoder class) tuples
+FORMATS = dict(
+    ndjson=('application/x-ndjson', NDJSONEncoder),
+    csv=('text/csv', CSVEncoder),
+    compact=('application/vnd.reporting.compact+json', CompactJSONEncoder)
+)
+# The Arrow formats are only available if pyarrow is installed
+if pyarrow is not None:
+    FORMATS['arrow'] = (
+        'application/vnd.apache.arrow.stream', ArrowStreamEncoder
+    )
+if parquet is not None:
+    FORMATS['parquet'] = ('application/vnd.apache.parquet', ParquetEncoder)
+
+
 """
 Pairs of input data and expected output data for unit testing.
 """
+try:
+    TEST_LONG = long
+except NameError:
+    # Python 3 has a single integer type
+    TEST_LONG = int
 TEST_INPUT_DATETIME = datetime(1999, 12, 31, 23, 59, 59, 999999)
 TEST_OUTPUT_DATETIME = '"1999-12-31T23:59:59.999999"'
 TEST_INPUT_SUBARRAY = [
@@ -284,6 +1210,52 @@ TEST_OUTPUT_GEN_ARRAY = (
 )
 
 
+# Pylint warns that the following class has too few public methods.
+# It is a stand-in for a database result set, so that is expected.
+# pylint: disable=R0903
+class ExampleRecordSet(object):
+
+    """
+    An example result set, with tuple rows described by a schema.
+    """
+
+    schema = [
+        ('name', 'string'),
+        ('count', 'integer'),
+        ('created', 'datetime'),
+        ('ratio', 'float'),
+        ('count', 'integer'),
+        ('owner', 'string')
+    ]
+    rows = [
+        (u'first', 1, TEST_INPUT_DATETIME, 0.5, 2, None),
+        (u'caf\xe9 "quoted"', TEST_LONG(10), None, None, True, 'ascii'),
+    ]
+
+    def row_schema(self):
+        """
+        Return the column names and kinds of this result set.
+        """
+        return self.schema
+
+    def iter_tuples(self):
+        """
+        Return an iterator over the rows of this result set as tuples.
+        """
+        return iter(self.rows)
+
+    def iter_batches(self):
+        """
+        Return an iterator over lists of rows of this result set,
+        one row per list.
+        """
+        return iter([[row] for row in self.rows])
+
+    def __iter__(self):
+        names = [name for (name, kind) in self.schema]
+        return iter([dict(zip(names, row)) for row in self.rows])
+
+
 # Silence a warning about there being too many public methods.
 # It is not a problem to have too many unit tests.
 # pylint: disable=R0904
@@ -375,6 +1347,408 @@ class JSONTestCase(TestCase):
         test_output = ''.join(test_output_iter)
         self.assertEqual(test_output, TEST_OUTPUT_GEN_ARRAY)
 
+    def testRowsToArray(self):
+        """
+        Test that converting a result set with a schema into a JSON array
+        produces exactly the output for the equivalent dictionaries.
+        """
+        test_output = ''.join(self.enc.to_json(ExampleRecordSet(), True))
+        expected = ''.join(
+            JSONStreamingEncoder().to_json(list(ExampleRecordSet()))
+        )
+        self.assertEqual(test_output, expected)
+
+    def testEmptyRowsToArray(self):
+        """
+        Test converting an empty result set with a schema into a JSON array.
+        """
+        test_input = ExampleRecordSet()
+        test_input.rows = []
+        test_output = ''.join(self.enc.to_json(test_input, True))
+        self.assertEqual(test_output, '[]')
+
+
+class BackendTestCase(TestCase):
+
+    """
+    Conformance tests for JSON backends, comparing their output with
+    that of the streaming JSON encoder without a backend.
+    """
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    def assertConforms(self, backend_name):
+        """
+        Test that the given-named backend, if installed, encodes
+        a result set exactly as the encoder does without a backend,
+        and values which encoders are prone to get wrong exactly as
+        Python's 'json' module does.
+        """
+        try:
+            backend = get_backend(backend_name)
+        except ValueError:
+            self.skipTest("JSON backend '%s' not installed" % backend_name)
+        for (kind, values) in [
+            ('integer', [2 ** 64 + 1, -2 ** 63, 0]),
+            ('string', [u'caf\xe9 \u2603 "a\\b"\n</c>', u'/', None]),
+            ('float', [0.1 + 0.2, 1e-7, 1e22])
+        ]:
+            exact_input = ExampleRecordSet()
+            exact_input.schema = [('value', kind)]
+            exact_input.rows = [(value,) for value in values]
+            expected = json.dumps(list(exact_input), separators=(',', ':'))
+            for engine in ENGINES.values():
+                self.assertEqual(''.join(
+                    engine(backend=backend).to_json(exact_input, True)
+                ), expected)
+        test_input = ExampleRecordSet()
+        test_input.rows = [
+            (u'first', 1, TEST_INPUT_DATETIME, 0.5, 2, None),
+            (u'caf\xe9 "b" \\ c/d\n', TEST_LONG(10), None, None, True, 'ascii')
+        ]
+        for engine in ENGINES.values():
+            test_output = ''.join(
+                engine(backend=backend).to_json(test_input, True)
+            )
+            expected = ''.join(
+                JSONStreamingEncoder().to_json(list(test_input), True)
+            )
+            self.assertEqual(test_output, expected)
+
+    def testJSON(self):
+        """
+        Test the standard library JSON backend.
+        """
+        self.assertConforms('json')
+
+    def testUJSON(self):
+        """
+        Test the ujson backend.
+        """
+        self.assertConforms('ujson')
+
+    def testFallback(self):
+        """
+        Test that values a backend cannot encode are handled by the encoder.
+        """
+        test_input = ExampleRecordSet()
+        test_input.rows = [
+            (u'first', 1, 'not a datetime', 0.5, 2, None)
+        ]
+        test_output = ''.join(
+            JSONStackEncoder(backend=get_backend('json'))
+            .to_json(test_input, True)
+        )
+        expected = ''.join(
+            JSONStreamingEncoder().to_json(list(test_input), True)
+        )
+        self.assertEqual(test_output, expected)
+
+
+class CoalesceTestCase(TestCase):
+
+    """
+    Unit tests for coalescing the streaming JSON encoder's output.
+    """
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    def testChunksMatchUnbuffered(self):
+        """
+        Test that coalescing alters only the chunking of the output.
+        """
+        enc = JSONStreamingEncoder(chunk_size=16, first_chunk_size=4)
+        chunks = list(enc.to_chunks(gen()))
+        fragments = list(JSONStreamingEncoder().to_chunks(gen()))
+        self.assertEqual(''.join(chunks), TEST_OUTPUT_GEN_ARRAY)
+        self.assertTrue(len(chunks) < len(fragments))
+
+    def testChunkSizes(self):
+        """
+        Test that chunks grow from the first chunk size to the chunk size.
+        """
+        chunks = list(coalesce(['ab'] * 100, 16, 4))
+        self.assertEqual(''.join(chunks), 'ab' * 100)
+        self.assertEqual(
+            [len(chunk) for chunk in chunks[:4]], [4, 8, 16, 16]
+        )
+
+
+class JSONStackTestCase(JSONTestCase):
+
+    """
+    Run the streaming JSON encoder's unit tests against the stack engine.
+    """
+
+    def setUp(self):
+        self.enc = JSONStackEncoder()
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    def testDeepNesting(self):
+        """
+        Test converting values nested deeper than the recursion limit.
+        """
+        depth = sys.getrecursionlimit() * 2
+        test_input = []
+        for _ in range(depth):
+            test_input = [test_input]
+        test_output = ''.join(self.enc.to_json(test_input))
+        self.assertEqual(test_output, '[' * (depth + 1) + ']' * (depth + 1))
+
+
+class NDJSONTestCase(TestCase):
+
+    """
+    Unit tests for the newline-delimited JSON encoder.
+    """
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    def testRowsToLines(self):
+        """
+        Test converting a result set into one JSON object per line.
+        """
+        rows = ExampleRecordSet()
+        test_output = ''.join(NDJSONEncoder().to_json(rows, True))
+        expected = ''.join(
+            ''.join(JSONStreamingEncoder().to_json(row)) + '\n'
+            for row in rows
+        )
+        self.assertEqual(test_output, expected)
+
+    def testGenToLines(self):
+        """
+        Test converting a generator into one JSON value per line,
+        without splitting nested arrays.
+        """
+        test_output = ''.join(NDJSONEncoder().to_chunks(gen(), True))
+        expected = ''.join(
+            ''.join(JSONStreamingEncoder().to_json(item)) + '\n'
+            for item in gen()
+        )
+        self.assertEqual(test_output, expected)
+        self.assertEqual(test_output.count('\n'), 5)
+
+    def testDictToLine(self):
+        """
+        Test converting a Python dictionary into a single line.
+        """
+        test_output = ''.join(NDJSONEncoder().to_json(TEST_INPUT_DICT))
+        self.assertEqual(test_output, TEST_OUTPUT_DICT_OBJECT + '\n')
+
+
+class CSVTestCase(TestCase):
+
+    """
+    Unit tests for the CSV encoder.
+    """
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    def testRowsToCSV(self):
+        """
+        Test converting a result set into CSV, with a header line
+        naming every column of its schema.
+        """
+        test_output = ''.join(CSVEncoder().to_chunks(ExampleRecordSet()))
+        self.assertEqual(test_output, (
+            'name,count,created,ratio,count,owner\r\n'
+            'first,1,1999-12-31T23:59:59.999999,0.5,2,\r\n'
+            '"caf\xc3\xa9 ""quoted""",10,,,True,ascii\r\n'
+        ))
+
+    def testDictsToCSV(self):
+        """
+        Test converting dictionaries into CSV, encoding nested values
+        as JSON.
+        """
+        rows = [
+            dict(name='a', links=dict(self='/a')),
+            dict(name='b', links=None)
+        ]
+        test_output = ''.join(CSVEncoder(chunk_size=4).to_chunks(rows))
+        self.assertEqual(test_output, (
+            'name,links\r\n'
+            'a,"{""self"":""/a""}"\r\n'
+            'b,\r\n'
+        ))
+
+
+class CompactJSONTestCase(TestCase):
+
+    """
+    Unit tests for the compact, columnar JSON encoder.
+    """
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    def testRowsToColumns(self):
+        """
+        Test converting a result set into positional rows.
+        """
+        test_output = ''.join(CompactJSONEncoder().to_json(ExampleRecordSet()))
+        self.assertEqual(test_output, (
+            '{"columns":["name","count","created","ratio","count","owner"],'
+            '"rows":[["first",1,' + TEST_OUTPUT_DATETIME + ',0.5,2,null],'
+            '["caf\\u00e9 \\"quoted\\"",10,null,null,true,"ascii"]]}'
+        ))
+
+    def testBackendMatches(self):
+        """
+        Test that encoding batches of rows using a backend alters nothing.
+        """
+        self.assertEqual(
+            ''.join(CompactJSONEncoder(
+                backend=get_backend('json')
+            ).to_json(ExampleRecordSet())),
+            ''.join(CompactJSONEncoder().to_json(ExampleRecordSet()))
+        )
+
+    def testDictionaries(self):
+        """
+        Test dictionary-encoding repeated values, ignoring unknown columns.
+        """
+        rows = [
+            dict(name='a', region='north'),
+            dict(name='b', region='south'),
+            dict(name='c', region='north'),
+            dict(name='d', region=None)
+        ]
+        encoder = CompactJSONEncoder(dictionary_columns=['region', 'other'])
+        test_output = json.loads(''.join(encoder.to_chunks(rows)))
+        self.assertEqual(test_output['columns'], ['region', 'name'])
+        self.assertEqual(test_output['rows'], [
+            [0, 'a'], [1, 'b'], [0, 'c'], [None, 'd']
+        ])
+        self.assertEqual(
+            test_output['dictionaries'], dict(region=['north', 'south'])
+        )
+
+    def testEmpty(self):
+        """
+        Test converting an empty sequence of rows.
+        """
+        self.assertEqual(
+            ''.join(CompactJSONEncoder().to_json([])),
+            '{"columns":[],"rows":[]}'
+        )
+
+
+class ArrowTestCase(TestCase):
+
+    """
+    Unit tests for the Arrow and Parquet encoders, which are skipped
+    if pyarrow is not installed.
+    """
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    def setUp(self):
+        if pyarrow is None:
+            self.skipTest("The 'pyarrow' module is not installed")
+        self.test_input = ExampleRecordSet()
+        self.test_input.rows = [
+            (u'first', 1, TEST_INPUT_DATETIME, 0.5, 2, None),
+            ('caf\xc3\xa9', TEST_LONG(10), None, None, 3, 'ascii'),
+        ]
+
+    def testArrowStream(self):
+        """
+        Test that an Arrow stream holds the result set, batch by batch.
+        """
+        test_output = ''.join(ArrowStreamEncoder().to_chunks(self.test_input))
+        reader = pyarrow.ipc.open_stream(pyarrow.py_buffer(test_output))
+        self.assertEqual(
+            [field.type for field in reader.schema], [
+                pyarrow.string(), pyarrow.int64(), pyarrow.timestamp('us'),
+                pyarrow.float64(), pyarrow.int64(), pyarrow.string()
+            ]
+        )
+        batches = list(reader)
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(
+            batches[1].column(0).to_pylist(), [u'caf\xe9']
+        )
+        self.assertEqual(
+            batches[0].column(2).to_pylist(), [TEST_INPUT_DATETIME]
+        )
+
+    def testParquet(self):
+        """
+        Test that a Parquet file holds the result set in one row group.
+        """
+        if parquet is None:
+            self.skipTest("The 'pyarrow.parquet' module is not installed")
+        test_output = ''.join(ParquetEncoder().to_chunks(self.test_input))
+        parquet_file = parquet.ParquetFile(pyarrow.BufferReader(test_output))
+        self.assertEqual(parquet_file.metadata.num_row_groups, 1)
+        self.assertEqual(
+            parquet_file.read().column(4).to_pylist(), [2, 3]
+        )
+
+    def testBinaryAndUnsigned(self):
+        """
+        Test that binary strings stay bytes and that unsigned integers
+        too large for a signed 64-bit integer do not overflow.
+        """
+        self.test_input.schema = [('blob', 'binary'), ('big', 'unsigned')]
+        self.test_input.rows = [
+            ('\xff\x00', 2 ** 64 - 1),
+            (bytearray('\xc3\x28'), None),
+        ]
+        test_output = ''.join(ArrowStreamEncoder().to_chunks(self.test_input))
+        table = pyarrow.ipc.open_stream(
+            pyarrow.py_buffer(test_output)
+        ).read_all()
+        self.assertEqual(
+            [field.type for field in table.schema],
+            [pyarrow.binary(), pyarrow.uint64()]
+        )
+        self.assertEqual(
+            table.column(0).to_pylist(), ['\xff\x00', '\xc3\x28']
+        )
+        self.assertEqual(table.column(1).to_pylist(), [2 ** 64 - 1, None])
+
+
+def benchmark(repeat=3):
+    """
+    Compare the speed of the JSON encoding engines on deeply-nested
+    and on wide values, printing the best of several timings for each.
+    """
+    deep = 'leaf'
+    for i in range(200):
+        deep = [deep, dict(level=i)]
+    wide = [
+        dict(('column%d' % col, row * col) for col in range(10))
+        for row in range(20000)
+    ]
+    for (label, value, number) in [('deep', deep, 200), ('wide', wide, 2)]:
+        for (name, engine) in sorted(ENGINES.items()):
+            encoder = engine(value, DEFAULT_CHUNK_SIZE)
+            elapsed = min(
+                timeit(lambda: ''.join(encoder), number=number)
+                for _ in range(repeat)
+            )
+            print('%s\t%s\t%.3fs' % (label, name, elapsed))
+
 
 if __name__ == '__main__':
-    test_main()
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+    else:
+        test_main()
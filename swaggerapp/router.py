@@ -0,0 +1,493 @@
+#!/usr/bin/python
+
+"""
+Routing of URLs to the paths of a set of Swagger API specifications,
+using a trie compiled once when the specifications are loaded.
+"""
+
+import sys
+import threading
+import unittest
+from collections import OrderedDict
+from operator import itemgetter
+from timeit import timeit
+from swaggerapp.specification import SwaggerSpecification
+
+
+def path_components(path):
+    """
+    Return the list of components of the given URL or URL pattern,
+    ignoring any trailing empty components, so that a trailing slash
+    makes no difference.
+    """
+    components = path.split('/')
+    while components and not components[-1]:
+        components.pop()
+    return components
+
+
+def is_parameter(component):
+    """
+    Return True if the given URL pattern component is a path parameter,
+    such as '{report}', or False if it is a literal.
+    """
+    return component.startswith('{') and component.endswith('}')
+
+
+# Pylint warns that the following class has too few public methods.
+# It is not intended to have many (or even any) public methods,
+# so this is not a problem, so the following comment silences the warning.
+# pylint: disable=R0903
+
+class _TrieNode(object):
+
+    """
+    A node of a PathTrie, reached by matching a sequence of URL components.
+    """
+
+    __slots__ = ('literals', 'parameter', 'entries')
+
+    def __init__(self):
+        # Child nodes reached by matching literal components
+        self.literals = dict()
+        # The child node reached by matching a path parameter, if any
+        self.parameter = None
+        # (priority, value, parameter names) tuples for patterns ending here
+        self.entries = []
+
+
+class PathTrie(object):
+
+    """
+    A trie of URL patterns, such as '/v1/reports/{report}', split into
+    components on '/', in which URLs are matched component by component,
+    so that a match costs time proportional to the depth of the URL
+    rather than to the number of patterns.
+    A path parameter matches any non-empty component. Where a URL matches
+    both a literal component and a path parameter, the literal is
+    preferred, though both are tried.
+    """
+
+    def __init__(self):
+        self.root = _TrieNode()
+
+    def add(self, pattern, value, priority=0):
+        """
+        Add the given URL pattern, which will match to the given value.
+        Where a URL matches several patterns, those with lower priorities
+        are returned first.
+        """
+        node = self.root
+        names = []
+        for component in path_components(pattern):
+            if is_parameter(component):
+                names.append(component[1:-1])
+                if node.parameter is None:
+                    node.parameter = _TrieNode()
+                node = node.parameter
+            else:
+                node = node.literals.setdefault(component, _TrieNode())
+        node.entries.append((priority, value, names))
+
+    def _match(self, node, components, index, captured, found):
+        """
+        Add to found a (priority, value, parameter names, parameter values)
+        tuple for every pattern below the given node which matches
+        the given URL components from the given index onward,
+        given the values of path parameters captured so far.
+        """
+        if index == len(components):
+            for (priority, value, names) in node.entries:
+                found.append((priority, value, names, list(captured)))
+            return
+        component = components[index]
+        child = node.literals.get(component)
+        if child is not None:
+            self._match(child, components, index + 1, captured, found)
+        if component and node.parameter is not None:
+            captured.append(component)
+            self._match(
+                node.parameter, components, index + 1, captured, found
+            )
+            captured.pop()
+
+    def match(self, url):
+        """
+        Return a list of (value, path parameters) tuples, one for each
+        pattern matching the given URL, ordered by priority,
+        then with patterns whose leading components are literal first.
+        Path parameters are returned as a dict mapping the names of
+        path parameters to the URL components which they matched.
+        """
+        found = []
+        self._match(self.root, path_components(url), 0, [], found)
+        found.sort(key=itemgetter(0))
+        return [
+            (value, dict(zip(names, values)))
+            for (_, value, names, values) in found
+        ]
+
+
+class Route(object):
+
+    """
+    A description, computed once when specifications are loaded, of how
+    requests using one HTTP method on one path of a specification are
+    handled: by the given operation, if any, which is handled by the
+    application method named handler_name, or else by refusing the
+    method. The allow attribute lists the HTTP methods allowed on the path,
+    including the synthesised OPTIONS method.
+    """
+
+    __slots__ = ('spec', 'path', 'operation', 'handler_name', 'allow')
+
+    def __init__(self, spec, path, operation):
+        self.spec = spec
+        self.path = path
+        self.operation = operation
+        if operation is None:
+            self.handler_name = None
+        else:
+            self.handler_name = 'operation_' + operation['operationId']
+        self.allow = [
+            method.upper() for method in spec.methods
+            if method != 'options' and method in path
+        ] + ['OPTIONS']
+
+
+class SwaggerRouter(object):
+
+    """
+    Finds the paths matching URLs in a set of Swagger specifications,
+    all of which are compiled into a single PathTrie when the router is
+    created, together with a Route for each operation of each path.
+    The results of the most recently used cache_size distinct
+    URLs are cached; a cache_size of 0 disables the cache.
+    """
+
+    DEFAULT_CACHE_SIZE = 1024
+
+    def __init__(self, specs, cache_size=DEFAULT_CACHE_SIZE):
+        self.trie = PathTrie()
+        for (priority, spec) in enumerate(specs):
+            for (pattern, pathdef) in spec.path_patterns():
+                # Routes by lower-case HTTP method, and for other methods
+                routes = dict(
+                    (method, Route(spec, pathdef, pathdef[method]))
+                    for method in spec.methods if method in pathdef
+                )
+                routes[None] = Route(spec, pathdef, None)
+                self.trie.add(pattern, (spec, pathdef, routes), priority)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _find(self, url):
+        """
+        Return a tuple of (specification, path definition, routes,
+        path parameters) tuples, one for each path matching the given URL,
+        in the order in which the specifications were given,
+        using the cache if possible.
+        """
+        if not self.cache_size:
+            return tuple(
+                value + (parameters,)
+                for (value, parameters) in self.trie.match(url)
+            )
+        with self.lock:
+            matches = self.cache.pop(url, None)
+            if matches is not None:
+                # Re-insert the matches to mark them most recently used
+                self.cache[url] = matches
+                return matches
+        matches = tuple(
+            value + (parameters,)
+            for (value, parameters) in self.trie.match(url)
+        )
+        with self.lock:
+            self.cache[url] = matches
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return matches
+
+    def find(self, url):
+        """
+        Return a list of (specification, path definition, path parameters)
+        tuples, one for each path matching the given URL, in the order
+        in which the specifications were given.
+        Each call returns new path parameter dictionaries, which the caller
+        may modify.
+        """
+        return [
+            (spec, pathdef, dict(parameters))
+            for (spec, pathdef, _, parameters) in self._find(url)
+        ]
+
+    def route(self, request_method, url):
+        """
+        Return a (Route, path parameters) tuple for a request using
+        the given HTTP method on the given URL. The Route is that of the
+        first matching path with an operation for the method, or if there
+        is none, a Route without an operation for the last matching path.
+        Return (None, None) if no path matches.
+        Each call returns a new path parameter dictionary, which the caller
+        may modify.
+        """
+        matches = self._find(url)
+        if not matches:
+            return (None, None)
+        request_method = request_method.lower()
+        for (_, _, routes, parameters) in matches:
+            if request_method in routes:
+                return (routes[request_method], dict(parameters))
+        (_, _, routes, parameters) = matches[-1]
+        return (routes[None], dict(parameters))
+
+
+class ExampleSpecification(object):
+
+    """
+    A stand-in for a SwaggerSpecification, for testing and benchmarking.
+    """
+
+    methods = ['get', 'put', 'post', 'delete', 'options', 'head', 'patch']
+
+    def __init__(self, base_path, paths):
+        self.base_path = base_path
+        self.paths = paths
+
+    def path_patterns(self):
+        """
+        Return a list of (URL pattern, path definition) tuples.
+        Each path has a GET operation named after the path.
+        """
+        return [
+            (self.base_path + path, dict(
+                path=path, get=dict(operationId=path)
+            )) for path in self.paths
+        ]
+
+
+class RouterTestCase(unittest.TestCase):
+
+    """
+    Tests the routing of URLs by PathTrie and SwaggerRouter.
+    """
+
+    # Silence warnings about the camelCase method names below.
+    # PyUnit requires such camelCase names.
+    # pylint: disable=C0103
+
+    def setUp(self):
+        self.versions = ExampleSpecification('', ['/'])
+        self.v1 = ExampleSpecification('/v1', [
+            '/reports', '/reports/{report}', '/reports/{report}/aggregate',
+            '/reports/special'
+        ])
+        self.router = SwaggerRouter([self.versions, self.v1])
+
+    def _paths(self, url):
+        """
+        Return a list of the (path, parameters) tuples matching the given URL.
+        """
+        return [
+            (pathdef['path'], parameters)
+            for (_, pathdef, parameters) in self.router.find(url)
+        ]
+
+    def testRoot(self):
+        """
+        Test that the root URL is routed, with or without a slash.
+        """
+        for url in ('', '/'):
+            self.assertEqual(self._paths(url), [('/', dict())])
+
+    def testLiteral(self):
+        """
+        Test routing to a path without parameters, ignoring
+        a trailing slash.
+        """
+        for url in ('/v1/reports', '/v1/reports/'):
+            self.assertEqual(self._paths(url), [('/reports', dict())])
+
+    def testParameter(self):
+        """
+        Test routing to paths with a parameter, which is extracted.
+        """
+        self.assertEqual(
+            self._paths('/v1/reports/usage'),
+            [('/reports/{report}', dict(report='usage'))]
+        )
+        self.assertEqual(
+            self._paths('/v1/reports/usage/aggregate'),
+            [('/reports/{report}/aggregate', dict(report='usage'))]
+        )
+
+    def testLiteralPreferred(self):
+        """
+        Test that a literal path segment is preferred to a parameter,
+        both of which match.
+        """
+        self.assertEqual(self._paths('/v1/reports/special'), [
+            ('/reports/special', dict()),
+            ('/reports/{report}', dict(report='special'))
+        ])
+
+    def testNoMatch(self):
+        """
+        Test that URLs matching no path are not routed.
+        """
+        for url in (
+            '/v2/reports', '/v1/reports/usage/other', '/v1//reports',
+            '/v1/reports//aggregate', 'v1/reports'
+        ):
+            self.assertEqual(self._paths(url), [])
+
+    def testSpecificationOrder(self):
+        """
+        Test that matches in earlier specifications are preferred.
+        """
+        other = ExampleSpecification('/v1', ['/{collection}/special'])
+        router = SwaggerRouter([other, self.v1])
+        self.assertEqual([
+            pathdef['path'] for (_, pathdef, _)
+            in router.find('/v1/reports/special')
+        ], ['/{collection}/special', '/reports/special', '/reports/{report}'])
+
+    def testAgreesWithScan(self):
+        """
+        Test that the path trie matches URLs exactly as testing each
+        path pattern in turn does.
+        """
+        # pylint: disable=W0212
+        patterns = ['/', '/v1/reports', '/v1/reports/{report}/aggregate']
+        for url in (
+            '', '/', '/v1', '/v1/reports/', '/v1/reports/x/aggregate/',
+            '/v1/reports//aggregate', '/v1/reports/x/y', '//'
+        ):
+            trie = PathTrie()
+            for pattern in patterns:
+                trie.add(pattern, pattern)
+            self.assertEqual(
+                [value for (value, _) in trie.match(url)],
+                [
+                    pattern for pattern in patterns if
+                    SwaggerSpecification._path_matches(pattern, url)[0]
+                ]
+            )
+
+    def testRoute(self):
+        """
+        Test routing a method and URL to an operation.
+        """
+        (route, parameters) = self.router.route('GET', '/v1/reports/usage')
+        self.assertEqual(route.path['path'], '/reports/{report}')
+        self.assertEqual(route.handler_name, 'operation_/reports/{report}')
+        self.assertEqual(route.allow, ['GET', 'OPTIONS'])
+        self.assertEqual(parameters, dict(report='usage'))
+
+    def testRouteMethodNotAllowed(self):
+        """
+        Test routing a URL to a path without the requested operation.
+        """
+        (route, parameters) = self.router.route('PUT', '/v1/reports/')
+        self.assertEqual(route.path['path'], '/reports')
+        self.assertEqual(route.operation, None)
+        self.assertEqual(route.handler_name, None)
+        self.assertEqual(parameters, dict())
+
+    def testRouteNotFound(self):
+        """
+        Test routing a URL which matches no path.
+        """
+        self.assertEqual(self.router.route('GET', '/v2'), (None, None))
+
+    def testCachedParametersAreCopies(self):
+        """
+        Test that changing the parameters of a routed URL
+        does not change those cached for it.
+        """
+        first = self.router.find('/v1/reports/usage')
+        first[0][2]['report'] = 'changed'
+        self.assertEqual(
+            self.router.find('/v1/reports/usage')[0][2],
+            dict(report='usage')
+        )
+
+    def testCacheSize(self):
+        """
+        Test that the least recently used URLs are evicted from the cache,
+        and that the cache can be disabled.
+        """
+        router = SwaggerRouter([self.v1], cache_size=2)
+        for name in ('a', 'b', 'c'):
+            router.find('/v1/reports/' + name)
+        self.assertEqual(
+            list(router.cache), ['/v1/reports/b', '/v1/reports/c']
+        )
+        uncached = SwaggerRouter([self.v1], cache_size=0)
+        self.assertEqual(len(uncached.find('/v1/reports/a')), 1)
+        self.assertEqual(len(uncached.cache), 0)
+
+
+def test_main():
+    """
+    Run the unit tests in this module.
+    """
+    unittest.main()
+
+
+def benchmark(repeat=3, number=2000):
+    """
+    Compare the time taken to route URLs by scanning every path,
+    as SwaggerSpecification.find_path did, with the time taken using
+    a SwaggerRouter with and without its cache, for specifications with
+    increasing numbers of synthetic paths, printing the best of several
+    timings, in microseconds per URL, for each.
+    """
+    for count in (10, 100, 1000, 5000):
+        spec = SwaggerSpecification(dict(
+            basePath='/v1',
+            paths=dict(
+                ('/collection%d/{item}/detail' % i, dict(get=dict(
+                    operationId='op%d' % i, responses={'200': dict()}
+                ))) for i in range(count)
+            )
+        ))
+        urls = [
+            '/v1/collection%d/item%d/detail' % (i * count // 10, i)
+            for i in range(10)
+        ]
+
+        def scan():
+            """
+            Route each URL by testing it against every path in turn.
+            """
+            # pylint: disable=W0212
+            for url in urls:
+                for (pattern, _) in spec.path_patterns():
+                    if spec._path_matches(pattern, url)[0]:
+                        break
+        routers = [
+            ('cached', SwaggerRouter([spec])),
+            ('uncached', SwaggerRouter([spec], cache_size=0))
+        ]
+        timings = [('scan', scan, max(1, number * 10 // count))] + [(
+            name,
+            lambda router=router: [router.route('GET', url) for url in urls],
+            number
+        ) for (name, router) in routers]
+        for (name, route, times) in timings:
+            elapsed = min(
+                timeit(route, number=times) for _ in range(repeat)
+            )
+            print('%d paths\t%s\t%.2fus' % (
+                count, name, elapsed * 1e6 / times / len(urls)
+            ))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+    else:
+        test_main()
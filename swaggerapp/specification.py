@@ -147,20 +147,15 @@ class SwaggerSpecification(object):
         """
         return self.spec['paths'].items()
 
-    def find_path(self, url):
+    def path_patterns(self):
         """
-        Find a path in this specification which matches the given URL.
-        Return that path if it exists, or a tuple of Nones if it does not.
+        Return a list of (URL pattern, path definition) tuples,
+        where each URL pattern is a path prefixed by the base path.
         """
         base_path = self._base_path()
-        for path, pathdef in self._paths():
-            logging.debug("BasePath: '%s'", base_path)
-            (matched, parameters) = self._path_matches(base_path + path, url)
-            if matched:
-                return (pathdef, parameters)
-            else:
-                logging.debug("Rejected URL '%s'", url)
-        return (None, None)
+        return [
+            (base_path + path, pathdef) for (path, pathdef) in self._paths()
+        ]
 
     @classmethod
     def find_operation(cls, pathdef, request_method):
@@ -5,8 +5,9 @@ Map URLs to Swagger operations and therefore to Python methods.
 """
 
 import json
-import logging
+import threading
 
+from swaggerapp.router import SwaggerRouter
 from swaggerapp.specification import SwaggerSpecification
 
 
@@ -20,11 +21,15 @@ class SwaggerMiddleware(object):
     """
     A WSGI URL router middleware that automatically configures itself
     using a set of Swagger JSON API specifications.
+    Each request is routed once, in a single lookup, to a Route describing
+    the matching specification, path and operation, and the name of the
+    Python method handling it; see _decorate_environment.
     """
 
-    def __init__(self, application, specs, cfg=None, **kw):
+    def __init__(self, application, specs, cfg=None, router=None, **kw):
         self.specs = specs
         self.application = application
+        self.router = router or SwaggerRouter(specs)
 
     def _decorate_environment(self, environ):
         """
@@ -32,45 +37,59 @@ class SwaggerMiddleware(object):
         decorate the request environment with additional information
         about the request found by examining the specification.
 
-        If the request matches an operation defined in the specification,
-        this information includes that operation and its parameters.
+        The 'swagger' key of the environment is set to a dict holding
+        the matching 'route', and for convenience its 'spec', 'path' and
+        'operation', together with the path 'parameters'. Each of these
+        is None if no path matches, and the operation is None if the path
+        has no operation for the request method.
+        A route already present in the environment is left alone.
         """
-        url = environ['SCRIPT_NAME'] + environ['PATH_INFO']
-        if 'swagger' in environ:
-            swagger = environ['swagger']
-        else:
-            swagger = environ['swagger'] = dict()
-        if 'path' in swagger:
-            pathdef = swagger['path']
+        swagger = environ.setdefault('swagger', dict())
+        if swagger.get('route') is not None:
+            return
+        (route, parameters) = self.router.route(
+            environ['REQUEST_METHOD'],
+            environ['SCRIPT_NAME'] + environ['PATH_INFO']
+        )
+        if route is None:
+            swagger.update(
+                route=None, spec=None, path=None, operation=None,
+                parameters=None
+            )
         else:
-            for spec in self.specs:
-                [pathdef, path_parameters] = spec.find_path(url)
-                if pathdef is not None:
-                    swagger['spec'] = spec
-                    swagger['path'] = pathdef
-                    swagger['parameters'] = path_parameters
-                    swagger['operation'] = spec.find_operation(
-                        pathdef, environ['REQUEST_METHOD']
-                    )
-                    if swagger['operation'] is not None:
-                        break
-        if 'spec' not in swagger:
-            swagger['spec'] = None
-        if 'path' not in swagger:
-            swagger['path'] = None
-        if 'parameters' not in swagger:
-            swagger['parameters'] = None
-        if 'operation' not in swagger:
-            swagger['operation'] = None
+            swagger.update(
+                route=route, spec=route.spec, path=route.path,
+                operation=route.operation, parameters=parameters
+            )
 
     def __call__(self, environ, start_response):
-        logging.debug("PATH_INFO: " + environ['PATH_INFO'])
-        logging.debug("SCRIPT_NAME: " + environ['SCRIPT_NAME'])
-        logging.debug(self.specs)
         self._decorate_environment(environ)
         return self.application(environ, start_response)
 
 
+# Routers by the tuple of names of the specification files they route,
+# so that filters configured with the same files share one router
+_ROUTERS = dict()
+_ROUTERS_LOCK = threading.Lock()
+
+
+def load_router(filenames):
+    """
+    Return a SwaggerRouter for the Swagger specifications in the given
+    files, which are read and compiled only the first time they are given.
+    """
+    filenames = tuple(filenames)
+    with _ROUTERS_LOCK:
+        if filenames not in _ROUTERS:
+            specs = [
+                SwaggerSpecification(
+                    json.loads(open(filename).read())
+                ) for filename in filenames
+            ]
+            _ROUTERS[filenames] = (specs, SwaggerRouter(specs))
+        return _ROUTERS[filenames]
+
+
 def factory(config, **settings):
     """
     Function that returns a function that returns
@@ -84,12 +103,8 @@ def factory(config, **settings):
         swagger_files = config.get('swagger_json')
         if not swagger_files:
             raise ValueError('No swagger_json specified')
-        specs = [
-            SwaggerSpecification(
-                json.loads(open(filename).read())
-            ) for filename in swagger_files.split()
-        ]
-        return SwaggerMiddleware(app, specs)
+        (specs, router) = load_router(swagger_files.split())
+        return SwaggerMiddleware(app, specs, router=router)
     return filter
 
 if __name__ == '__main__':
@@ -100,5 +115,5 @@ if __name__ == '__main__':
             open('reporting/conf/swagger_versions.json').read()
         )
     )
-    MIDDLEWARE = SwaggerMiddleware(APP, (SPEC))
+    MIDDLEWARE = SwaggerMiddleware(APP, [SPEC])
     print MIDDLEWARE